@@ -1,6 +1,13 @@
-from .graph import run_workout_planning_pipeline
+from .graph import (
+    arun_workout_planning_pipeline,
+    run_workout_planning_pipeline,
+    stream_workout_planning_pipeline,
+)
 from .state import WorkoutPlanResult
 
-__all__ = ['run_workout_planning_pipeline', 'WorkoutPlanResult']
-
-
+__all__ = [
+    'run_workout_planning_pipeline',
+    'arun_workout_planning_pipeline',
+    'stream_workout_planning_pipeline',
+    'WorkoutPlanResult',
+]
@@ -22,6 +22,13 @@ MUSCLE_TAXONOMY: Tuple[str, ...] = (
 )
 MUSCLE_TAXONOMY_SET = set(MUSCLE_TAXONOMY)
 
+# Nhóm cơ lớn (dùng cho hard constraints của weekly_focus_by_day)
+MAJOR_MUSCLES: Tuple[str, ...] = ("chest", "back", "quadriceps", "hamstrings", "hips")
+MAJOR_MUSCLE_SET = set(MAJOR_MUSCLES)
+
+# Số nhóm cơ tối đa/buổi theo days_per_week (1 = full body)
+MAX_MUSCLES_PER_DAY = {1: len(MUSCLE_TAXONOMY), 2: 5, 3: 4, 4: 3, 5: 2, 6: 2, 7: 2}
+
 GOAL_STYLE_ENUM: Tuple[str, ...] = (
     "health",
     "general_fitness",
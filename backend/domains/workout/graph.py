@@ -1,10 +1,11 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, Iterator
 
 from langgraph.graph import START, END, StateGraph
 
 from backend.core.audit import append_event
+from backend.shared.hedging import hedge_budget
 from backend.domains.workout.state import (
     WorkoutGraphState,
     init_workout_state,
@@ -15,24 +16,27 @@ from backend.domains.workout.state import (
 from backend.domains.workout import nodes as workout_nodes
 
 
-def build_workout_graph() -> StateGraph:
-    """Build workout planning graph (LangGraph StateGraph)."""
+def _build_graph(intent_fn: Any, prefetch_fn: Any, retrieval_fn: Any, plan_fn: Any) -> StateGraph:
     builder = StateGraph(WorkoutGraphState)
 
     # Nodes (logic nằm trong nodes.py)
     builder.add_node("profile", workout_nodes.node_profile)
     builder.add_node("constraints", workout_nodes.node_constraints)
-    builder.add_node("intent", workout_nodes.node_intent)        # <-- node intent chuẩn
-    builder.add_node("retrieval", workout_nodes.node_retrieval)
-    builder.add_node("plan", workout_nodes.node_plan)
+    builder.add_node("intent", intent_fn)        # <-- node intent chuẩn
+    builder.add_node("prefetch", prefetch_fn)
+    builder.add_node("retrieval", retrieval_fn)
+    builder.add_node("plan", plan_fn)
     builder.add_node("evaluate", workout_nodes.node_evaluate)
+    builder.add_node("repair", workout_nodes.node_repair)
     builder.add_node("enrich", workout_nodes.node_enrich)
 
     # Edges
     builder.add_edge(START, "profile")
     builder.add_edge("profile", "constraints")
+    # Fan-out: prefetch candidate pool chạy song song với intent (LLM), retrieval chờ cả hai
     builder.add_edge("constraints", "intent")
-    builder.add_edge("intent", "retrieval")
+    builder.add_edge("constraints", "prefetch")
+    builder.add_edge(["intent", "prefetch"], "retrieval")
     builder.add_edge("retrieval", "plan")
     builder.add_edge("plan", "evaluate")
 
@@ -41,16 +45,43 @@ def build_workout_graph() -> StateGraph:
         "evaluate",
         workout_nodes.route_after_eval,
         {
+            "repair": "repair",  # sửa cục bộ rồi evaluate lại
             "plan": "plan",      # retry
             "enrich": "enrich",  # finalize
         },
     )
+    builder.add_edge("repair", "evaluate")
     builder.add_edge("enrich", END)
 
     return builder.compile()
 
 
+def build_workout_graph() -> StateGraph:
+    """Build workout planning graph (LangGraph StateGraph)."""
+    return _build_graph(
+        workout_nodes.node_intent,
+        workout_nodes.node_prefetch,
+        workout_nodes.node_retrieval,
+        workout_nodes.node_plan,
+    )
+
+
+def build_workout_graph_async() -> StateGraph:
+    """
+    Cùng topology với build_workout_graph, nhưng các node I/O (intent, prefetch, retrieval, plan)
+    là coroutine: embedding + LLM call await trên event loop, không giữ worker thread.
+    Dùng với graph.ainvoke().
+    """
+    return _build_graph(
+        workout_nodes.anode_intent,
+        workout_nodes.anode_prefetch,
+        workout_nodes.anode_retrieval,
+        workout_nodes.anode_plan,
+    )
+
+
 _WORKOUT_GRAPH: StateGraph | None = None
+_WORKOUT_GRAPH_ASYNC: StateGraph | None = None
 
 
 def get_workout_graph() -> StateGraph:
@@ -61,15 +92,72 @@ def get_workout_graph() -> StateGraph:
     return _WORKOUT_GRAPH
 
 
-def run_workout_planning_pipeline(raw_input: Dict[str, Any]) -> WorkoutPlanResult:
-    """Main entry point cho workout planning."""
+def get_workout_graph_async() -> StateGraph:
+    global _WORKOUT_GRAPH_ASYNC
+    if _WORKOUT_GRAPH_ASYNC is None:
+        _WORKOUT_GRAPH_ASYNC = build_workout_graph_async()
+    return _WORKOUT_GRAPH_ASYNC
+
+
+def _init_pipeline_state(raw_input: Dict[str, Any]) -> WorkoutGraphState:
     init_state = init_workout_state(raw_input)
     init_state["audit"] = append_event(
         init_state.get("audit", {"events": [], "iterations": []}),
         "pipeline_start",
         {"raw_input": raw_input},
     )
+    return init_state
+
 
+def run_workout_planning_pipeline(raw_input: Dict[str, Any]) -> WorkoutPlanResult:
+    """Main entry point cho workout planning."""
     graph = get_workout_graph()
-    final_state = graph.invoke(init_state)
+    with hedge_budget():
+        final_state = graph.invoke(_init_pipeline_state(raw_input))
     return to_workout_result(final_state)
+
+
+async def arun_workout_planning_pipeline(
+    raw_input: Dict[str, Any], close_loop_clients: bool = False,
+) -> WorkoutPlanResult:
+    """
+    Entry point async (ASGI): await graph.ainvoke, các node sync còn lại chạy trong thread pool của LangGraph.
+    close_loop_clients=True khi event loop chỉ sống 1 request (view async dưới WSGI): đóng AsyncClient
+    LLM/embedding của loop trước khi return, tránh mỗi request bỏ lại 1 connection pool chưa đóng.
+    """
+    graph = get_workout_graph_async()
+    try:
+        with hedge_budget():
+            final_state = await graph.ainvoke(_init_pipeline_state(raw_input))
+    finally:
+        if close_loop_clients:
+            await workout_nodes.aclose_loop_clients()
+    return to_workout_result(final_state)
+
+
+def stream_workout_planning_pipeline(raw_input: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Chạy graph ở chế độ stream, yield event theo thứ tự:
+      - {"type": "node", "node": ..., "event": <audit event của node>} khi mỗi node xong
+      - {"type": "day", "iteration": ..., "index": ..., "day": <DayPlan đã enrich>} khi LLM sinh xong 1 ngày
+      - {"type": "result", "result": WorkoutPlanResult} ở cuối
+    """
+    graph = get_workout_graph()
+    final_state: Dict[str, Any] = {}
+
+    with hedge_budget():
+        for mode, chunk in graph.stream(
+            _init_pipeline_state(raw_input),
+            config={"configurable": {"stream_days": True}},
+            stream_mode=["updates", "custom", "values"],
+        ):
+            if mode == "values":
+                final_state = chunk
+            elif mode == "custom":
+                yield chunk
+            elif mode == "updates":
+                for node, update in chunk.items():
+                    events = ((update or {}).get("audit") or {}).get("events") or []
+                    yield {"type": "node", "node": node, "event": events[-1] if events else None}
+
+    yield {"type": "result", "result": to_workout_result(final_state)}
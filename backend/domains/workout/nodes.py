@@ -1,31 +1,72 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+import asyncio
+from typing import Any, Dict, List
+
 from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
 
 from backend.core.audit import append_event, append_iteration
 from backend.domains.workout.state import WorkoutGraphState
 from backend.domains.workout.services.profile import normalize_profile
 from backend.domains.workout.services.constraints import build_constraints
-from backend.domains.workout.services.retrieval import build_candidate_pack, candidate_pack_to_documents
+from backend.domains.workout.services.retrieval import (
+    RETRIEVAL_PREFETCH,
+    abuild_candidate_pack,
+    aprefetch_candidate_pool,
+    build_candidate_pack,
+    candidate_pack_to_documents,
+    prefetch_candidate_pool,
+)
 from backend.domains.workout.services.evaluation import evaluate_plan
-from backend.domains.workout.services.formatting import enrich_plan
+from backend.domains.workout.services.formatting import enrich_day, enrich_plan
+from backend.domains.workout.services.intent_rules import INTENT_FAST_PATH, match_intent_rules
+from backend.domains.workout.services.repair import can_repair, repair_plan
+from backend.domains.workout.services.speculative import (
+    agenerate_plan_speculative,
+    generate_plan_speculative,
+    speculative_k,
+)
+from backend.domains.workout.services.template_plan import PLAN_FALLBACK, PLAN_MODE, generate_template_plan
 from backend.domains.workout.services.planning import (
+    PLAN_GENERATION_SCOPE,
+    agenerate_plan_by_day_with_llm,
+    agenerate_plan_with_llm,
+    aparse_intent_internal_goal_with_llm,
+    aregenerate_days_with_llm,
+    generate_plan_by_day_with_llm,
     generate_plan_with_llm,
+    intent_cache_hit,
+    issue_day_indexes,
     parse_intent_internal_goal_with_llm,
+    regenerate_days_with_llm,
+    stream_plan_with_llm,
 )
 
+from backend.services.embedding_service import aclose_async_client
 from backend.shared.llm import LLMClient
+from backend.shared.llm.metrics import llm_call_scope, llm_calls_payload, summarize_llm_calls
 
 # Tạo 1 instance dùng lại (đỡ overhead)
 _LLM = LLMClient()
 
 
+async def aclose_loop_clients() -> None:
+    """Đóng client async (LLM + embedding) của event loop đang chạy; dùng khi loop chỉ sống 1 request (WSGI)."""
+    await _LLM.aclose_loop_clients()
+    await aclose_async_client()
+
+
 def node_profile(state: WorkoutGraphState) -> Dict[str, Any]:
     raw_input = state["raw_input"]
     profile = normalize_profile(raw_input)
-    audit = append_event(state["audit"], "profile_done", {"profile": profile})
-    return {"profile": profile, "audit": audit}
+    plan_mode = (raw_input.get("plan_mode") or PLAN_MODE).lower()
+    spec_k = speculative_k(raw_input.get("speculative_k"))
+    audit = append_event(
+        state["audit"], "profile_done", {"profile": profile, "plan_mode": plan_mode, "speculative_k": spec_k}
+    )
+    return {"profile": profile, "plan_mode": plan_mode, "speculative_k": spec_k, "audit": audit}
 
 
 def node_constraints(state: WorkoutGraphState) -> Dict[str, Any]:
@@ -35,8 +76,62 @@ def node_constraints(state: WorkoutGraphState) -> Dict[str, Any]:
     return {"constraints": constraints, "max_iter": max_iter, "audit": audit}
 
 
+def node_prefetch(state: WorkoutGraphState) -> Dict[str, Any]:
+    """
+    Chạy song song với intent (fan-out sau constraints): lấy trước candidate pool theo taxonomy
+    để retrieval chỉ cắt theo priority_muscles. Chỉ ghi prefetch_pool (không ghi audit: intent cùng
+    superstep cũng ghi audit); lỗi → None, retrieval truy vấn như cũ.
+    """
+    if not _should_prefetch(state):
+        return {"prefetch_pool": None}
+    try:
+        return {"prefetch_pool": prefetch_candidate_pool(state["profile"])}
+    except Exception as e:
+        print(f"[PREFETCH] failed: {e}")
+        return {"prefetch_pool": None}
+
+
+async def anode_prefetch(state: WorkoutGraphState) -> Dict[str, Any]:
+    if not await asyncio.to_thread(_should_prefetch, state):
+        return {"prefetch_pool": None}
+    try:
+        return {"prefetch_pool": await aprefetch_candidate_pool(state["profile"])}
+    except Exception as e:
+        print(f"[PREFETCH] failed: {e}")
+        return {"prefetch_pool": None}
+
+
+def _should_prefetch(state: WorkoutGraphState) -> bool:
+    """
+    Không prefetch khi intent không gọi LLM (đã có internal_goal / rule fast path trúng /
+    prompt cache hoặc semantic intent cache trùng text): không có latency để ẩn.
+    Gate chỉ tra cache exact, không embed (tránh thêm 1 call embedding trước intent).
+    """
+    if RETRIEVAL_PREFETCH != "on":
+        return False
+    profile = state.get("profile") or {}
+    if state.get("internal_goal") or profile.get("internal_goal"):
+        return False
+    if INTENT_FAST_PATH == "rules" and match_intent_rules(profile).accepted:
+        return False
+    try:
+        return not intent_cache_hit(_LLM, profile)
+    except Exception as e:
+        print(f"[PREFETCH] intent cache check failed: {e}")
+        return True
+
+
 def node_retrieval(state: WorkoutGraphState) -> Dict[str, Any]:
-    candidates = build_candidate_pack(state["profile"], state["constraints"])
+    candidates = build_candidate_pack(state["profile"], state["constraints"], pool=state.get("prefetch_pool"))
+    return _retrieval_update(state, candidates)
+
+
+async def anode_retrieval(state: WorkoutGraphState) -> Dict[str, Any]:
+    candidates = await abuild_candidate_pack(state["profile"], state["constraints"], pool=state.get("prefetch_pool"))
+    return _retrieval_update(state, candidates)
+
+
+def _retrieval_update(state: WorkoutGraphState, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
     documents = candidate_pack_to_documents(candidates)
 
     print("[PIPELINE] build_candidate_pack_fn: workout.domains.workout.services.retrieval.build_candidate_pack")
@@ -44,7 +139,11 @@ def node_retrieval(state: WorkoutGraphState) -> Dict[str, Any]:
     print("[PIPELINE] candidate_sample_ids:", [c["id"] for c in candidates[:10]])
 
     candidate_ids = {c["id"] for c in candidates if c.get("id") is not None}
-    audit = append_event(state["audit"], "retrieval_done", {"candidate_count": len(candidates)})
+    audit = append_event(
+        state["audit"],
+        "retrieval_done",
+        {"candidate_count": len(candidates), "prefetched": bool(state.get("prefetch_pool"))},
+    )
 
     return {
         "documents": documents,
@@ -56,6 +155,7 @@ def node_retrieval(state: WorkoutGraphState) -> Dict[str, Any]:
 def node_intent(state: WorkoutGraphState) -> Dict[str, Any]:
     """
     Intent → Internal Goal:
+      - thử rule-based fast path trước (intent_rules); chỉ gọi LLM khi confidence thấp
       - sinh internal_goal (structured)
       - lưu vào state["internal_goal"] và profile["internal_goal"]
       - nếu fail: warning + audit, không block pipeline (retrieval fallback taxonomy)
@@ -68,13 +168,72 @@ def node_intent(state: WorkoutGraphState) -> Dict[str, Any]:
     if state.get("internal_goal") or profile.get("internal_goal"):
         return {}
 
-    internal_goal = parse_intent_internal_goal_with_llm(_LLM, profile)
+    state = _intent_fast_path(state, profile)
+    if state.get("internal_goal"):
+        return _intent_update(state, profile, state["internal_goal"], [], source="rules")
+
+    with llm_call_scope("intent") as calls:
+        internal_goal = parse_intent_internal_goal_with_llm(_LLM, profile)
+    return _intent_update(state, profile, internal_goal, calls)
+
+
+async def anode_intent(state: WorkoutGraphState) -> Dict[str, Any]:
+    """Bản async của node_intent (LLM call qua ainvoke)."""
+    profile = state.get("profile") or {}
+    if not profile:
+        return {}
+
+    if state.get("internal_goal") or profile.get("internal_goal"):
+        return {}
+
+    state = _intent_fast_path(state, profile)
+    if state.get("internal_goal"):
+        return _intent_update(state, profile, state["internal_goal"], [], source="rules")
+
+    with llm_call_scope("intent") as calls:
+        internal_goal = await aparse_intent_internal_goal_with_llm(_LLM, profile)
+    return _intent_update(state, profile, internal_goal, calls)
+
+
+def _intent_fast_path(state: WorkoutGraphState, profile: Dict[str, Any]) -> WorkoutGraphState:
+    """
+    Thử map goal_text bằng rule (services/intent_rules.py) trước khi gọi LLM.
+    Trả state có audit "intent_rules" (đo tỉ lệ trúng) và internal_goal nếu rule đủ tin cậy.
+    """
+    if INTENT_FAST_PATH != "rules":
+        return state
+
+    result = match_intent_rules(profile)
+    print(f"[INTENT_RULES] confidence={result.confidence} reason={result.reason} accepted={result.accepted}")
+
+    audit = append_event(
+        state.get("audit", {"events": [], "iterations": []}),
+        "intent_rules",
+        {"confidence": result.confidence, "reason": result.reason, "accepted": result.accepted},
+    )
+    return {**state, "audit": audit, "internal_goal": result.internal_goal if result.accepted else None}
+
+
+def _append_llm_calls(audit: Dict[str, Any], calls: List[Any]) -> Dict[str, Any]:
+    if not calls:
+        return audit
+    return append_event(audit, "llm_calls", {"calls": llm_calls_payload(calls)})
+
+
+def _intent_update(
+    state: WorkoutGraphState,
+    profile: Dict[str, Any],
+    internal_goal: Dict[str, Any],
+    calls: List[Any],
+    source: str = "llm",
+) -> Dict[str, Any]:
+    print("[INTENT] source:", source)
     print("[INTENT] goal_style:", internal_goal.get("goal_style"))
     print("[INTENT] priority_muscles:", internal_goal.get("priority_muscles"))
     print("[INTENT] weekly_focus_by_day:", internal_goal.get("weekly_focus_by_day"))
 
 
-    audit = state.get("audit", {"events": [], "iterations": []})
+    audit = _append_llm_calls(state.get("audit", {"events": [], "iterations": []}), calls)
     warnings = list(state.get("warnings", []))
 
     # planning.py có thể trả dict chứa error_type khi validate fail
@@ -103,6 +262,7 @@ def node_intent(state: WorkoutGraphState) -> Dict[str, Any]:
         audit,
         "intent_done",
         {
+            "source": source,
             "goal_style": internal_goal.get("goal_style") if isinstance(internal_goal, dict) else None,
             "priority_muscles": internal_goal.get("priority_muscles") if isinstance(internal_goal, dict) else None,
         },
@@ -113,14 +273,12 @@ def node_intent(state: WorkoutGraphState) -> Dict[str, Any]:
     return {"audit": audit, "internal_goal": internal_goal, "profile": p2}
 
 
-def node_plan(state: WorkoutGraphState) -> Dict[str, Any]:
+def _plan_kwargs(state: WorkoutGraphState) -> Dict[str, Any]:
     iteration = int(state.get("iteration", 0))
 
-    audit = append_iteration(state["audit"], iteration)
-
     print("[PIPELINE] candidates_len_before_llm:", len(state.get("candidates", [])))
 
-    draft = generate_plan_with_llm(
+    return dict(
         llm=_LLM,
         profile=state["profile"],
         constraints=state["constraints"],
@@ -130,8 +288,167 @@ def node_plan(state: WorkoutGraphState) -> Dict[str, Any]:
         prev_plan=(state["draft_plan"] if iteration > 0 else None),
     )
 
-    audit = append_event(audit, "draft_done", {"iteration": iteration})
-    return {"draft_plan": draft, "audit": audit}
+
+def _regen_days(kwargs: Dict[str, Any]) -> List[int]:
+    """
+    Vòng sửa mà mọi issue đều gắn với ngày cụ thể (và không phải cả tuần): chỉ sinh lại các ngày đó.
+    Trả [] nếu phải sinh lại cả plan.
+    """
+    prev_plan = kwargs.get("prev_plan")
+    day_indexes = issue_day_indexes(kwargs.get("issues"), prev_plan)
+    if not day_indexes or len(day_indexes) >= len((prev_plan or {}).get("days") or []):
+        return []
+    return day_indexes
+
+
+def _regen_kwargs(kwargs: Dict[str, Any], day_indexes: List[int]) -> Dict[str, Any]:
+    out = {k: v for k, v in kwargs.items() if k != "documents"}
+    out["day_indexes"] = day_indexes
+    return out
+
+
+def _speculative_kwargs(state: WorkoutGraphState, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Lần sinh đầu với speculative_k > 1: K plan song song, plan sạch đầu tiên thắng. {} nếu không dùng."""
+    k = int(state.get("speculative_k") or 1)
+    if k <= 1 or kwargs.get("prev_plan") is not None:
+        return {}
+    out = {key: kwargs[key] for key in ("llm", "profile", "constraints", "candidates", "documents")}
+    out["k"] = k
+    return out
+
+
+def _speculative_draft(spec: Any, on_day: Any = None) -> Dict[str, Any]:
+    print(f"[PLAN] speculative winner={spec.variant} issues={len(spec.issues)} finished={spec.finished}/{spec.k}")
+    if on_day is not None and not spec.plan.get("error_type"):
+        for i, day in enumerate(spec.plan.get("days") or []):
+            on_day(i, day)
+    return spec.plan
+
+
+def _speculative_payload(spec: Any) -> Dict[str, Any]:
+    return {
+        "k": spec.k,
+        "winner": spec.variant,
+        "issues": len(spec.issues),
+        "finished": spec.finished,
+        "failed": spec.failed,
+    }
+
+
+def _by_day_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Lần sinh đầu với PLAN_GENERATION_SCOPE=day: mỗi buổi 1 call song song. {} nếu dùng call cả tuần."""
+    if PLAN_GENERATION_SCOPE != "day" or kwargs.get("prev_plan") is not None:
+        return {}
+    return {k: kwargs[k] for k in ("llm", "profile", "constraints", "candidates")}
+
+
+def _plan_update(
+    state: WorkoutGraphState,
+    draft: Dict[str, Any],
+    calls: List[Any],
+    source: str = "llm",
+    regen_days: Any = None,
+    speculative: Any = None,
+) -> Dict[str, Any]:
+    iteration = int(state.get("iteration", 0))
+    audit = append_iteration(state["audit"], iteration)
+    audit = _append_llm_calls(audit, calls)
+    payload = {"iteration": iteration, "source": source}
+    if regen_days:
+        payload["regenerated_days"] = regen_days
+    if speculative is not None:
+        payload["speculative"] = _speculative_payload(speculative)
+    audit = append_event(audit, "draft_done", payload)
+    return {"draft_plan": draft, "plan_source": source, "repaired": False, "audit": audit}
+
+
+def _template_update(
+    state: WorkoutGraphState,
+    calls: List[Any],
+    reason: str,
+    on_day: Any = None,
+) -> Dict[str, Any]:
+    """Draft từ template_plan (plan_mode=template hoặc degrade khi LLM lỗi)."""
+    print(f"[PLAN] template plan ({reason})")
+    draft = generate_template_plan(state["profile"], state["constraints"], state.get("candidates", []) or [], on_day=on_day)
+    update = _plan_update(state, draft, calls, source="template")
+    if reason != "plan_mode":
+        update["audit"] = append_event(update["audit"], "plan_degraded", {"reason": reason})
+    return update
+
+
+def node_plan(state: WorkoutGraphState, config: RunnableConfig) -> Dict[str, Any]:
+    # configurable.stream_days=True (endpoint SSE): stream từng DayPlan qua custom stream
+    on_day = _day_writer(state) if (config.get("configurable") or {}).get("stream_days") else None
+    if state.get("plan_mode") == "template":
+        return _template_update(state, [], "plan_mode", on_day=on_day)
+
+    kwargs = _plan_kwargs(state)
+    regen = _regen_days(kwargs)
+    speculative = _speculative_kwargs(state, kwargs)
+    by_day = _by_day_kwargs(kwargs)
+    spec = None
+    with llm_call_scope("plan", int(state.get("iteration", 0))) as calls:
+        try:
+            if regen:
+                draft = regenerate_days_with_llm(on_day=on_day, **_regen_kwargs(kwargs, regen))
+            elif speculative:
+                spec = generate_plan_speculative(**speculative)
+                draft = _speculative_draft(spec, on_day)
+            elif by_day:
+                draft = generate_plan_by_day_with_llm(on_day=on_day, **by_day)
+            elif on_day is not None:
+                draft = stream_plan_with_llm(on_day=on_day, **kwargs)
+            else:
+                draft = generate_plan_with_llm(**kwargs)
+        except Exception as e:
+            if PLAN_FALLBACK != "template":
+                raise
+            return _template_update(state, calls, f"llm_error: {e}", on_day=on_day)
+    return _plan_update(state, draft, calls, regen_days=regen, speculative=spec)
+
+
+def _day_writer(state: WorkoutGraphState) -> Any:
+    writer = get_stream_writer()
+    iteration = int(state.get("iteration", 0))
+    candidates = state.get("candidates", []) or []
+
+    def on_day(index: int, day: Dict[str, Any]) -> None:
+        writer({
+            "type": "day",
+            "iteration": iteration,
+            "index": index,
+            "day": enrich_day(day, candidates),
+        })
+
+    return on_day
+
+
+async def anode_plan(state: WorkoutGraphState) -> Dict[str, Any]:
+    if state.get("plan_mode") == "template":
+        return _template_update(state, [], "plan_mode")
+
+    kwargs = _plan_kwargs(state)
+    regen = _regen_days(kwargs)
+    speculative = _speculative_kwargs(state, kwargs)
+    by_day = _by_day_kwargs(kwargs)
+    spec = None
+    with llm_call_scope("plan", int(state.get("iteration", 0))) as calls:
+        try:
+            if regen:
+                draft = await aregenerate_days_with_llm(**_regen_kwargs(kwargs, regen))
+            elif speculative:
+                spec = await agenerate_plan_speculative(**speculative)
+                draft = _speculative_draft(spec)
+            elif by_day:
+                draft = await agenerate_plan_by_day_with_llm(**by_day)
+            else:
+                draft = await agenerate_plan_with_llm(**kwargs)
+        except Exception as e:
+            if PLAN_FALLBACK != "template":
+                raise
+            return _template_update(state, calls, f"llm_error: {e}")
+    return _plan_update(state, draft, calls, regen_days=regen, speculative=spec)
 
 
 def node_evaluate(state: WorkoutGraphState) -> Dict[str, Any]:
@@ -161,18 +478,42 @@ def node_evaluate(state: WorkoutGraphState) -> Dict[str, Any]:
     })
 
     # Nếu còn issues và chưa tới lần cuối, tăng iteration để plan node chạy vòng sửa tiếp
+    # (repair cục bộ không tính là 1 vòng LLM)
     next_iteration = iteration
-    if issues and iteration < max_iter:
+    if issues and iteration < max_iter and not _should_repair(state, issues):
         next_iteration = iteration + 1
 
     return {"issues": issues, "warnings": warnings, "iteration": next_iteration, "audit": audit}
 
 
 
+def _should_repair(state: WorkoutGraphState, issues: List[Dict[str, Any]]) -> bool:
+    """Mỗi draft chỉ repair 1 lần; issue còn lại sau repair mới quay lại LLM."""
+    return not state.get("repaired") and can_repair(issues)
+
+
+def node_repair(state: WorkoutGraphState) -> Dict[str, Any]:
+    """Sửa issue cơ học (id ngoài pack, thừa/thiếu bài) bằng code, rồi quay lại evaluate."""
+    draft, actions = repair_plan(
+        state.get("draft_plan") or {},
+        state.get("candidates", []) or [],
+        state["profile"],
+        state["constraints"],
+    )
+    print("[REPAIR] actions:", actions)
+    audit = append_event(state["audit"], "repair_done", {
+        "iteration": int(state.get("iteration", 0)),
+        "issues": [i.get("type") for i in state.get("issues", []) if isinstance(i, dict)],
+        "actions": actions,
+    })
+    return {"draft_plan": draft, "repaired": True, "audit": audit}
+
+
 def route_after_eval(state: WorkoutGraphState) -> str:
     """
     Quy tắc dừng đúng như orchestrator cũ:
     - Nếu không còn issues: kết thúc và enrich
+    - Nếu có issue sửa được bằng code và draft chưa repair: repair (không tốn LLM call)
     - Nếu còn issues nhưng đã ở attempt cuối (iteration == max_iter): enrich (stop)
     - Nếu còn issues và vẫn còn lượt sửa: quay lại plan
     """
@@ -182,14 +523,20 @@ def route_after_eval(state: WorkoutGraphState) -> str:
 
     if not issues:
         return "enrich"
+    if _should_repair(state, issues):
+        return "repair"
     if iteration >= max_iter:
         return "enrich"
+    # Template deterministic: chạy lại cho ra đúng plan cũ, không có gì để sửa
+    if state.get("plan_source") == "template":
+        return "enrich"
     return "plan"
 
 
 def node_enrich(state: WorkoutGraphState) -> Dict[str, Any]:
     final_plan = enrich_plan(state["draft_plan"] or {}, state["candidates"])
-    audit = append_event(state["audit"], "pipeline_end", {
+    audit = append_event(state["audit"], "llm_summary", summarize_llm_calls(state["audit"].get("events", [])))
+    audit = append_event(audit, "pipeline_end", {
         "issues": len(state.get("issues", [])),
         "warnings": len(state.get("warnings", []))
     })
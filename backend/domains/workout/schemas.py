@@ -3,9 +3,10 @@ from __future__ import annotations
 from enum import Enum
 from typing import List
 
-from pydantic import BaseModel, ConfigDict, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 
-from backend.domains.workout.contract import MUSCLE_TAXONOMY, GOAL_STYLE_ENUM
+from backend.domains.workout.contract import MUSCLE_ALIASES, MUSCLE_TAXONOMY, GOAL_STYLE_ENUM
+from backend.shared.llm.salvage import register_enum_aliases
 
 
 # ============================================================
@@ -33,6 +34,42 @@ class WorkoutPlan(BaseModel):
     days: List[DayPlan]
 
 
+# ============================================================
+# Compact plan schema (PLAN_OUTPUT_FORMAT=compact)
+#   - mỗi bài là 1 string "id|sets|reps|rest_sec" (tùy chọn thêm "|notes")
+#   - goal/days_per_week/session_minutes không bắt LLM lặp lại, server điền từ profile
+# ============================================================
+
+def parse_compact_exercise(row: str) -> ExerciseItem:
+    parts = [p.strip() for p in str(row).split("|", 4)]
+    if len(parts) < 4:
+        raise ValueError(f"compact exercise cần dạng id|sets|reps|rest_sec, nhận: {row!r}")
+    return ExerciseItem(
+        exercise_id=int(parts[0]),
+        sets=int(parts[1]),
+        reps=parts[2],
+        rest_sec=int(parts[3]),
+        notes=parts[4] if len(parts) > 4 else "",
+    )
+
+
+class CompactDayPlan(BaseModel):
+    day: str
+    ex: List[str]
+
+    @field_validator("ex")
+    @classmethod
+    def _check_rows(cls, v: List[str]) -> List[str]:
+        for row in v:
+            parse_compact_exercise(row)
+        return v
+
+
+class CompactWorkoutPlan(BaseModel):
+    split: str
+    days: List[CompactDayPlan]
+
+
 # ============================================================
 # Intent → Internal Goal schema (LLM structured output)
 # ============================================================
@@ -78,6 +115,9 @@ class TrainingDayEnum(str, Enum):
 assert tuple(m.value for m in MuscleEnum) == MUSCLE_TAXONOMY, "MuscleEnum lệch MUSCLE_TAXONOMY"
 assert tuple(g.value for g in GoalStyleEnum) == GOAL_STYLE_ENUM, "GoalStyleEnum lệch GOAL_STYLE_ENUM"
 
+# Output LLM lỗi enum (vd "glutes") được sửa tại chỗ theo alias của contract thay vì retry
+register_enum_aliases(MuscleEnum, MUSCLE_ALIASES)
+
 
 class MuscleRankItem(BaseModel):
     model_config = ConfigDict(extra="forbid", use_enum_values=True)
@@ -16,6 +16,13 @@ def _norm(s: Any) -> str:
     return str(s or "").strip().lower()
 
 
+def _as_int(v: Any) -> Optional[int]:
+    try:
+        return int(v)
+    except Exception:
+        return None
+
+
 def _canonicalize_muscle(m: str) -> str:
     m = _norm(m)
     # Backward compatibility
@@ -122,6 +129,7 @@ def evaluate_plan(
     Evaluation policy (updated):
       - Validate exercise_id must be within candidate pack
       - Respect min/max exercises per day from constraints
+      - Cross-day: same exercise across days within max_repeat_same_exercise_per_week
       - Duration warning if estimate > session_minutes
       - Rank1 is ONLY a muscle-level concept in weekly_focus_by_day.
         We DO NOT cap the number of exercises hitting rank1 muscle.
@@ -144,17 +152,19 @@ def evaluate_plan(
     # ------------------------
     # 0) Candidate id-only
     # ------------------------
+    # Issue gắn "day" (nhãn ngày trong plan) để có thể sửa riêng ngày đó
     for d in draft_plan.get("days", []) or []:
+        label = d.get("day") or d.get("training_day")
         for ex in d.get("exercises", []) or []:
             eid = ex.get("exercise_id")
             try:
                 eid_int = int(eid)
             except Exception:
-                issues.append({"type": "invalid_exercise_id", "detail": f"exercise_id không hợp lệ: {eid}"})
+                issues.append({"type": "invalid_exercise_id", "day": label, "detail": f"exercise_id không hợp lệ: {eid}"})
                 continue
 
             if eid_int not in candidate_ids:
-                issues.append({"type": "invalid_exercise_id", "detail": f"exercise_id={eid_int} không nằm trong candidate pack"})
+                issues.append({"type": "invalid_exercise_id", "day": label, "detail": f"exercise_id={eid_int} không nằm trong candidate pack"})
 
     # ------------------------
     # 1) Min/Max exercises per day
@@ -175,11 +185,36 @@ def evaluate_plan(
     for d in draft_plan.get("days", []) or []:
         n = len(d.get("exercises", []) or [])
         label = d.get("training_day") or d.get("day") or "day"
+        day = d.get("day") or d.get("training_day")
 
         if min_ex_n is not None and n < min_ex_n:
-            issues.append({"type": "too_few_exercises", "detail": f"{label} ít hơn {min_ex_n} bài (={n})"})
+            issues.append({"type": "too_few_exercises", "day": day, "detail": f"{label} ít hơn {min_ex_n} bài (={n})"})
         if max_ex_n is not None and n > max_ex_n:
-            issues.append({"type": "too_many_exercises", "detail": f"{label} nhiều hơn {max_ex_n} bài (={n})"})
+            issues.append({"type": "too_many_exercises", "day": day, "detail": f"{label} nhiều hơn {max_ex_n} bài (={n})"})
+
+    # ------------------------
+    # 1b) Cross-day: lặp bài trong tuần
+    #     max_repeat_same_exercise_per_week = số lần được lặp lại thêm (1 → 1 bài xuất hiện tối đa 2 buổi).
+    #     Issue gắn vào ngày có lần xuất hiện vượt giới hạn.
+    # ------------------------
+    try:
+        max_repeat = constraints.get("max_repeat_same_exercise_per_week")
+        max_repeat_n = int(max_repeat) if max_repeat is not None else None
+    except Exception:
+        max_repeat_n = None
+
+    if max_repeat_n is not None:
+        seen_count: Dict[int, int] = {}
+        for d in draft_plan.get("days", []) or []:
+            day = d.get("day") or d.get("training_day")
+            for eid in {_as_int(ex.get("exercise_id")) for ex in d.get("exercises", []) or []} - {None}:
+                seen_count[eid] = seen_count.get(eid, 0) + 1
+                if seen_count[eid] > max_repeat_n + 1:
+                    issues.append({
+                        "type": "exercise_repeated",
+                        "day": day,
+                        "detail": f"exercise_id={eid} xuất hiện {seen_count[eid]} buổi/tuần, tối đa {max_repeat_n + 1}",
+                    })
 
     # ------------------------
     # 2) Duration warnings
@@ -1,25 +1,50 @@
 from __future__ import annotations
 from typing import Any, Dict, List
 
+from backend.domains.workout.schemas import WorkoutPlan, parse_compact_exercise
+
+
+def _enrich_day(d: Dict[str, Any], lookup: Dict[Any, Dict[str, Any]]) -> Dict[str, Any]:
+    ex_out = []
+    for ex in d.get("exercises", []):
+        eid = ex["exercise_id"]
+        meta = lookup.get(eid, {})
+        ex_out.append({
+            **ex,
+            "title": meta.get("title"),
+            "muscle_groups": meta.get("muscle_groups", []),
+            "image_url": meta.get("image_url"),
+            "image_file": meta.get("image_file"),
+        })
+    return {"day": d.get("day"), "exercises": ex_out}
+
+
+def enrich_day(day: Dict[str, Any], candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Enrich 1 DayPlan (dùng khi stream từng ngày)."""
+    return _enrich_day(day, {c["id"]: c for c in candidates})
+
 
 def enrich_plan(draft_plan: Dict[str, Any], candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
     lookup = {c["id"]: c for c in candidates}
-    days_out = []
-
-    for d in draft_plan.get("days", []):
-        ex_out = []
-        for ex in d.get("exercises", []):
-            eid = ex["exercise_id"]
-            meta = lookup.get(eid, {})
-            ex_out.append({
-                **ex,
-                "title": meta.get("title"),
-                "muscle_groups": meta.get("muscle_groups", []),
-                "image_url": meta.get("image_url"),
-                "image_file": meta.get("image_file"),
-            })
-        days_out.append({"day": d.get("day"), "exercises": ex_out})
-
+    days_out = [_enrich_day(d, lookup) for d in draft_plan.get("days", [])]
     return {**draft_plan, "days": days_out}
 
 
+def expand_compact_day(day: Dict[str, Any]) -> Dict[str, Any]:
+    """CompactDayPlan -> DayPlan dict."""
+    return {
+        "day": day.get("day"),
+        "exercises": [parse_compact_exercise(row).model_dump(mode="json") for row in day.get("ex") or []],
+    }
+
+
+def expand_compact_plan(compact: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """CompactWorkoutPlan -> WorkoutPlan dict (field lặp lại lấy từ profile), validate lại theo WorkoutPlan."""
+    plan = {
+        "goal": profile.get("goal_text") or "",
+        "days_per_week": profile.get("days_per_week"),
+        "session_minutes": profile.get("session_minutes"),
+        "split": compact.get("split") or "",
+        "days": [expand_compact_day(d) for d in compact.get("days") or []],
+    }
+    return WorkoutPlan.model_validate(plan).model_dump(mode="json")
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import copy
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from backend.domains.workout.services.intent_rules import fold_text, goal_phrases, needs_context
+from backend.services.embedding_service import embed_texts
+
+# Cache intent theo nghĩa của goal_text thay vì hash cả prompt (prompt chứa user_id, cân nặng, số đo...):
+# goal diễn đạt khác nhưng cùng ý ("muốn giảm mỡ bụng" / "giảm mỡ bụng") + cùng days_per_week,
+# training_days, experience, cùng tập goal/nhóm cơ từ điển intent_rules đọc được → dùng lại IntentInternalGoal.
+# on = bật | off = chỉ cache theo hash prompt như cũ
+INTENT_SEMANTIC_CACHE = (os.getenv("INTENT_SEMANTIC_CACHE") or "on").lower()
+# Cosine tối thiểu giữa embedding goal_text (đã normalize) để coi là cùng ý
+INTENT_SEMANTIC_THRESHOLD = float(os.getenv("INTENT_SEMANTIC_THRESHOLD") or 0.92)
+# LRU giới hạn số entry trong process; entry hết hạn sau TTL
+INTENT_SEMANTIC_CACHE_SIZE = max(1, int(os.getenv("INTENT_SEMANTIC_CACHE_SIZE") or 1024))
+INTENT_SEMANTIC_CACHE_TTL = int(os.getenv("INTENT_SEMANTIC_CACHE_TTL") or 86400)
+
+# Từ đệm đầu câu không đổi nghĩa goal (so theo dạng bỏ dấu)
+_FILLER_WORDS = frozenset((
+    "toi", "minh", "em", "muon", "can", "duoc", "hay", "giup",
+    "i", "want", "to", "would", "like", "please", "need",
+))
+# Cụm đệm nhiều từ (không bỏ riêng "mong": dạng bỏ dấu trùng "mông")
+_FILLER_PHRASES: Tuple[Tuple[str, ...], ...] = (("mong", "muon"),)
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+
+StructKey = Tuple[int, Tuple[str, ...], str, Tuple[str, ...]]
+
+
+def normalize_goal_text(text: str) -> str:
+    """Lowercase, bỏ dấu câu, gộp khoảng trắng, bỏ từ đệm ở đầu; giữ dấu tiếng Việt cho embedding."""
+    words = _PUNCT_RE.sub(" ", unicodedata.normalize("NFC", (text or "").lower())).split()
+    while words:
+        phrase = next((p for p in _FILLER_PHRASES if tuple(fold_text(w) for w in words[:len(p)]) == p), None)
+        if phrase is not None:
+            del words[:len(phrase)]
+        elif fold_text(words[0]) in _FILLER_WORDS:
+            words.pop(0)
+        else:
+            break
+    return " ".join(words)
+
+
+def structural_key(profile: Dict[str, Any]) -> StructKey:
+    """
+    Phần quyết định internal_goal phải khớp tuyệt đối: số buổi, ngày tập (weekly_focus_by_day), trình độ,
+    và tập goal/nhóm cơ trong goal_text ("tăng cơ ngực" / "tăng cơ lưng" gần nhau về embedding nhưng khác muscle).
+    """
+    return (
+        int(profile.get("days_per_week") or 0),
+        tuple(str(d).strip().lower() for d in profile.get("training_days") or []),
+        str(profile.get("experience") or "").strip().lower(),
+        goal_phrases(str(profile.get("goal_text") or "")),
+    )
+
+
+@lru_cache(maxsize=INTENT_SEMANTIC_CACHE_SIZE)
+def _embed_goal(text: str) -> np.ndarray:
+    # max_retries thấp: embedding chỉ để tránh call LLM, lỗi thì bỏ qua cache chứ không chờ backoff dài
+    vec = np.asarray(embed_texts([text], task_type="RETRIEVAL_QUERY", max_retries=1)[0], dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else vec
+
+
+# Embedding cho entry mới chạy nền (put() nằm trên response path); 1 worker để không tranh rate limit với request
+_EMBEDDER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intent-cache-embed")
+
+
+@dataclass
+class _Entry:
+    internal_goal: Dict[str, Any]
+    vector: Optional[np.ndarray]
+    expires_at: float
+
+
+class SemanticIntentCache:
+    """
+    LRU (struct key, goal_text đã normalize) → IntentInternalGoal.
+    get(): trùng text sau normalize → hit không cần embedding; còn lại so cosine với các entry
+    cùng struct key, lấy entry gần nhất nếu >= threshold.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl_seconds: int) -> None:
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[StructKey, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(profile: Dict[str, Any]) -> Optional[Tuple[StructKey, str]]:
+        goal_text = str(profile.get("goal_text") or "")
+        text = normalize_goal_text(goal_text)
+        if not text or needs_context(goal_text):
+            return None
+        return structural_key(profile), text
+
+    def get(self, profile: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """(internal_goal, similarity) hoặc None."""
+        key = self._key(profile)
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return copy.deepcopy(entry.internal_goal), 1.0
+            if not any(k[0] == key[0] and e.vector is not None for k, e in self._entries.items()):
+                return None
+
+        try:
+            vec = _embed_goal(key[1])
+        except Exception as e:
+            print(f"[INTENT_CACHE] embed failed: {e}")
+            return None
+
+        with self._lock:
+            best: Optional[Tuple[float, Tuple[StructKey, str]]] = None
+            for k, e in self._entries.items():
+                if k[0] != key[0] or e.vector is None:
+                    continue
+                sim = float(np.dot(vec, e.vector))
+                if best is None or sim > best[0]:
+                    best = (sim, k)
+            if best is None or best[0] < self.threshold:
+                return None
+            self._entries.move_to_end(best[1])
+            return copy.deepcopy(self._entries[best[1]].internal_goal), best[0]
+
+    def has_exact(self, profile: Dict[str, Any]) -> bool:
+        """Có entry trùng text sau normalize (không embed, không đổi thứ tự LRU)."""
+        key = self._key(profile)
+        if key is None:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires_at >= time.time()
+
+    def put(self, profile: Dict[str, Any], internal_goal: Dict[str, Any]) -> Optional[Future]:
+        """
+        Lưu internal_goal hợp lệ (bỏ qua output lỗi). Entry dùng được ngay cho text trùng sau normalize;
+        embedding tính nền, xong mới tham gia so cosine. Return Future của phần embedding (None nếu không lưu).
+        """
+        key = self._key(profile)
+        if key is None or not isinstance(internal_goal, dict) or internal_goal.get("error_type"):
+            return None
+
+        entry = _Entry(copy.deepcopy(internal_goal), None, time.time() + self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return _EMBEDDER.submit(self._embed_entry, key[1], entry)
+
+    @staticmethod
+    def _embed_entry(text: str, entry: _Entry) -> None:
+        try:
+            vec = _embed_goal(text)
+        except Exception as e:
+            # Không có embedding vẫn giữ entry: text trùng sau normalize vẫn hit
+            print(f"[INTENT_CACHE] embed failed: {e}")
+            return
+        entry.vector = vec
+
+    def _evict_expired(self, now: float) -> None:
+        for k in [k for k, e in self._entries.items() if e.expires_at < now]:
+            del self._entries[k]
+
+
+_CACHE: Optional[SemanticIntentCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_semantic_intent_cache() -> Optional[SemanticIntentCache]:
+    """Cache dùng chung trong process; None nếu INTENT_SEMANTIC_CACHE=off."""
+    global _CACHE
+    if INTENT_SEMANTIC_CACHE != "on":
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = SemanticIntentCache(
+                    INTENT_SEMANTIC_THRESHOLD, INTENT_SEMANTIC_CACHE_SIZE, INTENT_SEMANTIC_CACHE_TTL,
+                )
+    return _CACHE
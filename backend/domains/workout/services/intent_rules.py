@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend.domains.workout.contract import (
+    MAJOR_MUSCLE_SET,
+    MAX_MUSCLES_PER_DAY,
+    validate_intent_internal_goal,
+    validate_training_days,
+)
+
+# Fast path cho Intent → Internal Goal: từ điển keyword/phrase VI/EN + split template.
+# Chỉ nhận kết quả khi confidence đủ cao và pass validate; còn lại để LLM xử lý.
+INTENT_FAST_PATH = (os.getenv("INTENT_FAST_PATH") or "rules").lower()  # rules | off
+INTENT_RULES_MIN_CONFIDENCE = float(os.getenv("INTENT_RULES_MIN_CONFIDENCE") or 0.8)
+
+
+# -----------------------------
+# Text normalize (bỏ dấu tiếng Việt để khớp cả input không dấu)
+# -----------------------------
+def fold_text(text: str) -> str:
+    s = unicodedata.normalize("NFD", (text or "").lower().replace("đ", "d"))
+    return "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_QUANTITY_RE = re.compile(r"^\d+[a-z]+$")  # "5kg", "10cm": bỏ để "giảm 5kg mỡ" vẫn khớp "giam mo"
+
+Token = Tuple[str, str]  # (giữ dấu, bỏ dấu)
+
+
+def _tokens(text: str) -> List[Token]:
+    raw = _TOKEN_RE.findall(unicodedata.normalize("NFC", (text or "").lower()))
+    pairs = [(t, fold_text(t)) for t in raw]
+    return [(t, f) for t, f in pairs if not _QUANTITY_RE.match(f)]
+
+
+# -----------------------------
+# Từ điển (lowercase). Goal/escalate/stopword so theo dạng bỏ dấu; nhóm cơ so theo dạng có dấu
+# vì bỏ dấu thì trùng từ thường ("mong muốn" -> mông, "vài buổi" -> vai)
+# -----------------------------
+_GOAL_PHRASES: Dict[str, Tuple[str, ...]] = {
+    "fat_loss": (
+        "giam mo", "dot mo", "giam can", "giam beo", "xuong can", "giam eo",
+        "fat loss", "lose fat", "burn fat", "lose weight", "weight loss", "cut", "cutting", "slim down",
+    ),
+    "hypertrophy": (
+        "tang co", "to co", "len co", "phat trien co", "tang khoi luong co", "co to",
+        "build muscle", "gain muscle", "muscle gain", "hypertrophy", "bulk", "bulking", "get bigger",
+    ),
+    "body_recomposition": (
+        "siet co", "san chac", "thon gon", "body recomposition", "recomp", "tone", "toned", "lean",
+    ),
+    "strength": (
+        "suc manh", "tang luc", "khoe hon", "manh hon",
+        "strength", "stronger", "get strong", "powerlifting",
+    ),
+    "endurance": (
+        "suc ben", "chay bo", "cardio", "marathon", "endurance", "stamina", "running",
+    ),
+    "athletic_performance": (
+        "the thao", "bat nhay", "toc do", "phan xa",
+        "athletic", "athlete", "sport", "sports", "speed", "agility", "vertical jump",
+    ),
+    "mobility_flexibility": (
+        "deo dai", "linh hoat", "gian co", "mobility", "flexibility", "flexible", "stretching",
+    ),
+    "posture_stability": (
+        "tu the", "gu lung", "can bang", "posture", "balance", "stability",
+    ),
+    "health": (
+        "suc khoe", "khoe manh", "song khoe", "health", "healthy",
+    ),
+    "general_fitness": (
+        "giu dang", "giu suc khoe", "tap deu", "fitness", "stay fit", "keep fit", "get fit", "in shape",
+    ),
+}
+
+# phrase (có dấu) -> (muscles, priority_target hoặc None); input không dấu thì so với dạng bỏ dấu
+_MUSCLE_PHRASES: Dict[str, Tuple[Tuple[str, ...], Optional[str]]] = {
+    "bụng": (("core",), "abs"),
+    "cơ bụng": (("core",), "abs"),
+    "bụng dưới": (("core",), "abs"),
+    "eo": (("core",), "abs"),
+    "vòng eo": (("core",), "abs"),
+    "abs": (("core",), "abs"),
+    "six pack": (("core",), "abs"),
+    "sixpack": (("core",), "abs"),
+    "core": (("core",), None),
+    "ngực": (("chest",), None),
+    "ngực trên": (("chest",), "upper chest"),
+    "chest": (("chest",), None),
+    "upper chest": (("chest",), "upper chest"),
+    "pecs": (("chest",), None),
+    "vai": (("shoulders",), None),
+    "bờ vai": (("shoulders",), "shoulder caps"),
+    "shoulder": (("shoulders",), None),
+    "shoulders": (("shoulders",), None),
+    "delts": (("shoulders",), "shoulder caps"),
+    "tay": (("biceps", "triceps"), "arms"),
+    "cánh tay": (("biceps", "triceps"), "arms"),
+    "bắp tay": (("biceps",), "arms"),
+    "tay trước": (("biceps",), "arms"),
+    "tay sau": (("triceps",), "arms"),
+    "arm": (("biceps", "triceps"), "arms"),
+    "arms": (("biceps", "triceps"), "arms"),
+    "biceps": (("biceps",), "arms"),
+    "triceps": (("triceps",), "arms"),
+    "lưng": (("back",), None),
+    "lưng xô": (("back",), "back thickness"),
+    "xô": (("back",), None),
+    "back": (("back",), None),
+    "lats": (("back",), None),
+    "lưng chữ v": (("back", "shoulders"), "v taper"),
+    "chữ v": (("back", "shoulders"), "v taper"),
+    "v taper": (("back", "shoulders"), "v taper"),
+    "chân": (("quadriceps", "hamstrings"), None),
+    "đùi": (("quadriceps", "hamstrings"), None),
+    "đùi trước": (("quadriceps",), None),
+    "đùi sau": (("hamstrings",), None),
+    "leg": (("quadriceps", "hamstrings"), None),
+    "legs": (("quadriceps", "hamstrings"), None),
+    "quads": (("quadriceps",), None),
+    "hamstring": (("hamstrings",), None),
+    "hamstrings": (("hamstrings",), None),
+    "mông": (("hips",), "hips"),
+    "vòng 3": (("hips",), "hips"),
+    "hông": (("hips",), "hips"),
+    "glute": (("hips",), "hips"),
+    "glutes": (("hips",), "hips"),
+    "butt": (("hips",), "hips"),
+    "hips": (("hips",), "hips"),
+    "bắp chân": (("calves",), None),
+    "bẹ chân": (("calves",), None),
+    "calves": (("calves",), None),
+    "calf": (("calves",), None),
+}
+
+# Có các cụm này (phủ định, chấn thương, bệnh lý) → cần risk_notes/hiểu ngữ cảnh → để LLM xử lý
+_ESCALATE_PHRASES: Tuple[str, ...] = (
+    "khong", "tru", "tranh", "dau", "chan thuong", "benh", "bau", "mang thai", "phau thuat", "thoat vi",
+    "not", "no", "except", "avoid", "without", "pain", "injury", "injured", "surgery", "pregnant",
+)
+
+# Cụm đệm nhiều từ: phủ nhưng không tính là nội dung (và không để fallback bỏ dấu đọc "mong" thành mông)
+_FILLER_PHRASES: Tuple[str, ...] = ("mong muon",)
+
+_STOPWORDS = frozenset((
+    "toi", "minh", "em", "anh", "chi", "muon", "can", "duoc", "va", "voi", "cho", "de", "hon", "them",
+    "nhanh", "mot", "chut", "it", "nhieu", "rat", "la", "thi", "co", "nhung", "vung", "phan", "o", "lam",
+    "tap", "trung", "tang", "giam", "dep", "body", "than", "hinh", "nguoi", "ngay", "tuan", "thang", "buoi",
+    "i", "want", "to", "and", "my", "the", "a", "an", "get", "more", "some", "be", "in", "for", "of",
+    "with", "on", "focus", "improve", "increase", "reduce", "build", "lose", "train", "training",
+))
+
+# Tổ hợp goal đặc thù → goal_style; goal chung chung bị bỏ khi có goal cụ thể hơn
+_GOAL_COMBOS: Tuple[Tuple[frozenset, str], ...] = (
+    (frozenset({"fat_loss", "hypertrophy"}), "body_recomposition"),
+    (frozenset({"fat_loss", "body_recomposition"}), "body_recomposition"),
+    (frozenset({"hypertrophy", "body_recomposition"}), "body_recomposition"),
+    (frozenset({"hypertrophy", "strength"}), "hypertrophy"),
+)
+_GENERIC_GOALS = frozenset({"health", "general_fitness"})
+
+# priority_muscles mặc định khi goal_text không nhắc nhóm cơ nào
+_GOAL_DEFAULT_MUSCLES: Dict[str, Tuple[str, ...]] = {
+    "fat_loss": ("quadriceps", "back", "core"),
+    "hypertrophy": ("chest", "back", "quadriceps"),
+    "body_recomposition": ("chest", "back", "quadriceps"),
+    "strength": ("back", "quadriceps", "chest"),
+    "endurance": ("quadriceps", "calves", "core"),
+    "athletic_performance": ("quadriceps", "hips", "core"),
+    "mobility_flexibility": ("hips", "hamstrings", "shoulders"),
+    "posture_stability": ("back", "core", "shoulders"),
+    "health": ("back", "quadriceps", "core"),
+    "general_fitness": ("back", "quadriceps", "core"),
+}
+
+
+def _phrase_index() -> Dict[Tuple[str, ...], Tuple[str, Any]]:
+    """Index theo dạng bỏ dấu: goal, filler, escalate (escalate thắng khi trùng cụm)."""
+    idx: Dict[Tuple[str, ...], Tuple[str, Any]] = {}
+    for style, phrases in _GOAL_PHRASES.items():
+        for p in phrases:
+            idx[tuple(p.split())] = ("goal", style)
+    for p in _FILLER_PHRASES:
+        idx[tuple(p.split())] = ("filler", p)
+    for p in _ESCALATE_PHRASES:
+        idx[tuple(p.split())] = ("escalate", p)
+    return idx
+
+
+def _muscle_index(folded: bool) -> Dict[Tuple[str, ...], Tuple[str, Any]]:
+    idx: Dict[Tuple[str, ...], Tuple[str, Any]] = {}
+    for p, val in _MUSCLE_PHRASES.items():
+        p = unicodedata.normalize("NFC", p)
+        idx[tuple((fold_text(p) if folded else p).split())] = ("muscle", val)
+    return idx
+
+
+_PHRASE_INDEX = _phrase_index()
+_MUSCLE_INDEX = _muscle_index(folded=False)
+_MUSCLE_INDEX_FOLDED = _muscle_index(folded=True)
+_MAX_PHRASE_LEN = max(len(k) for k in (*_PHRASE_INDEX, *_MUSCLE_INDEX))
+
+
+def _lookup(
+    tokens: Sequence[Token], i: int, n: int, muscle_index: Dict[Tuple[str, ...], Tuple[str, Any]], accented: bool,
+) -> Optional[Tuple[str, Any]]:
+    folded = tuple(f for _, f in tokens[i:i + n])
+    hit = _PHRASE_INDEX.get(folded)
+    if hit is not None and hit[0] == "escalate":
+        return hit
+    muscle = muscle_index.get(tuple(t for t, _ in tokens[i:i + n]) if accented else folded)
+    return muscle or hit
+
+
+def _match_phrases(tokens: Sequence[Token]) -> Tuple[List[Tuple[str, Any]], int, int]:
+    """
+    Greedy longest-match. Trả (matches, số token nội dung được phủ, tổng token nội dung).
+    Nhóm cơ so theo token có dấu; chỉ khi input hoàn toàn không dấu mới so theo dạng bỏ dấu.
+    """
+    accented = any(t != f for t, f in tokens)
+    muscle_index = _MUSCLE_INDEX if accented else _MUSCLE_INDEX_FOLDED
+    matches: List[Tuple[str, Any]] = []
+    covered = 0
+    content = 0
+    i = 0
+    while i < len(tokens):
+        for n in range(min(_MAX_PHRASE_LEN, len(tokens) - i), 0, -1):
+            hit = _lookup(tokens, i, n, muscle_index, accented)
+            if hit is not None:
+                if hit[0] != "filler":
+                    matches.append(hit)
+                    covered += n
+                    content += n
+                i += n
+                break
+        else:
+            tok = tokens[i][1]
+            if tok not in _STOPWORDS and not any(ch.isdigit() for ch in tok):
+                content += 1
+            i += 1
+    return matches, covered, content
+
+
+# -----------------------------
+# Split templates (thỏa hard constraints trong intent prompt)
+# -----------------------------
+# Mỗi ngày liệt kê theo thứ tự rank mặc định; đã tránh 2 ngày liền nhau trùng nhóm cơ lớn
+# và nhóm cơ lớn không quá 2 lần/tuần.
+_SPLIT_TEMPLATES: Dict[int, Tuple[Tuple[str, ...], ...]] = {
+    1: (("core", "chest", "back", "quadriceps", "hamstrings", "hips", "shoulders", "triceps", "biceps", "calves"),),
+    2: (
+        ("chest", "back", "shoulders", "triceps", "biceps"),
+        ("core", "quadriceps", "hamstrings", "hips", "calves"),
+    ),
+    3: (
+        ("chest", "shoulders", "triceps"),
+        ("back", "biceps", "core"),
+        ("calves", "quadriceps", "hamstrings", "hips"),
+    ),
+    4: (
+        ("chest", "shoulders", "triceps"),
+        ("quadriceps", "hamstrings", "calves"),
+        ("back", "biceps", "core"),
+        ("hips", "hamstrings", "core"),
+    ),
+    5: (
+        ("chest", "triceps"),
+        ("back", "biceps"),
+        ("quadriceps", "calves"),
+        ("shoulders", "core"),
+        ("hips", "hamstrings"),
+    ),
+    6: (
+        ("chest", "triceps"),
+        ("back", "biceps"),
+        ("quadriceps", "calves"),
+        ("shoulders", "core"),
+        ("hips", "hamstrings"),
+        ("chest", "back"),
+    ),
+    7: (
+        ("chest", "triceps"),
+        ("back", "biceps"),
+        ("quadriceps", "calves"),
+        ("shoulders", "core"),
+        ("hips", "hamstrings"),
+        ("chest", "back"),
+        ("quadriceps", "core"),
+    ),
+}
+SPLIT_NAMES = {
+    1: "full body",
+    2: "upper/lower",
+    3: "push/pull/legs",
+    4: "upper/lower x2",
+    5: "body part split",
+    6: "body part split",
+    7: "body part split",
+}
+
+
+def _order_day(muscles: Sequence[str], priority: Sequence[str]) -> List[str]:
+    rank_of = {m: i for i, m in enumerate(priority)}
+    ordered = sorted(muscles, key=lambda m: (rank_of.get(m, len(priority)), muscles.index(m)))
+
+    # Constraint 2: buổi có > 2 nhóm cơ lớn thì rank 1 phải là nhóm cơ nhỏ
+    if sum(m in MAJOR_MUSCLE_SET for m in ordered) > 2 and ordered[0] in MAJOR_MUSCLE_SET:
+        minor = next((m for m in ordered if m not in MAJOR_MUSCLE_SET), None)
+        if minor is not None:
+            ordered.remove(minor)
+            ordered.insert(0, minor)
+    return ordered
+
+
+def build_weekly_focus(
+    training_days: Sequence[str],
+    priority_muscles: Sequence[str],
+) -> List[Dict[str, Any]]:
+    template = _SPLIT_TEMPLATES[len(training_days)]
+    return [
+        {
+            "training_day": td,
+            "focus": [{"muscle": m, "rank": r} for r, m in enumerate(_order_day(muscles, priority_muscles), start=1)],
+        }
+        for td, muscles in zip(training_days, template)
+    ]
+
+
+def check_split_constraints(
+    weekly_focus_by_day: List[Dict[str, Any]],
+    days_per_week: int,
+    experience: Optional[str] = None,
+) -> List[str]:
+    """Check hard constraints 1-5 của intent prompt (phần validate_intent_internal_goal chưa check)."""
+    errors: List[str] = []
+    cap = MAX_MUSCLES_PER_DAY.get(int(days_per_week))
+    major_count: Dict[str, int] = {}
+    prev_major: set = set()
+
+    for di, day in enumerate(weekly_focus_by_day):
+        focus = sorted(day.get("focus") or [], key=lambda x: x.get("rank") or 0)
+        muscles = [str(x.get("muscle")) for x in focus]
+        majors = {m for m in muscles if m in MAJOR_MUSCLE_SET}
+
+        if sum(1 for x in focus if x.get("rank") == 1) != 1:
+            errors.append(f"day[{di}] phải có đúng 1 rank=1")
+        if len(majors) > 2 and muscles and muscles[0] in MAJOR_MUSCLE_SET:
+            errors.append(f"day[{di}] có > 2 nhóm cơ lớn nhưng rank 1 là nhóm cơ lớn ({muscles[0]})")
+        if prev_major & majors:
+            errors.append(f"day[{di}] trùng nhóm cơ lớn với ngày trước: {sorted(prev_major & majors)}")
+        if cap is not None and len(muscles) > cap:
+            errors.append(f"day[{di}] có {len(muscles)} nhóm cơ, tối đa {cap}")
+
+        for m in majors:
+            major_count[m] = major_count.get(m, 0) + 1
+        prev_major = majors
+
+    if (experience or "").lower() != "advanced":
+        over = sorted(m for m, n in major_count.items() if n >= 3)
+        if over:
+            errors.append(f"nhóm cơ lớn xuất hiện >= 3 lần/tuần: {over}")
+    return errors
+
+
+# -----------------------------
+# Entry point
+# -----------------------------
+@dataclass
+class IntentRuleResult:
+    internal_goal: Optional[Dict[str, Any]]
+    confidence: float
+    reason: str
+
+    @property
+    def accepted(self) -> bool:
+        return self.internal_goal is not None and self.confidence >= INTENT_RULES_MIN_CONFIDENCE
+
+
+def needs_context(goal_text: str) -> bool:
+    """Goal có cụm phủ định / chấn thương / bệnh lý → cần LLM đọc ngữ cảnh (không dùng kết quả chung)."""
+    matches, _, _ = _match_phrases(_tokens(goal_text))
+    return any(kind == "escalate" for kind, _ in matches)
+
+
+def goal_phrases(goal_text: str) -> Tuple[str, ...]:
+    """Goal style + nhóm cơ từ điển đọc được trong goal_text ("goal:fat_loss", "muscle:core"...), sorted."""
+    matches, _, _ = _match_phrases(_tokens(goal_text))
+    out = set()
+    for kind, val in matches:
+        if kind == "goal":
+            out.add(f"goal:{val}")
+        elif kind == "muscle":
+            out.update(f"muscle:{m}" for m in val[0])
+    return tuple(sorted(out))
+
+
+def _resolve_goal_style(styles: List[str]) -> Tuple[Optional[str], bool]:
+    """Trả (goal_style, ambiguous)."""
+    found = set(styles)
+    if len(found) > 1:
+        found = (found - _GENERIC_GOALS) or found
+    if len(found) == 1:
+        return next(iter(found)), False
+    for combo, style in _GOAL_COMBOS:
+        if found == combo:
+            return style, False
+    if not found:
+        return None, False
+    return styles[0], True
+
+
+def match_intent_rules(profile: Dict[str, Any]) -> IntentRuleResult:
+    """
+    Map goal_text → internal_goal bằng từ điển + split template.
+    confidence = 0.4 + 0.6 * (tỉ lệ token nội dung được từ điển phủ); 0 nếu có cụm cần LLM.
+    """
+    days = int(profile.get("days_per_week") or 0)
+    training_days = [str(x) for x in (profile.get("training_days") or [])]
+    if days not in _SPLIT_TEMPLATES or validate_training_days(training_days, days_per_week=days):
+        return IntentRuleResult(None, 0.0, "unsupported_days")
+
+    tokens = _tokens(profile.get("goal_text") or "")
+    if not tokens:
+        return IntentRuleResult(None, 0.0, "empty_goal_text")
+
+    matches, covered, content = _match_phrases(tokens)
+    if any(kind == "escalate" for kind, _ in matches):
+        return IntentRuleResult(None, 0.0, "needs_context")
+
+    goal_style, ambiguous = _resolve_goal_style([v for kind, v in matches if kind == "goal"])
+    if goal_style is None:
+        return IntentRuleResult(None, 0.0, "no_goal_match")
+
+    muscles: List[str] = []
+    targets: List[str] = []
+    for kind, val in matches:
+        if kind != "muscle":
+            continue
+        ms, target = val
+        muscles.extend(m for m in ms if m not in muscles)
+        if target and target not in targets:
+            targets.append(target)
+    if not muscles:
+        muscles = list(_GOAL_DEFAULT_MUSCLES.get(goal_style, ()))
+
+    confidence = 0.4 + 0.6 * (covered / content if content else 0.0)
+    if ambiguous:
+        confidence *= 0.5
+
+    internal_goal = {
+        "goal_style": goal_style,
+        "priority_targets": targets,
+        "priority_muscles": muscles,
+        "training_days": training_days,
+        "weekly_focus_by_day": build_weekly_focus(training_days, muscles),
+        "risk_notes": [],
+    }
+
+    errors = validate_intent_internal_goal(internal_goal, days_per_week=days)
+    errors += check_split_constraints(internal_goal["weekly_focus_by_day"], days, profile.get("experience"))
+    if errors:
+        return IntentRuleResult(None, 0.0, f"invalid: {errors[0]}")
+
+    return IntentRuleResult(internal_goal, round(confidence, 3), "ambiguous_goal" if ambiguous else "ok")
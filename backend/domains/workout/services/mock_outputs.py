@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import json
+import random
+import re
+from typing import Any, Dict, List
+
+from backend.domains.workout.contract import MAX_MUSCLES_PER_DAY, MUSCLE_TAXONOMY
+from backend.shared.llm.mock import register_mock_generator
+
+# Generator output giả lập cho LLM_PROVIDER=mock: đọc lại dữ liệu từ chính prompt
+# (profile/constraints JSON, candidate rows) để output hợp lệ và dùng được với evaluate/enrich.
+
+_DEFAULT_DAYS = {
+    1: ["mon"],
+    2: ["mon", "thu"],
+    3: ["mon", "wed", "fri"],
+    4: ["mon", "tue", "thu", "fri"],
+    5: ["mon", "tue", "wed", "thu", "fri"],
+    6: ["mon", "tue", "wed", "thu", "fri", "sat"],
+    7: ["mon", "tue", "wed", "thu", "fri", "sat", "sun"],
+}
+
+# Nhóm cơ xoay vòng theo ngày; số nhóm/buổi cắt theo giới hạn trong intent prompt
+_SPLIT_GROUPS = (
+    ("chest", "shoulders", "triceps", "core"),
+    ("back", "biceps", "core", "shoulders"),
+    ("quadriceps", "hamstrings", "hips", "calves"),
+)
+
+_GOAL_KEYWORDS = (
+    (("giảm mỡ", "giam mo", "fat", "giảm cân", "giam can"), "fat_loss"),
+    (("sức mạnh", "suc manh", "strength", "khỏe", "khoe"), "strength"),
+    (("sức bền", "suc ben", "endurance", "cardio"), "endurance"),
+    (("tăng cơ", "tang co", "muscle", "hypertrophy"), "hypertrophy"),
+)
+
+_CANDIDATE_ROW_RE = re.compile(r"^(?:id=)?(\d+)\s*\|", re.MULTILINE)
+
+
+def _json_after(prompt: str, header: str) -> Dict[str, Any]:
+    lines = prompt.splitlines()
+    for i, line in enumerate(lines[:-1]):
+        if line.strip() == header:
+            try:
+                out = json.loads(lines[i + 1])
+                return out if isinstance(out, dict) else {}
+            except ValueError:
+                return {}
+    return {}
+
+
+def _days_per_week(prompt: str, profile: Dict[str, Any]) -> int:
+    m = re.search(r"^days_per_week:\s*(\d+)", prompt, re.MULTILINE)
+    days = int(m.group(1)) if m else int(profile.get("days_per_week") or 3)
+    return min(max(days, 1), 7)
+
+
+def _training_days(profile: Dict[str, Any], days: int) -> List[str]:
+    td = profile.get("training_days")
+    if isinstance(td, list) and len(td) == days and len(set(td)) == days:
+        return [str(x) for x in td]
+    return list(_DEFAULT_DAYS[days])
+
+
+def _candidate_ids(prompt: str) -> List[int]:
+    # Candidate rows nằm trước bảng plan cũ (nếu có); dòng bảng plan bắt đầu bằng day, không phải số
+    section = prompt.split("Candidate exercises", 1)[-1]
+    return list(dict.fromkeys(int(x) for x in _CANDIDATE_ROW_RE.findall(section)))
+
+
+def mock_intent(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    profile = _json_after(prompt, "Input profile:")
+    days = _days_per_week(prompt, profile)
+    training_days = _training_days(profile, days)
+
+    goal_text = str(profile.get("goal_text") or "").lower()
+    goal_style = next(
+        (style for keys, style in _GOAL_KEYWORDS if any(k in goal_text for k in keys)),
+        rng.choice(["hypertrophy", "general_fitness", "fat_loss"]),
+    )
+
+    cap = MAX_MUSCLES_PER_DAY[days]
+    weekly = []
+    for i, td in enumerate(training_days):
+        muscles = list(MUSCLE_TAXONOMY) if days == 1 else list(_SPLIT_GROUPS[i % len(_SPLIT_GROUPS)])
+        weekly.append({
+            "training_day": td,
+            "focus": [{"muscle": m, "rank": r} for r, m in enumerate(muscles[:cap], start=1)],
+        })
+
+    return {
+        "goal_style": goal_style,
+        "priority_targets": [],
+        "priority_muscles": rng.sample(list(MUSCLE_TAXONOMY), 2),
+        "training_days": training_days,
+        "weekly_focus_by_day": weekly,
+        "risk_notes": [],
+    }
+
+
+def _per_day(profile: Dict[str, Any], constraints: Dict[str, Any], n_ids: int) -> int:
+    max_ex = int(constraints.get("max_exercises_per_day") or 6)
+    min_ex = int(constraints.get("min_exercises_per_day") or 1)
+    per_day = max(min_ex, min(max_ex, int(profile.get("session_minutes") or 60) // 12))
+    return max(1, min(per_day, n_ids))
+
+
+def _mock_exercises(ids: List[int], n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [
+        {"exercise_id": eid, "sets": 3, "reps": "8-12", "rest_sec": 90, "notes": ""}
+        for eid in rng.sample(ids, n)
+    ]
+
+
+def _compact_row(e: Dict[str, Any]) -> str:
+    return f"{e['exercise_id']}|{e['sets']}|{e['reps']}|{e['rest_sec']}"
+
+
+def _mock_days(prompt: str, rng: random.Random) -> List[Dict[str, Any]]:
+    profile = _json_after(prompt, "Input profile:")
+    constraints = _json_after(prompt, "Constraints:")
+    days = _days_per_week(prompt, profile)
+    ids = _candidate_ids(prompt) or [1]
+    per_day = _per_day(profile, constraints, len(ids))
+    return [{"day": td, "exercises": _mock_exercises(ids, per_day, rng)} for td in _training_days(profile, days)]
+
+
+def mock_day(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    """Prompt 1 buổi (planning._build_day_prompt): dòng 'day:' + candidate, tránh id đã dùng ở ngày khác."""
+    profile = _json_after(prompt, "Input profile:")
+    constraints = _json_after(prompt, "Constraints:")
+    m = re.search(r"^day:\s*(\S+)", prompt, re.MULTILINE)
+    avoid = re.search(r"^Đã dùng ở ngày khác[^:]*:\s*([\d,]+)", prompt, re.MULTILINE)
+    avoid_ids = {int(x) for x in avoid.group(1).split(",") if x} if avoid else set()
+
+    ids = _candidate_ids(prompt) or [1]
+    ids = [i for i in ids if i not in avoid_ids] or ids
+    return {"day": m.group(1) if m else "mon", "exercises": _mock_exercises(ids, _per_day(profile, constraints, len(ids)), rng)}
+
+
+def mock_compact_day(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    day = mock_day(prompt, rng)
+    return {"day": day["day"], "ex": [_compact_row(e) for e in day["exercises"]]}
+
+
+def mock_plan(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    profile = _json_after(prompt, "Input profile:")
+    return {
+        "goal": str(profile.get("goal_text") or "mock"),
+        "days_per_week": _days_per_week(prompt, profile),
+        "session_minutes": min(max(int(profile.get("session_minutes") or 60), 10), 240),
+        "split": "mock",
+        "days": _mock_days(prompt, rng),
+    }
+
+
+def mock_compact_plan(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "split": "mock",
+        "days": [
+            {
+                "day": d["day"],
+                "ex": [_compact_row(e) for e in d["exercises"]],
+            }
+            for d in _mock_days(prompt, rng)
+        ],
+    }
+
+
+register_mock_generator("IntentInternalGoal", mock_intent)
+register_mock_generator("WorkoutPlan", mock_plan)
+register_mock_generator("CompactWorkoutPlan", mock_compact_plan)
+register_mock_generator("DayPlan", mock_day)
+register_mock_generator("CompactDayPlan", mock_compact_day)
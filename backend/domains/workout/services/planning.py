@@ -1,12 +1,18 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import contextvars
 import hashlib
-from typing import Any, Dict, List, Optional, Set
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type
 
 from langchain_core.documents import Document
+from pydantic import BaseModel
 
 from backend.shared.llm import LLMClient
+from backend.shared.llm.cache import get_llm_cache
+from backend.shared.llm.metrics import llm_call_scope, new_call_record, record_llm_call
 from backend.shared.simple_cache import cache_get, cache_set
 from backend.domains.workout.contract import (
     MUSCLE_TAXONOMY,
@@ -14,52 +20,35 @@ from backend.domains.workout.contract import (
     TRAINING_DAY_ENUM,
     validate_intent_internal_goal,
 )
-from backend.domains.workout.schemas import IntentInternalGoal
+from backend.domains.workout.schemas import (
+    CompactDayPlan,
+    CompactWorkoutPlan,
+    DayPlan,
+    IntentInternalGoal,
+    WorkoutPlan,
+)
+from backend.domains.workout.services.formatting import expand_compact_day, expand_compact_plan
+from backend.domains.workout.services.intent_cache import get_semantic_intent_cache
+from backend.domains.workout.services.template_plan import assemble_plan, focus_by_day
+from backend.domains.workout.services import mock_outputs  # noqa: F401  (đăng ký generator cho LLM_PROVIDER=mock)
+from backend.domains.workout.services.prompting import (
+    PLAN_PROMPT_TOKEN_BUDGET,
+    candidate_rows,
+    compact_json,
+    estimate_tokens,
+    fit_candidate_rows,
+    muscle_legend,
+    plan_header,
+    plan_table,
+)
 
 
 PLAN_CACHE_TTL = 900  # 15 phút
+# full = WorkoutPlan đầy đủ key; compact = CompactWorkoutPlan (ít output token hơn), server expand lại
+PLAN_OUTPUT_FORMAT = (os.getenv("PLAN_OUTPUT_FORMAT") or "full").lower()
 INTENT_CACHE_TTL = 900  # 15 phút
 
 
-def _format_candidate_lines_from_docs(documents: List[Document], max_items: int = 45) -> str:
-    lines: List[str] = []
-    for d in documents[:max_items]:
-        m = d.metadata or {}
-        eid = m.get("id")
-        title = m.get("title", "")
-        muscles = m.get("muscle_groups") or []
-        equipment = m.get("equipment") or []
-        level = m.get("level") or ""
-
-        parts = [f"id={eid}", title]
-
-        if muscles:
-            parts.append(f"muscles={','.join(map(str, muscles))}")
-
-        if equipment:
-            parts.append(f"equip={','.join(map(str, equipment))}")
-
-        if level:
-            parts.append(f"level={level}")
-
-        lines.append(" | ".join(parts))
-    return "\n".join(lines)
-
-
-def _format_candidate_lines_fallback(candidates: List[Dict[str, Any]]) -> str:
-    lines: List[str] = []
-    for c in candidates:
-        parts = [f"id={c['id']}", c.get("title", "")]
-
-        muscles = c.get("muscle_groups") or []
-        if muscles:
-            mg = ",".join([str(x) for x in muscles])
-            parts.append(f"muscles={mg}")
-
-        lines.append(" | ".join(parts))
-    return "\n".join(lines)
-
-
 def _guard_before_llm(
     profile: Dict[str, Any],
     constraints: Dict[str, Any],
@@ -125,16 +114,17 @@ def _guard_before_llm(
     }
 
 
-def _build_intent_prompt(profile: Dict[str, Any]) -> str:
-    days = profile.get("days_per_week")
-    minutes = profile.get("session_minutes")
+# Prompt = phần tĩnh (giống hệt nhau từng byte cho mọi request) + phần biến đổi ở cuối,
+# để provider cache được prefix. Đổi nội dung phần tĩnh => tăng version.
+INTENT_PROMPT_VERSION = "intent-v2"
+PLAN_PROMPT_VERSION = "plan-v2"
+
 
+def _intent_static_prefix() -> str:
     parts: List[str] = []
+    parts.append(f"[prompt {INTENT_PROMPT_VERSION}]")
     parts.append("Nhiệm vụ: phân tích goal_text và chuẩn hóa thành Internal Goal dạng JSON đúng schema.")
     parts.append("")
-    parts.append("Input profile:")
-    parts.append(json.dumps(profile, ensure_ascii=False))
-    parts.append("")
 
     parts.append("Taxonomy muscles hợp lệ (BẮT BUỘC dùng đúng):")
     parts.append(", ".join(MUSCLE_TAXONOMY))
@@ -150,8 +140,8 @@ def _build_intent_prompt(profile: Dict[str, Any]) -> str:
     parts.append("- goal_style: 1 giá trị thuộc enum")
     parts.append("- priority_targets: list string (ví dụ abs, hips, upper chest, v taper)")
     parts.append("- priority_muscles: list muscle thuộc taxonomy")
-    parts.append(f"- training_days: list đúng {days} phần tử, unique, thuộc mon..sun")
-    parts.append(f"- weekly_focus_by_day: list đúng {days} phần tử, mỗi phần tử là object {{training_day, focus}}")
+    parts.append("- training_days: list đúng days_per_week phần tử, unique, thuộc mon..sun")
+    parts.append("- weekly_focus_by_day: list đúng days_per_week phần tử, mỗi phần tử là object {training_day, focus}")
     parts.append("  - focus: list các object {muscle, rank} (rank 1 là ưu tiên cao nhất)")
     parts.append("- risk_notes: list string (cảnh báo logic)")
     parts.append("")
@@ -180,11 +170,27 @@ def _build_intent_prompt(profile: Dict[str, Any]) -> str:
     parts.append("")
     parts.append("Gợi ý phân bổ:")
     parts.append("- Ưu tiên mục tiêu chính ở rank 1, mục tiêu phụ rank 2-3")
-    parts.append("- Mỗi ngày nên có 2-4 nhóm cơ tùy thời lượng buổi")
-    parts.append(f"- session_minutes hiện tại: {minutes}")
+    parts.append("- Mỗi ngày nên có 2-4 nhóm cơ tùy thời lượng buổi (session_minutes)")
     parts.append("")
     parts.append("Chỉ trả về JSON hợp lệ, không thêm giải thích.")
-    return "\n".join(parts)
+    parts.append("")
+    parts.append("=== Request ===")
+    return "\n".join(parts) + "\n"
+
+
+INTENT_STATIC_PREFIX = _intent_static_prefix()
+
+
+def _build_intent_prompt(profile: Dict[str, Any]) -> str:
+    days = profile.get("days_per_week")
+    minutes = profile.get("session_minutes")
+
+    parts: List[str] = []
+    parts.append(f"days_per_week: {days}")
+    parts.append(f"session_minutes: {minutes}")
+    parts.append("Input profile:")
+    parts.append(compact_json(profile))
+    return INTENT_STATIC_PREFIX + "\n".join(parts)
 
 
 def _canonicalize_internal_goal_dict(g: Dict[str, Any]) -> Dict[str, Any]:
@@ -228,32 +234,82 @@ def _canonicalize_internal_goal_dict(g: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
-def parse_intent_internal_goal_with_llm(
-    llm: LLMClient,
-    profile: Dict[str, Any],
-) -> Dict[str, Any]:
-    """
-    Gọi LLM để sinh Internal Goal structured theo schema IntentInternalGoal.
-    Có cache theo prompt hash.
-    """
-    prompt = _build_intent_prompt(profile)
-    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+def _cached_llm_output(cache_name: str, key: str, ttl_seconds: int, schema_name: str) -> Any:
+    """L1 = simple_cache trong process, L2 = LLM response cache dùng chung giữa các worker."""
+    cached = cache_get(cache_name, key)
+    if cached is None:
+        try:
+            cached = get_llm_cache().get(key)
+        except Exception as e:
+            print(f"[LLM_CACHE] get failed: {e}")
+            return None
+        if cached is not None:
+            cache_set(cache_name, key, cached, ttl_seconds=ttl_seconds)
 
-    cached = cache_get("intent_prompt", prompt_hash)
     if cached is not None:
-        return cached
+        record_llm_call(new_call_record(schema_name, cache_hit=True))
+    return cached
+
 
+def _store_llm_output(cache_name: str, key: str, out: Any, ttl_seconds: int) -> None:
+    cache_set(cache_name, key, out, ttl_seconds=ttl_seconds)
+
+    # Output lỗi chỉ cache trong process (không lưu lâu dài)
+    if isinstance(out, dict) and out.get("error_type"):
+        return
     try:
-        out = llm.generate_structured(prompt=prompt, schema_model=IntentInternalGoal)
+        get_llm_cache().set(key, out)
     except Exception as e:
-        out = {
-            "error_type": "intent_generation_failed",
-            "message": "Không parse được internal_goal theo schema (generate_structured failed).",
-            "exception": str(e),
-        }
-        cache_set("intent_prompt", prompt_hash, out, ttl_seconds=INTENT_CACHE_TTL)
-        return out
+        print(f"[LLM_CACHE] set failed: {e}")
+
+
+def _intent_failure(e: Exception) -> Dict[str, Any]:
+    return {
+        "error_type": "intent_generation_failed",
+        "message": "Không parse được internal_goal theo schema (generate_structured failed).",
+        "exception": str(e),
+    }
+
+
+def _similar_intent(profile: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Internal goal của goal_text cùng ý + cùng days/training_days/experience (services/intent_cache.py)."""
+    cache = get_semantic_intent_cache()
+    hit = cache.get(profile) if cache is not None else None
+    if hit is None:
+        return None
+    internal_goal, similarity = hit
+    print(f"[INTENT_CACHE] semantic hit similarity={similarity:.3f}")
+    record_llm_call(new_call_record(IntentInternalGoal.__name__, cache_hit=True))
+    return internal_goal
+
+
+def intent_cache_hit(llm: LLMClient, profile: Dict[str, Any]) -> bool:
+    """
+    parse_intent_internal_goal_with_llm chắc chắn trả từ cache (prompt cache L1/L2 hoặc semantic cache trùng text)
+    mà không gọi LLM. Chỉ tra cache, không ghi metrics, không embed (semantic cache chỉ xét trùng text sau normalize);
+    dùng để bỏ việc chạy song song với intent khi intent không có latency.
+    """
+    prompt_hash = hashlib.sha256(_build_intent_prompt(profile).encode("utf-8")).hexdigest()
+    with llm_call_scope("intent"):  # key theo route của task intent, giống lúc node_intent gọi
+        key = llm.response_cache_key(IntentInternalGoal, prompt_hash)
+    if cache_get("intent_prompt", key) is not None:
+        return True
+    try:
+        if get_llm_cache().get(key) is not None:
+            return True
+    except Exception as e:
+        print(f"[LLM_CACHE] get failed: {e}")
+    cache = get_semantic_intent_cache()
+    return cache is not None and cache.has_exact(profile)
+
+
+def _remember_intent(profile: Dict[str, Any], out: Dict[str, Any]) -> None:
+    cache = get_semantic_intent_cache()
+    if cache is not None:
+        cache.put(profile, out)
+
 
+def _finalize_intent(out: Any, profile: Dict[str, Any]) -> Dict[str, Any]:
     # Defensive canonicalize
     if isinstance(out, dict):
         out = _canonicalize_internal_goal_dict(out)
@@ -267,11 +323,102 @@ def parse_intent_internal_goal_with_llm(
             "errors": errors,
             "raw": out,
         }
+    return out
+
+
+def parse_intent_internal_goal_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Gọi LLM để sinh Internal Goal structured theo schema IntentInternalGoal.
+    Có cache theo (provider, model, schema, prompt hash), miss thì thử cache theo nghĩa goal_text.
+    """
+    prompt = _build_intent_prompt(profile)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = llm.response_cache_key(IntentInternalGoal, prompt_hash)
+
+    cached = _cached_llm_output("intent_prompt", key, INTENT_CACHE_TTL, IntentInternalGoal.__name__)
+    if cached is not None:
+        return cached
+
+    similar = _similar_intent(profile)
+    if similar is not None:
+        _store_llm_output("intent_prompt", key, similar, INTENT_CACHE_TTL)
+        return similar
+
+    try:
+        out = llm.generate_structured(prompt=prompt, schema_model=IntentInternalGoal)
+    except Exception as e:
+        out = _intent_failure(e)
+        _store_llm_output("intent_prompt", key, out, INTENT_CACHE_TTL)
+        return out
 
-    cache_set("intent_prompt", prompt_hash, out, ttl_seconds=INTENT_CACHE_TTL)
+    out = _finalize_intent(out, profile)
+    _store_llm_output("intent_prompt", key, out, INTENT_CACHE_TTL)
+    _remember_intent(profile, out)
     return out
 
 
+async def aparse_intent_internal_goal_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Bản async của parse_intent_internal_goal_with_llm (dùng chung cache)."""
+    prompt = _build_intent_prompt(profile)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = llm.response_cache_key(IntentInternalGoal, prompt_hash)
+
+    cached = await asyncio.to_thread(_cached_llm_output, "intent_prompt", key, INTENT_CACHE_TTL, IntentInternalGoal.__name__)
+    if cached is not None:
+        return cached
+
+    similar = await asyncio.to_thread(_similar_intent, profile)
+    if similar is not None:
+        await asyncio.to_thread(_store_llm_output, "intent_prompt", key, similar, INTENT_CACHE_TTL)
+        return similar
+
+    try:
+        out = await llm.agenerate_structured(prompt=prompt, schema_model=IntentInternalGoal)
+    except Exception as e:
+        out = _intent_failure(e)
+        await asyncio.to_thread(_store_llm_output, "intent_prompt", key, out, INTENT_CACHE_TTL)
+        return out
+
+    out = _finalize_intent(out, profile)
+    await asyncio.to_thread(_store_llm_output, "intent_prompt", key, out, INTENT_CACHE_TTL)
+    await asyncio.to_thread(_remember_intent, profile, out)
+    return out
+
+
+def _plan_static_prefix() -> str:
+    parts: List[str] = []
+    parts.append(f"[prompt {PLAN_PROMPT_VERSION}/{PLAN_OUTPUT_FORMAT}]")
+    parts.append("Nhiệm vụ: tạo lịch tập tuần dạng JSON đúng schema, chỉ được dùng exercise_id có trong danh sách.")
+    parts.append("")
+    parts.append("Yêu cầu output:")
+    parts.append("- Chỉ trả về JSON hợp lệ, không thêm chữ giải thích.")
+    if PLAN_OUTPUT_FORMAT == "compact":
+        parts.append("- Format compact: days[i].ex là list string 'exercise_id|sets|reps|rest_sec' (ví dụ '12|3|8-10|90').")
+        parts.append("  - Chỉ thêm '|notes' khi thật cần ghi chú.")
+    parts.append("- Không dùng id ngoài candidate list.")
+    parts.append("- Mỗi buổi tối đa max_exercises_per_day bài.")
+    parts.append("- Nếu constraints có min_exercises_per_day: mỗi buổi tối thiểu min_exercises_per_day bài.")
+    parts.append("- Nếu profile có training_days: days[i].day hoặc days[i].training_day BẮT BUỘC đúng theo training_days (theo thứ tự).")
+    parts.append("  - Dùng token mon..sun, không dùng tiếng Việt như Thứ 2.")
+    parts.append("- (Khuyến nghị) mỗi exercise nên có primary_muscle thuộc taxonomy để dễ đánh giá.")
+    parts.append("- Nếu có bản nháp trước đó + issues: sửa bản nháp để xử lý hết issues, giữ nguyên phần không liên quan.")
+    parts.append("")
+    parts.append(f"Muscle codes: {muscle_legend()}")
+    parts.append("Candidate format: id|title|muscles|equip|level")
+    parts.append("")
+    parts.append("=== Request ===")
+    return "\n".join(parts) + "\n"
+
+
+PLAN_STATIC_PREFIX = _plan_static_prefix()
+
+
 def _build_prompt(
     profile: Dict[str, Any],
     constraints: Dict[str, Any],
@@ -279,67 +426,96 @@ def _build_prompt(
     documents: Optional[List[Document]] = None,
     issues: Optional[List[Dict[str, Any]]] = None,
     prev_plan: Optional[Dict[str, Any]] = None,
+    variant: int = 0,
 ) -> str:
+    """
+    PLAN_STATIC_PREFIX (chung mọi request) + phần biến đổi, encode compact theo token budget
+    (PLAN_PROMPT_TOKEN_BUDGET):
+      - profile/constraints: JSON gọn, bỏ field null/rỗng
+      - candidate: 1 dòng id|title|muscle codes|equip|level, muscle code định nghĩa 1 lần ở legend
+      - plan trước đó: bảng day|exercise_id|sets|reps|rest_sec thay vì JSON đầy đủ
+      - số candidate = phần budget còn lại sau khi trừ các phần cố định
+      - variant > 0 (sinh nhiều phương án song song): thêm 1 dòng cuối để mỗi phương án có prompt/cache key riêng
+    """
     parts: List[str] = []
 
-    parts.append("Nhiệm vụ: tạo lịch tập tuần dạng JSON đúng schema, chỉ được dùng exercise_id có trong danh sách.")
-    parts.append("")
     parts.append("Input profile:")
-    parts.append(json.dumps(profile, ensure_ascii=False))
+    parts.append(compact_json(profile))
     parts.append("")
     parts.append("Constraints:")
-    parts.append(json.dumps(constraints, ensure_ascii=False))
-    parts.append("")
+    parts.append(compact_json(constraints))
+
+    # Calendar-aware labels
+    td = profile.get("training_days")
+    if isinstance(td, list) and td:
+        parts.append("")
+        parts.append(f"training_days (theo thứ tự): {td}")
 
+    parts.append("")
     parts.append("Candidate exercises (chỉ được chọn id trong danh sách này):")
-    if documents is not None:
-        parts.append(_format_candidate_lines_from_docs(documents, max_items=45))
-    else:
-        parts.append(_format_candidate_lines_fallback(candidates))
+    candidate_slot = len(parts)
+    parts.append("")
 
     if prev_plan:
         parts.append("")
         parts.append("Bản nháp trước đó (để sửa):")
-        parts.append(json.dumps(prev_plan, ensure_ascii=False))
+        parts.append(plan_header(prev_plan))
+        parts.append(plan_table(prev_plan))
 
     if issues:
         parts.append("")
         parts.append("Issues cần sửa (bắt buộc xử lý):")
-        parts.append(json.dumps(issues, ensure_ascii=False))
+        parts.extend(compact_json(i) for i in issues)
 
-    parts.append("")
-    parts.append("Yêu cầu output:")
-    parts.append("- Chỉ trả về JSON hợp lệ, không thêm chữ giải thích.")
-    parts.append("- Không dùng id ngoài candidate list.")
-    parts.append("- Mỗi buổi tối đa max_exercises_per_day bài.")
-    # Calendar-aware labels
-    td = profile.get("training_days")
-    if isinstance(td, list) and td:
-        parts.append(f"- BẮT BUỘC: days[i].day hoặc days[i].training_day phải đúng theo training_days (theo thứ tự): {td}.")
-        parts.append("  - Dùng token mon..sun, không dùng tiếng Việt như Thứ 2.")
-    parts.append("- (Khuyến nghị) mỗi exercise nên có primary_muscle thuộc taxonomy để dễ đánh giá.")
-    if constraints.get("min_exercises_per_day"):
-        parts.append("- Mỗi buổi tối thiểu min_exercises_per_day bài.")
+    if variant:
+        parts.append("")
+        parts.append(f"Phương án #{variant + 1}: ưu tiên tổ hợp bài khác phương án thông thường nếu vẫn đáp ứng đủ yêu cầu.")
 
-    return "\n".join(parts)
+    fixed_tokens = estimate_tokens(PLAN_STATIC_PREFIX) + estimate_tokens("\n".join(parts))
+    rows = fit_candidate_rows(
+        candidate_rows(candidates, documents),
+        budget_tokens=PLAN_PROMPT_TOKEN_BUDGET - fixed_tokens,
+    )
+    parts[candidate_slot] = "\n".join(rows)
 
+    return PLAN_STATIC_PREFIX + "\n".join(parts)
 
-def generate_plan_with_llm(
+
+def _plan_output_schema() -> Type[BaseModel]:
+    return CompactWorkoutPlan if PLAN_OUTPUT_FORMAT == "compact" else WorkoutPlan
+
+
+def _expand_plan_output(out: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    if PLAN_OUTPUT_FORMAT == "compact":
+        return expand_compact_plan(out, profile)
+    return out
+
+
+def _validate_day(day: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate 1 ngày đang stream theo format output, trả DayPlan dict."""
+    if PLAN_OUTPUT_FORMAT == "compact":
+        return expand_compact_day(CompactDayPlan.model_validate(day).model_dump())
+    return DayPlan.model_validate(day).model_dump(mode="json")
+
+
+def _prepare_plan_call(
     llm: LLMClient,
     profile: Dict[str, Any],
     constraints: Dict[str, Any],
     candidates: List[Dict[str, Any]],
-    issues: Optional[List[Dict[str, Any]]] = None,
-    prev_plan: Optional[Dict[str, Any]] = None,
-    documents: Optional[List[Document]] = None,
-) -> Dict[str, Any]:
+    issues: Optional[List[Dict[str, Any]]],
+    prev_plan: Optional[Dict[str, Any]],
+    documents: Optional[List[Document]],
+    variant: int = 0,
+) -> Tuple[Optional[Dict[str, Any]], str, str]:
+    """Guard + build prompt + tra cache. Return (kết quả sẵn có nếu có, prompt, cache key)."""
     guard_error = _guard_before_llm(
         profile=profile,
         constraints=constraints,
         candidates=candidates,
     )
     if guard_error is not None:
-        return guard_error
+        return guard_error, "", ""
 
     prompt = _build_prompt(
         profile=profile,
@@ -348,13 +524,475 @@ def generate_plan_with_llm(
         documents=documents,
         issues=issues,
         prev_plan=prev_plan,
+        variant=variant,
     )
 
     prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
-    cached = cache_get("plan_prompt", prompt_hash)
+    schema_model = _plan_output_schema()
+    key = llm.response_cache_key(schema_model, prompt_hash)
+    return _cached_llm_output("plan_prompt", key, PLAN_CACHE_TTL, schema_model.__name__), prompt, key
+
+
+def generate_plan_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    issues: Optional[List[Dict[str, Any]]] = None,
+    prev_plan: Optional[Dict[str, Any]] = None,
+    documents: Optional[List[Document]] = None,
+    variant: int = 0,
+) -> Dict[str, Any]:
+    ready, prompt, key = _prepare_plan_call(llm, profile, constraints, candidates, issues, prev_plan, documents, variant)
+    if ready is not None:
+        return ready
+
+    out = _expand_plan_output(llm.generate_structured(prompt=prompt, schema_model=_plan_output_schema()), profile)
+    _store_llm_output("plan_prompt", key, out, PLAN_CACHE_TTL)
+    return out
+
+
+async def agenerate_plan_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    issues: Optional[List[Dict[str, Any]]] = None,
+    prev_plan: Optional[Dict[str, Any]] = None,
+    documents: Optional[List[Document]] = None,
+    variant: int = 0,
+) -> Dict[str, Any]:
+    """Bản async của generate_plan_with_llm (dùng chung guard, prompt và cache)."""
+    ready, prompt, key = await asyncio.to_thread(
+        _prepare_plan_call, llm, profile, constraints, candidates, issues, prev_plan, documents, variant
+    )
+    if ready is not None:
+        return ready
+
+    out = _expand_plan_output(await llm.agenerate_structured(prompt=prompt, schema_model=_plan_output_schema()), profile)
+    await asyncio.to_thread(_store_llm_output, "plan_prompt", key, out, PLAN_CACHE_TTL)
+    return out
+
+
+def stream_plan_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    on_day: Callable[[int, Dict[str, Any]], None],
+    issues: Optional[List[Dict[str, Any]]] = None,
+    prev_plan: Optional[Dict[str, Any]] = None,
+    documents: Optional[List[Document]] = None,
+) -> Dict[str, Any]:
+    """
+    Như generate_plan_with_llm nhưng stream output của LLM:
+      - days[i] coi là xong khi LLM đã bắt đầu days[i+1] (hoặc stream kết thúc)
+      - validate từng ngày (DayPlan / CompactDayPlan + expand) rồi gọi on_day(index, day)
+      - bản cuối validate toàn bộ theo schema output rồi expand (như path không stream)
+    """
+    ready, prompt, key = _prepare_plan_call(llm, profile, constraints, candidates, issues, prev_plan, documents)
+    if ready is not None:
+        if not ready.get("error_type"):
+            for i, day in enumerate(ready.get("days") or []):
+                on_day(i, day)
+        return ready
+
+    emitted = 0
+    last: Dict[str, Any] = {}
+
+    def _emit_until(n: int) -> None:
+        nonlocal emitted
+        days = last.get("days") or []
+        while emitted < min(n, len(days)):
+            try:
+                day = _validate_day(days[emitted])
+            except ValueError:  # gồm ValidationError
+                day = None  # ngày lỗi schema: để bản validate cuối quyết định
+            if day is not None:
+                on_day(emitted, day)
+            emitted += 1
+
+    schema_model = _plan_output_schema()
+    for partial in llm.stream_structured(prompt, schema_model):
+        last = partial
+        _emit_until(len(last.get("days") or []) - 1)
+
+    last = schema_model.model_validate(last).model_dump(mode="json")
+    _emit_until(len(last["days"]))
+    out = _expand_plan_output(last, profile)
+
+    _store_llm_output("plan_prompt", key, out, PLAN_CACHE_TTL)
+    return out
+
+
+# ============================================================
+# Per-day generation (sửa / sinh riêng từng buổi với prompt nhỏ)
+# ============================================================
+DAY_PROMPT_VERSION = "day-v1"
+# day = issue gắn được với ngày cụ thể thì chỉ sinh lại các ngày đó | week = luôn sinh lại cả tuần
+PLAN_REGEN_SCOPE = (os.getenv("PLAN_REGEN_SCOPE") or "day").lower()
+# Lần sinh đầu: week = 1 call cho cả tuần | day = mỗi buổi 1 call nhỏ chạy song song rồi ghép (wall time ~ 1 buổi)
+PLAN_GENERATION_SCOPE = (os.getenv("PLAN_GENERATION_SCOPE") or "week").lower()
+# Số call per-day chạy đồng thời tối đa
+PLAN_DAY_CONCURRENCY = max(1, int(os.getenv("PLAN_DAY_CONCURRENCY") or 7))
+
+
+def _day_static_prefix() -> str:
+    parts: List[str] = []
+    parts.append(f"[prompt {DAY_PROMPT_VERSION}/{PLAN_OUTPUT_FORMAT}]")
+    parts.append("Nhiệm vụ: tạo (hoặc sửa) đúng 1 buổi tập dạng JSON đúng schema, chỉ được dùng exercise_id có trong danh sách.")
+    parts.append("")
+    parts.append("Yêu cầu output:")
+    parts.append("- Chỉ trả về JSON hợp lệ của 1 buổi, không thêm chữ giải thích.")
+    if PLAN_OUTPUT_FORMAT == "compact":
+        parts.append("- Format compact: ex là list string 'exercise_id|sets|reps|rest_sec' (ví dụ '12|3|8-10|90').")
+    parts.append("- day BẮT BUỘC giữ đúng giá trị ở dòng 'day:'.")
+    parts.append("- Ưu tiên bài thuộc focus theo thứ tự rank.")
+    parts.append("- Không dùng id ngoài candidate list; tránh id đã dùng ở ngày khác.")
+    parts.append("- Số bài trong khoảng min_exercises_per_day..max_exercises_per_day của constraints, vừa session_minutes.")
+    parts.append("- Nếu có buổi trước đó + issues: sửa buổi đó để xử lý hết issues, giữ nguyên phần không liên quan.")
+    parts.append("")
+    parts.append(f"Muscle codes: {muscle_legend()}")
+    parts.append("Candidate format: id|title|muscles|equip|level")
+    parts.append("")
+    parts.append("=== Request ===")
+    return "\n".join(parts) + "\n"
+
+
+DAY_STATIC_PREFIX = _day_static_prefix()
+
+
+def _day_output_schema() -> Type[BaseModel]:
+    return CompactDayPlan if PLAN_OUTPUT_FORMAT == "compact" else DayPlan
+
+
+def _day_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Chỉ phần profile ảnh hưởng tới 1 buổi (prompt nhỏ, cache trúng giữa user giống nhau)."""
+    internal_goal = profile.get("internal_goal") or {}
+    return {
+        "goal_text": profile.get("goal_text"),
+        "goal_style": internal_goal.get("goal_style"),
+        "session_minutes": profile.get("session_minutes"),
+        "experience": profile.get("experience"),
+        "equipment": profile.get("equipment"),
+    }
+
+
+def _focus_first(candidates: List[Dict[str, Any]], focus: List[str]) -> List[Dict[str, Any]]:
+    """Candidate có muscle thuộc focus lên trước (giữ thứ tự rank retrieval trong từng nhóm)."""
+    wanted = set(focus)
+    hit = [c for c in candidates if wanted & {str(m).lower() for m in c.get("muscle_groups") or []}]
+    hit_ids = {id(c) for c in hit}
+    return hit + [c for c in candidates if id(c) not in hit_ids]
+
+
+def _build_day_prompt(
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    training_day: str,
+    focus: List[str],
+    avoid_ids: Optional[List[int]] = None,
+    prev_day: Optional[Dict[str, Any]] = None,
+    issues: Optional[List[Dict[str, Any]]] = None,
+) -> str:
+    parts: List[str] = []
+    parts.append(f"day: {training_day}")
+    parts.append(f"focus (theo rank): {', '.join(focus)}")
+    parts.append("Input profile:")
+    parts.append(compact_json(_day_profile(profile)))
+    parts.append("Constraints:")
+    parts.append(compact_json(constraints))
+    parts.append("")
+    parts.append("Candidate exercises (chỉ được chọn id trong danh sách này):")
+    candidate_slot = len(parts)
+    parts.append("")
+
+    if avoid_ids:
+        parts.append(f"Đã dùng ở ngày khác (tránh lặp lại): {','.join(str(x) for x in avoid_ids)}")
+
+    if prev_day:
+        parts.append("")
+        parts.append("Buổi trước đó (để sửa):")
+        parts.append(plan_table({"days": [prev_day]}))
+
+    if issues:
+        parts.append("")
+        parts.append("Issues cần sửa (bắt buộc xử lý):")
+        parts.extend(compact_json(i) for i in issues)
+
+    # Prompt 1 buổi: nửa budget của prompt cả tuần là đủ
+    fixed_tokens = estimate_tokens(DAY_STATIC_PREFIX) + estimate_tokens("\n".join(parts))
+    rows = fit_candidate_rows(
+        candidate_rows(_focus_first(candidates, focus)),
+        budget_tokens=PLAN_PROMPT_TOKEN_BUDGET // 2 - fixed_tokens,
+    )
+    parts[candidate_slot] = "\n".join(rows)
+
+    return DAY_STATIC_PREFIX + "\n".join(parts)
+
+
+def issue_day_indexes(
+    issues: Optional[List[Dict[str, Any]]],
+    plan: Optional[Dict[str, Any]],
+) -> Optional[List[int]]:
+    """
+    Map issues → index các ngày bị ảnh hưởng trong plan.
+    None nếu có issue không gắn với ngày cụ thể (phải sinh lại cả tuần) hoặc PLAN_REGEN_SCOPE=week.
+    """
+    if PLAN_REGEN_SCOPE != "day" or not issues or not plan:
+        return None
+    labels = [str(d.get("day") or "").strip().lower() for d in plan.get("days") or []]
+    out: Set[int] = set()
+    for issue in issues:
+        day = str((issue or {}).get("day") or "").strip().lower()
+        if not day or day not in labels:
+            return None
+        out.add(labels.index(day))
+    return sorted(out)
+
+
+def _day_call_args(
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    plan: Dict[str, Any],
+    index: int,
+    issues: Optional[List[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """Tham số _build_day_prompt cho ngày thứ index của plan (focus theo weekly_focus_by_day)."""
+    days = plan.get("days") or []
+    prev_day = days[index]
+    label = str(prev_day.get("day") or "")
+    focus = dict(focus_by_day(profile)).get(label.lower(), [])
+    avoid = sorted({
+        int(ex["exercise_id"])
+        for i, d in enumerate(days) if i != index
+        for ex in d.get("exercises") or []
+    })
+    day_issues = [i for i in issues or [] if str(i.get("day") or "").strip().lower() == label.lower()]
+    return dict(
+        profile=profile,
+        constraints=constraints,
+        candidates=candidates,
+        training_day=label,
+        focus=focus,
+        avoid_ids=avoid,
+        prev_day=prev_day,
+        issues=day_issues,
+    )
+
+
+def _prepare_day_call(llm: LLMClient, prompt_args: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str, str]:
+    prompt = _build_day_prompt(**prompt_args)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    schema_model = _day_output_schema()
+    key = llm.response_cache_key(schema_model, prompt_hash)
+    return _cached_llm_output("day_prompt", key, PLAN_CACHE_TTL, schema_model.__name__), prompt, key
+
+
+def _finish_day(out: Dict[str, Any], training_day: str) -> Dict[str, Any]:
+    day = _validate_day(out)
+    return {**day, "day": training_day}  # giữ nhãn ngày của plan gốc
+
+
+def generate_day_with_llm(llm: LLMClient, prompt_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Sinh 1 DayPlan (dict) từ prompt nhỏ của 1 buổi."""
+    cached, prompt, key = _prepare_day_call(llm, prompt_args)
     if cached is not None:
         return cached
 
-    out = llm.generate_plan_json(prompt=prompt)
-    cache_set("plan_prompt", prompt_hash, out, ttl_seconds=PLAN_CACHE_TTL)
+    out = _finish_day(llm.generate_structured(prompt=prompt, schema_model=_day_output_schema()), prompt_args["training_day"])
+    _store_llm_output("day_prompt", key, out, PLAN_CACHE_TTL)
     return out
+
+
+async def agenerate_day_with_llm(llm: LLMClient, prompt_args: Dict[str, Any]) -> Dict[str, Any]:
+    cached, prompt, key = await asyncio.to_thread(_prepare_day_call, llm, prompt_args)
+    if cached is not None:
+        return cached
+
+    out = _finish_day(await llm.agenerate_structured(prompt=prompt, schema_model=_day_output_schema()), prompt_args["training_day"])
+    await asyncio.to_thread(_store_llm_output, "day_prompt", key, out, PLAN_CACHE_TTL)
+    return out
+
+
+def _splice_days(plan: Dict[str, Any], new_days: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    days = [new_days.get(i, d) for i, d in enumerate(plan.get("days") or [])]
+    return WorkoutPlan.model_validate({**plan, "days": days}).model_dump(mode="json")
+
+
+def _run_days(
+    llm: LLMClient,
+    calls: Dict[int, Dict[str, Any]],
+    on_day: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Chạy các call 1 buổi song song trên thread pool (tối đa PLAN_DAY_CONCURRENCY).
+    Mỗi task chạy trong bản copy contextvars để llm_call_scope của node vẫn ghi nhận call.
+    on_day gọi ở thread hiện tại, theo thứ tự ngày nào xong trước.
+    """
+    out: Dict[int, Dict[str, Any]] = {}
+    if len(calls) <= 1:
+        for i, args in calls.items():
+            out[i] = generate_day_with_llm(llm, args)
+            if on_day is not None:
+                on_day(i, out[i])
+        return out
+
+    with ThreadPoolExecutor(max_workers=min(PLAN_DAY_CONCURRENCY, len(calls))) as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, generate_day_with_llm, llm, args): i
+            for i, args in calls.items()
+        }
+        try:
+            for fut in as_completed(futures):
+                i = futures[fut]
+                out[i] = fut.result()
+                if on_day is not None:
+                    on_day(i, out[i])
+        except Exception:
+            for fut in futures:
+                fut.cancel()
+            raise
+    return out
+
+
+async def _arun_days(llm: LLMClient, calls: Dict[int, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    sem = asyncio.Semaphore(PLAN_DAY_CONCURRENCY)
+
+    async def _one(args: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            return await agenerate_day_with_llm(llm, args)
+
+    days = await asyncio.gather(*(_one(args) for args in calls.values()))
+    return dict(zip(calls.keys(), days))
+
+
+def split_candidates_by_day(
+    candidates: List[Dict[str, Any]],
+    focus: List[List[str]],
+    min_size: int = 8,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Chia candidate thành subset rời nhau theo ngày để các call song song không chọn trùng bài:
+      - candidate thuộc ngày mà muscle đầu tiên khớp focus có rank cao nhất (hoà → ngày đang ít candidate hơn)
+      - candidate không khớp focus ngày nào chia cho ngày đang ít candidate nhất, xếp sau candidate khớp focus
+      - subset < min_size (pack quá nhỏ) mới bù bằng candidate của ngày khác (theo thứ tự rank retrieval)
+    """
+    own: List[List[Dict[str, Any]]] = [[] for _ in focus]
+    rest: List[List[Dict[str, Any]]] = [[] for _ in focus]
+    rank = [{m: r for r, m in enumerate(muscles)} for muscles in focus]
+    unmatched: List[Dict[str, Any]] = []
+
+    for c in candidates:
+        muscles = [str(m).strip().lower() for m in c.get("muscle_groups") or []]
+        muscle = next((m for m in muscles if any(m in r for r in rank)), None)
+        if muscle is None:
+            unmatched.append(c)
+            continue
+        best = min(
+            (i for i, r in enumerate(rank) if muscle in r),
+            key=lambda i: (rank[i][muscle], len(own[i]), i),
+        )
+        own[best].append(c)
+
+    for c in unmatched:
+        best = min(range(len(focus)), key=lambda i: (len(own[i]) + len(rest[i]), i))
+        rest[best].append(c)
+
+    out: List[List[Dict[str, Any]]] = []
+    for matched, extra in zip(own, rest):
+        subset = matched + extra
+        if len(subset) < min_size:
+            taken = {id(c) for c in subset}
+            subset += [c for c in candidates if id(c) not in taken][: min_size - len(subset)]
+        out.append(subset)
+    return out
+
+
+def _by_day_calls(
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+) -> Dict[int, Dict[str, Any]]:
+    """Tham số _build_day_prompt theo index ngày cho lần sinh per-day đầu tiên."""
+    focus = focus_by_day(profile)
+    max_ex = int(constraints.get("max_exercises_per_day") or 6)
+    subsets = split_candidates_by_day(candidates, [m for _, m in focus], min_size=max_ex)
+    return {
+        i: dict(
+            profile=profile,
+            constraints=constraints,
+            candidates=subset,
+            training_day=training_day,
+            focus=muscles,
+        )
+        for i, ((training_day, muscles), subset) in enumerate(zip(focus, subsets))
+    }
+
+
+def generate_plan_by_day_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    on_day: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    PLAN_GENERATION_SCOPE=day: mỗi training day 1 call nhỏ (focus của ngày + subset candidate rời nhau),
+    chạy song song rồi ghép thành WorkoutPlan. Ràng buộc liên ngày (lặp bài trong tuần...) để evaluate_plan kiểm.
+    """
+    guard_error = _guard_before_llm(profile=profile, constraints=constraints, candidates=candidates)
+    if guard_error is not None:
+        return guard_error
+
+    days = _run_days(llm, _by_day_calls(profile, constraints, candidates), on_day=on_day)
+    return assemble_plan(profile, [days[i] for i in sorted(days)])
+
+
+async def agenerate_plan_by_day_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Bản async của generate_plan_by_day_with_llm (asyncio.gather thay cho thread pool)."""
+    guard_error = _guard_before_llm(profile=profile, constraints=constraints, candidates=candidates)
+    if guard_error is not None:
+        return guard_error
+
+    days = await _arun_days(llm, _by_day_calls(profile, constraints, candidates))
+    return assemble_plan(profile, [days[i] for i in sorted(days)])
+
+
+def regenerate_days_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    prev_plan: Dict[str, Any],
+    issues: List[Dict[str, Any]],
+    day_indexes: List[int],
+    on_day: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Sửa theo phạm vi issue: chỉ sinh lại các ngày trong day_indexes (prompt 1 buổi: focus,
+    candidate ưu tiên focus, buổi cũ + issues của ngày đó; các ngày chạy song song), rồi ghép lại vào plan cũ.
+    """
+    calls = {i: _day_call_args(profile, constraints, candidates, prev_plan, i, issues) for i in day_indexes}
+    return _splice_days(prev_plan, _run_days(llm, calls, on_day=on_day))
+
+
+async def aregenerate_days_with_llm(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    prev_plan: Dict[str, Any],
+    issues: List[Dict[str, Any]],
+    day_indexes: List[int],
+) -> Dict[str, Any]:
+    """Bản async của regenerate_days_with_llm."""
+    calls = {i: _day_call_args(profile, constraints, candidates, prev_plan, i, issues) for i in day_indexes}
+    return _splice_days(prev_plan, await _arun_days(llm, calls))
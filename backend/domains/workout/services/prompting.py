@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+from backend.domains.workout.contract import MUSCLE_TAXONOMY
+
+# Budget token cho toàn bộ prompt plan; số candidate đưa vào prompt được chọn theo phần còn lại
+PLAN_PROMPT_TOKEN_BUDGET = int(os.getenv("PLAN_PROMPT_TOKEN_BUDGET") or 3000)
+PLAN_PROMPT_MIN_CANDIDATES = 20  # khớp min_candidates của _guard_before_llm
+PLAN_PROMPT_MAX_CANDIDATES = 45
+
+# Mã ngắn cho muscle (định nghĩa 1 lần ở legend thay vì lặp tên đầy đủ mỗi dòng)
+MUSCLE_CODES: Dict[str, str] = {
+    "chest": "CH",
+    "shoulders": "SH",
+    "triceps": "TR",
+    "back": "BK",
+    "biceps": "BI",
+    "quadriceps": "QD",
+    "hamstrings": "HM",
+    "hips": "HP",
+    "calves": "CV",
+    "core": "CO",
+}
+assert set(MUSCLE_CODES) == set(MUSCLE_TAXONOMY), "MUSCLE_CODES lệch MUSCLE_TAXONOMY"
+
+
+# -----------------------------
+# Token estimate
+# -----------------------------
+@lru_cache(maxsize=1)
+def _tiktoken_encoder() -> Any:
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_TOKEN_PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Đếm token bằng tiktoken nếu có; không thì ước lượng theo word/số/ký tự đặc biệt (dấu tiếng Việt tính riêng)."""
+    text = text or ""
+    enc = _tiktoken_encoder()
+    if enc is not None:
+        return len(enc.encode(text))
+    return len(_TOKEN_PIECE_RE.findall(text))
+
+
+# -----------------------------
+# Compact encoders
+# -----------------------------
+def _drop_empty(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        out = {k: _drop_empty(v) for k, v in obj.items()}
+        return {k: v for k, v in out.items() if v not in (None, "", [], {})}
+    if isinstance(obj, list):
+        return [_drop_empty(v) for v in obj if v is not None]
+    return obj
+
+
+def compact_json(obj: Any) -> str:
+    """JSON không khoảng trắng, bỏ field null/rỗng."""
+    return json.dumps(_drop_empty(obj), ensure_ascii=False, separators=(",", ":"))
+
+
+def muscle_legend() -> str:
+    return ", ".join(f"{code}={m}" for m, code in MUSCLE_CODES.items())
+
+
+def _muscle_codes(muscles: List[Any]) -> str:
+    return ",".join(MUSCLE_CODES.get(str(m).lower(), str(m)) for m in muscles)
+
+
+def _candidate_row(eid: Any, title: str, muscles: List[Any], equipment: List[Any], level: str) -> str:
+    return "|".join([
+        str(eid),
+        title or "",
+        _muscle_codes(muscles or []),
+        ",".join(map(str, equipment or [])),
+        level or "",
+    ]).rstrip("|")
+
+
+def candidate_rows(
+    candidates: List[Dict[str, Any]],
+    documents: Optional[List[Document]] = None,
+) -> List[str]:
+    """1 dòng/candidate: id|title|muscle codes|equip|level (thứ tự giữ nguyên theo retrieval/rerank)."""
+    if documents is not None:
+        return [
+            _candidate_row(
+                (d.metadata or {}).get("id"),
+                (d.metadata or {}).get("title", ""),
+                (d.metadata or {}).get("muscle_groups") or [],
+                (d.metadata or {}).get("equipment") or [],
+                (d.metadata or {}).get("level") or "",
+            )
+            for d in documents
+        ]
+    return [
+        _candidate_row(c["id"], c.get("title", ""), c.get("muscle_groups") or [], c.get("equipment") or [], c.get("level") or "")
+        for c in candidates
+    ]
+
+
+def fit_candidate_rows(rows: List[str], budget_tokens: int) -> List[str]:
+    """
+    Lấy prefix của rows vừa budget (rows đã sort theo độ liên quan).
+    Luôn giữ tối thiểu PLAN_PROMPT_MIN_CANDIDATES, tối đa PLAN_PROMPT_MAX_CANDIDATES.
+    """
+    out: List[str] = []
+    used = 0
+    for row in rows[:PLAN_PROMPT_MAX_CANDIDATES]:
+        cost = estimate_tokens(row) + 1  # +1 cho newline
+        if len(out) >= PLAN_PROMPT_MIN_CANDIDATES and used + cost > budget_tokens:
+            break
+        out.append(row)
+        used += cost
+    return out
+
+
+def plan_table(plan: Dict[str, Any]) -> str:
+    """
+    Plan trước đó dạng bảng 1 dòng/bài: day|exercise_id|sets|reps|rest_sec.
+    Dễ so sánh/sửa từng dòng hơn JSON lồng nhau và rẻ token hơn nhiều.
+    """
+    lines = ["day|exercise_id|sets|reps|rest_sec"]
+    for d in (plan or {}).get("days") or []:
+        for ex in d.get("exercises") or []:
+            lines.append("|".join(str(x) for x in (
+                d.get("day", ""),
+                ex.get("exercise_id", ""),
+                ex.get("sets", ""),
+                ex.get("reps", ""),
+                ex.get("rest_sec", ""),
+            )))
+    return "\n".join(lines)
+
+
+def plan_header(plan: Dict[str, Any]) -> str:
+    """Các field cấp plan (goal/split/...) ngoài days."""
+    return compact_json({k: v for k, v in (plan or {}).items() if k != "days"})
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from backend.domains.workout.schemas import WorkoutPlan
+from backend.domains.workout.services.template_plan import (
+    focus_by_day,
+    muscle_index,
+    pick_day_exercises,
+    prescription_for,
+)
+
+# Sửa plan bằng code trước khi nhờ LLM sửa: local = bật | off = mọi issue quay lại LLM như cũ
+PLAN_REPAIR = (os.getenv("PLAN_REPAIR") or "local").lower()
+
+# Issue sửa được cơ học (không cần LLM)
+REPAIRABLE_ISSUE_TYPES = frozenset({
+    "invalid_exercise_id",
+    "too_many_exercises",
+    "too_few_exercises",
+    "exercise_repeated",
+})
+
+
+def can_repair(issues: List[Dict[str, Any]]) -> bool:
+    return PLAN_REPAIR == "local" and any(
+        isinstance(i, dict) and i.get("type") in REPAIRABLE_ISSUE_TYPES for i in issues or []
+    )
+
+
+def _as_int(v: Any) -> Optional[int]:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _day_focus(plan_days: List[Dict[str, Any]], profile: Dict[str, Any]) -> List[List[str]]:
+    """Focus muscles (theo rank) cho từng ngày của plan: khớp theo tên ngày, không có thì theo thứ tự."""
+    focus = focus_by_day(profile)
+    by_day = {td: muscles for td, muscles in focus}
+    out: List[List[str]] = []
+    for i, d in enumerate(plan_days):
+        label = str(d.get("day") or "").strip().lower()
+        if label in by_day:
+            out.append(by_day[label])
+        elif i < len(focus):
+            out.append(focus[i][1])
+        else:
+            out.append([])
+    return out
+
+
+def _least_covered(muscles: List[str], day_ids: List[int], primary_of: Dict[int, str]) -> Optional[str]:
+    if not muscles:
+        return None
+    counts = {m: 0 for m in muscles}
+    for eid in day_ids:
+        m = primary_of.get(eid)
+        if m in counts:
+            counts[m] += 1
+    return min(muscles, key=lambda m: (counts[m], muscles.index(m)))
+
+
+def repair_plan(
+    draft_plan: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Sửa các issue cơ học của draft (không gọi LLM). Return (plan đã sửa, danh sách thao tác).
+      - exercise_id ngoài candidate pack, hoặc lặp quá max_repeat_same_exercise_per_week
+        → thay bằng candidate rank cao nhất của focus muscle đang ít bài nhất trong ngày
+      - quá max_exercises_per_day → bỏ bài có primary muscle rank thấp nhất trong focus của ngày
+      - ít hơn min_exercises_per_day → bổ sung theo focus (như template_plan), sets/reps/rest theo bài sẵn có
+    """
+    if not isinstance(draft_plan, dict) or draft_plan.get("error_type") or not candidates:
+        return draft_plan, []
+
+    primary, any_muscle = muscle_index(candidates)
+    primary_of = {eid: m for m, ids in primary.items() for eid in ids}
+    all_ids = [int(c["id"]) for c in candidates if c.get("id") is not None]
+    valid_ids = set(all_ids)
+
+    max_ex = _as_int(constraints.get("max_exercises_per_day"))
+    min_ex = _as_int(constraints.get("min_exercises_per_day"))
+    max_repeat = _as_int(constraints.get("max_repeat_same_exercise_per_week"))
+    week_limit = max_repeat + 1 if max_repeat is not None else None
+    # Số buổi trong tuần có bài (1 bài lặp trong cùng buổi vẫn tính 1 lần, giống evaluate_plan)
+    week_count: Dict[int, int] = {}
+    internal_goal = profile.get("internal_goal") or {}
+
+    days = [dict(d) for d in draft_plan.get("days") or []]
+    focus = _day_focus(days, profile)
+    used_week: Set[int] = {
+        eid for d in days for ex in d.get("exercises") or [] for eid in [_as_int(ex.get("exercise_id"))] if eid in valid_ids
+    }
+    actions: List[str] = []
+
+    for d, muscles in zip(days, focus):
+        label = d.get("day") or "day"
+        exercises: List[Dict[str, Any]] = []
+        counted: Set[int] = set()
+
+        # 1) id không hợp lệ / lặp quá giới hạn tuần → thay thế
+        for ex in d.get("exercises") or []:
+            eid = _as_int(ex.get("exercise_id"))
+            if eid in valid_ids and (eid in counted or week_limit is None or week_count.get(eid, 0) < week_limit):
+                if eid not in counted:
+                    counted.add(eid)
+                    week_count[eid] = week_count.get(eid, 0) + 1
+                exercises.append(dict(ex))
+                continue
+
+            day_ids = [e["exercise_id"] for e in exercises]
+            muscle = _least_covered(muscles, day_ids, primary_of)
+            replacement = pick_day_exercises(
+                [muscle] if muscle else [], len(day_ids) + 1, primary, any_muscle, all_ids, used_week, picked=day_ids,
+            )[len(day_ids):]
+            if replacement:
+                used_week.add(replacement[0])
+                counted.add(replacement[0])
+                week_count[replacement[0]] = week_count.get(replacement[0], 0) + 1
+                exercises.append({**ex, "exercise_id": replacement[0]})
+                actions.append(f"{label}: replace {ex.get('exercise_id')} -> {replacement[0]}")
+            else:
+                actions.append(f"{label}: drop {ex.get('exercise_id')}")
+
+        # 2) quá nhiều bài → giữ bài có primary muscle rank cao, giữ nguyên thứ tự trong ngày
+        if max_ex is not None and len(exercises) > max_ex:
+            rank = {m: i for i, m in enumerate(muscles)}
+            order = sorted(
+                range(len(exercises)),
+                key=lambda i: (rank.get(primary_of.get(exercises[i]["exercise_id"], ""), len(muscles)), i),
+            )
+            keep = sorted(order[:max_ex])
+            dropped = [exercises[i]["exercise_id"] for i in order[max_ex:]]
+            exercises = [exercises[i] for i in keep]
+            for eid in set(dropped) - {e["exercise_id"] for e in exercises}:
+                week_count[eid] -= 1
+            actions.append(f"{label}: trim {dropped}")
+
+        # 3) quá ít bài → bổ sung theo focus
+        if min_ex is not None and len(exercises) < min_ex:
+            day_ids = [e["exercise_id"] for e in exercises]
+            added = pick_day_exercises(muscles, min_ex, primary, any_muscle, all_ids, used_week, picked=day_ids)[len(day_ids):]
+            if exercises:
+                sets, reps, rest = exercises[0]["sets"], exercises[0]["reps"], exercises[0]["rest_sec"]
+            else:
+                sets, reps, rest = prescription_for(internal_goal.get("goal_style"), profile.get("experience"))
+            for eid in added:
+                used_week.add(eid)
+                week_count[eid] = week_count.get(eid, 0) + 1
+                exercises.append({"exercise_id": eid, "sets": sets, "reps": reps, "rest_sec": rest, "notes": ""})
+            if added:
+                actions.append(f"{label}: add {added}")
+
+        d["exercises"] = exercises
+
+    if not actions:
+        return draft_plan, []
+    repaired = WorkoutPlan.model_validate({**draft_plan, "days": days}).model_dump(mode="json")
+    return repaired, actions
@@ -1,19 +1,29 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import asyncio
+import os
+from typing import Any, Dict, Iterator, List, Optional
+from asgiref.sync import sync_to_async
 from langchain_core.documents import Document
 from django.db import connection
 
+from backend.services.embedding_index import get_active_embedding_index
+from backend.services.query_vectors import aembed_query_cached, embed_queries_cached
 from backend.services.retriever import retrieve_exercises
 from backend.services.rerank_service import get_rerank_service
 from backend.shared.simple_cache import cache_get, cache_set
-from backend.domains.workout.contract import MUSCLE_TAXONOMY, is_valid_muscle
+from backend.domains.workout.contract import GOAL_STYLE_ENUM, MUSCLE_TAXONOMY, is_valid_muscle
 
 
 DEFAULT_K = 55  # Giới hạn retriever: top_k = 50-60
 RETRIEVAL_CACHE_TTL = 900  # 15 phút
 USE_RERANK = True  # Bật/tắt rerank
 RERANK_TOP_N = 30  # Số lượng candidates sau rerank
+# Prefetch pool theo taxonomy song song với intent (graph fan-out sau constraints):
+# off = retrieval chờ intent xong mới truy vấn như cũ (mặc định) | on = bật
+# Pool query theo goal_text nên chỉ dùng được khi pack cũng query theo goal_text (intent không có goal_style)
+RETRIEVAL_PREFETCH = (os.getenv("RETRIEVAL_PREFETCH") or "off").lower()
+PREFETCH_PER_MUSCLE = max(10, DEFAULT_K // 2)  # đủ cho pack từ 2 priority muscles; 1 muscle thì truy vấn bù
 
 
 def _distance_to_score(distance: Any) -> float:
@@ -29,7 +39,28 @@ def _distance_to_score(distance: Any) -> float:
         return 0.8
 
 
-def build_candidate_pack(profile: Dict[str, Any], constraints: Dict[str, Any]) -> List[Dict[str, Any]]:
+def semantic_query_for_muscle(query_base: str, muscle: str) -> str:
+    return f"{query_base} exercise for {muscle}"
+
+
+def global_semantic_query(query_base: str) -> str:
+    return f"{query_base} workout exercise"
+
+
+def iter_semantic_query_vocabulary() -> Iterator[str]:
+    """
+    Toàn bộ query semantic sinh ra khi query_base là goal_style (closed vocabulary):
+    goal_style × muscle + global query cho mỗi goal_style.
+    Dùng để precompute query vectors (management command precompute_query_embeddings).
+    """
+    for goal_style in GOAL_STYLE_ENUM:
+        for m in MUSCLE_TAXONOMY:
+            yield semantic_query_for_muscle(goal_style, m)
+        yield global_semantic_query(goal_style)
+
+
+def _pack_context(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuẩn hóa input cho candidate pack: muscles, query_base, per_muscle, cache_key."""
     goal_text = (profile.get("goal_text") or "").strip().lower()
     internal_goal = profile.get("internal_goal") or {}
     goal_style = (internal_goal.get("goal_style") or "").strip().lower()
@@ -49,11 +80,6 @@ def build_candidate_pack(profile: Dict[str, Any], constraints: Dict[str, Any]) -
     # query hint: ưu tiên goal_style, fallback goal_text
     query_base = goal_style or goal_text or "general_fitness"
 
-
-    per_muscle = max(10, DEFAULT_K // max(1, len(base_muscles)))
-    candidates: List[Dict[str, Any]] = []
-    seen: set[int] = set()
-
     # Cache retrieval theo profile để tránh tốn chi phí khi user spam cùng input
     cache_key = (
         "retrieval_v1",
@@ -66,109 +92,302 @@ def build_candidate_pack(profile: Dict[str, Any], constraints: Dict[str, Any]) -
         profile.get("seed"),
     )
 
-    cached = cache_get("retrieval_candidates", cache_key)
-    if cached is not None:
-        return cached
+    return {
+        "goal_text": goal_text,
+        "goal_style": goal_style,
+        "base_muscles": base_muscles,
+        "query_base": query_base,
+        "per_muscle": max(10, DEFAULT_K // max(1, len(base_muscles))),
+        "cache_key": cache_key,
+    }
+
+
+def _pack_semantic_queries(ctx: Dict[str, Any], pool: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Các query semantic mà _collect_candidates có thể dùng (để embed trước 1 lần); bỏ slice đã có trong pool."""
+    queries = [
+        semantic_query_for_muscle(ctx["query_base"], m)
+        for m in ctx["base_muscles"]
+        if m and _pool_slice(pool, m, ctx["per_muscle"]) is None
+    ]
+    if not pool or pool.get("global") is None:
+        queries.append(global_semantic_query(ctx["query_base"]))
+    return queries
+
+
+def _embed_queries(queries: List[str]) -> Dict[str, List[float]]:
+    """Embed các query semantic bằng 1 call batch (path sync); query có vector precompute thì không embed."""
+    index = get_active_embedding_index()
+    return embed_queries_cached(queries, output_dim=index.dim, provider=index.provider, model=index.model)
+
+
+async def _aembed_queries(queries: List[str]) -> Dict[str, List[float]]:
+    index = get_active_embedding_index()
+    queries = list(dict.fromkeys(queries))
+    vectors = await asyncio.gather(
+        *[
+            aembed_query_cached(q, output_dim=index.dim, provider=index.provider, model=index.model)
+            for q in queries
+        ]
+    )
+    return dict(zip(queries, vectors))
+
+
+def _candidate_row(ex: Any, reason: str, default_score: float) -> Dict[str, Any]:
+    dist = getattr(ex, "distance", None)
+    return {
+        "id": ex.id,
+        "title": ex.title,
+        "muscle_groups": ex.muscle_groups or [],
+        "image_url": ex.image_url,
+        "image_file": ex.image_file,
+        "score": float(_distance_to_score(dist) if dist is not None else default_score),
+        "reason": reason,
+    }
+
+
+def _muscle_slice(
+    m: str,
+    query_base: str,
+    limit: int,
+    use_semantic: bool,
+    query_vectors: Dict[str, List[float]],
+) -> List[Dict[str, Any]]:
+    """Tối đa limit candidate cho 1 muscle (semantic/q-based trước, thiếu thì bù muscle-only)."""
+    semantic_q = semantic_query_for_muscle(query_base, m)
+
+    # 1) Thử semantic (Postgres) hoặc q-based (fallback) trước
+    objs = retrieve_exercises(
+        q=semantic_q if use_semantic else "",
+        muscles=[m],
+        limit=limit,
+        use_semantic=use_semantic,
+        query_vector=query_vectors.get(semantic_q),
+    )
 
-    # Semantic chỉ hữu ích khi Postgres + pgvector + có embedding
-    use_semantic = (connection.vendor == "postgresql")
+    # 2) Nếu quá ít (hoặc SQLite), fallback sang muscle-only để chắc chắn có pool
+    if len(objs) < max(3, limit // 3):
+        more = retrieve_exercises(
+            q=None,
+            muscles=[m],
+            limit=limit,
+            use_semantic=False,
+        )
+        # nối thêm nhưng vẫn unique theo id
+        if more:
+            # giữ ưu tiên objs trước
+            ids_in_objs = {x.id for x in objs}
+            for x in more:
+                if x.id not in ids_in_objs:
+                    objs.append(x)
+                if len(objs) >= limit:
+                    break
+
+    return [
+        _candidate_row(
+            ex,
+            f"{'semantic' if (use_semantic and getattr(ex, 'distance', None) is not None) else 'muscle'}:{m}",
+            0.9,
+        )
+        for ex in objs
+    ]
 
-    for m in base_muscles:
-        m = (m or "").strip().lower()
-        if not m:
-            continue
 
-        semantic_q = f"{query_base} exercise for {m}"
+def _global_slice(query_base: str, use_semantic: bool, query_vectors: Dict[str, List[float]]) -> List[Dict[str, Any]]:
+    global_q = global_semantic_query(query_base)
+    objs = retrieve_exercises(
+        q=global_q if use_semantic else None,
 
-        # 1) Thử semantic (Postgres) hoặc q-based (fallback) trước
-        objs = retrieve_exercises(
-            q=semantic_q if use_semantic else "",
-            muscles=[m],
-            limit=per_muscle,
-            use_semantic=use_semantic,
+        muscles=[],
+        limit=50,
+        use_semantic=use_semantic,
+        query_vector=query_vectors.get(global_q),
+    )
+
+    # Nếu vẫn ít, fallback sang lấy theo id (hoặc keyword rộng)
+    if len(objs) < 10:
+        objs = retrieve_exercises(q=None, muscles=[], limit=50, use_semantic=False)
+
+    return [
+        _candidate_row(
+            ex,
+            "semantic_fallback_pool" if (use_semantic and getattr(ex, "distance", None) is not None) else "fallback_pool",
+            0.5,
         )
+        for ex in objs
+    ]
 
-        # 2) Nếu quá ít (hoặc SQLite), fallback sang muscle-only để chắc chắn có pool
-        if len(objs) < max(3, per_muscle // 3):
-            more = retrieve_exercises(
-                q=None,
-                muscles=[m],
-                limit=per_muscle,
-                use_semantic=False,
-            )
-            # nối thêm nhưng vẫn unique theo id
-            if more:
-                # giữ ưu tiên objs trước
-                ids_in_objs = {x.id for x in objs}
-                for x in more:
-                    if x.id not in ids_in_objs:
-                        objs.append(x)
-                    if len(objs) >= per_muscle:
-                        break
-
-        for ex in objs:
-            if ex.id in seen:
+
+def _pool_slice(pool: Optional[Dict[str, Any]], m: str, n: int) -> Optional[List[Dict[str, Any]]]:
+    """Slice của muscle m lấy từ prefetch pool nếu đủ n bài; None = phải truy vấn bù."""
+    if not pool:
+        return None
+    rows = (pool.get("slices") or {}).get(m)
+    if rows is None:
+        return None
+    # slice ngắn hơn limit của pool = muscle đã hết bài, đủ dùng cho mọi n
+    if len(rows) >= n or len(rows) < int(pool.get("limit") or 0):
+        return rows[:n]
+    return None
+
+
+def _usable_pool(ctx: Dict[str, Any], pool: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Pool chỉ dùng được khi query cùng query_base với pack: pool query theo goal_text, pack ưu tiên goal_style.
+    Khác query_base → bỏ pool, truy vấn lại bằng query (và vector) của pack để kết quả không phụ thuộc prefetch.
+    """
+    if pool and pool.get("query_base") == ctx["query_base"]:
+        return pool
+    return None
+
+
+def _candidates_cache_key(ctx: Dict[str, Any], pool: Optional[Dict[str, Any]]) -> tuple:
+    # Pack cắt từ pool (limit pool khác per_muscle) có thể khác pack truy vấn thẳng → key ghi rõ pool nào đã dùng
+    return ctx["cache_key"] + ((pool or {}).get("query_base"),)
+
+
+def _collect_candidates(
+    ctx: Dict[str, Any],
+    use_semantic: bool,
+    query_vectors: Optional[Dict[str, List[float]]] = None,
+    pool: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Phần truy vấn DB của candidate pack (sync, dùng ORM). Slice có sẵn trong prefetch pool thì không truy vấn lại."""
+    query_vectors = query_vectors or {}
+    pool = _usable_pool(ctx, pool)
+    base_muscles = ctx["base_muscles"]
+    query_base = ctx["query_base"]
+    per_muscle = ctx["per_muscle"]
+
+    candidates: List[Dict[str, Any]] = []
+    seen: set[int] = set()
+    fetched: List[str] = []
+
+    def _extend(rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            if row["id"] in seen:
                 continue
-            seen.add(ex.id)
-
-            dist = getattr(ex, "distance", None)
-            score = _distance_to_score(dist) if dist is not None else 0.9
-
-            candidates.append(
-                {
-                    "id": ex.id,
-                    "title": ex.title,
-                    "muscle_groups": ex.muscle_groups or [],
-                    "image_url": ex.image_url,
-                    "image_file": ex.image_file,
-                    "score": float(score),
-                    "reason": f"{'semantic' if (use_semantic and dist is not None) else 'muscle'}:{m}",
-                }
-            )
+            seen.add(row["id"])
+            candidates.append(dict(row))  # pool có thể nằm trong cache: không để rerank sửa row gốc
+
+    for m in base_muscles:
+        m = (m or "").strip().lower()
+        if not m:
+            continue
+        rows = _pool_slice(pool, m, per_muscle)
+        if rows is None:
+            rows = _muscle_slice(m, query_base, per_muscle, use_semantic, query_vectors)
+            fetched.append(m)
+        _extend(rows)
 
     # Global fallback nếu pool quá nhỏ
     if len(candidates) < 30:
-        objs = retrieve_exercises(
-            q=f"{query_base} workout exercise" if use_semantic else None,
+        rows = (pool or {}).get("global")
+        if rows is None:
+            rows = _global_slice(query_base, use_semantic, query_vectors)
+            fetched.append("global")
+        _extend(rows)
 
-            muscles=[],
-            limit=50,
-            use_semantic=use_semantic,
-        )
+    if pool:
+        print(f"[RETRIEVAL] prefetch pool used, fetched missing slices: {fetched}")
+    return candidates
 
-        # Nếu vẫn ít, fallback sang lấy theo id (hoặc keyword rộng)
-        if len(objs) < 10:
-            objs = retrieve_exercises(q=None, muscles=[], limit=50, use_semantic=False)
 
-        for ex in objs:
-            if ex.id in seen:
-                continue
-            seen.add(ex.id)
-
-            dist = getattr(ex, "distance", None)
-            score = _distance_to_score(dist) if dist is not None else 0.5
-
-            candidates.append(
-                {
-                    "id": ex.id,
-                    "title": ex.title,
-                    "muscle_groups": ex.muscle_groups or [],
-                    "image_url": ex.image_url,
-                    "image_file": ex.image_file,
-                    "score": float(score),
-                    "reason": "semantic_fallback_pool" if (use_semantic and dist is not None) else "fallback_pool",
-                }
-            )
+# ============================================================
+# Prefetch (chạy song song với intent, trước khi biết priority_muscles / goal_style)
+# ============================================================
+def _prefetch_query_base(profile: Dict[str, Any]) -> str:
+    goal_text = (profile.get("goal_text") or "").strip().lower()
+    return goal_text or "general_fitness"
+
+
+def _collect_pool(query_base: str, use_semantic: bool, query_vectors: Optional[Dict[str, List[float]]] = None) -> Dict[str, Any]:
+    query_vectors = query_vectors or {}
+    return {
+        "query_base": query_base,
+        "limit": PREFETCH_PER_MUSCLE,
+        "slices": {
+            m: _muscle_slice(m, query_base, PREFETCH_PER_MUSCLE, use_semantic, query_vectors) for m in MUSCLE_TAXONOMY
+        },
+        "global": _global_slice(query_base, use_semantic, query_vectors),
+    }
+
+
+def _pool_queries(query_base: str) -> List[str]:
+    return [semantic_query_for_muscle(query_base, m) for m in MUSCLE_TAXONOMY] + [global_semantic_query(query_base)]
+
+
+def prefetch_candidate_pool(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pool candidate theo toàn bộ taxonomy (PREFETCH_PER_MUSCLE bài/muscle + global slice), query theo goal_text.
+    Chạy song song với intent; build_candidate_pack sau đó chỉ cắt từ pool theo priority_muscles
+    và truy vấn bù slice thiếu (muscle cần nhiều bài hơn pool đã lấy). Pack query theo goal_style
+    (intent có goal_style) thì không dùng pool.
+    """
+    query_base = _prefetch_query_base(profile)
+    use_semantic = (connection.vendor == "postgresql")
+    cache_key = ("retrieval_prefetch_v1", query_base, use_semantic)
+
+    cached = cache_get("retrieval_prefetch", cache_key)
+    if cached is not None:
+        return cached
+
+    query_vectors = _embed_queries(_pool_queries(query_base)) if use_semantic else {}
+    pool = _collect_pool(query_base, use_semantic, query_vectors)
+    cache_set("retrieval_prefetch", cache_key, pool, ttl_seconds=RETRIEVAL_CACHE_TTL)
+    return pool
+
+
+async def aprefetch_candidate_pool(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Bản async của prefetch_candidate_pool (embed các query đồng thời, ORM qua sync_to_async)."""
+    query_base = _prefetch_query_base(profile)
+    use_semantic = (connection.vendor == "postgresql")
+    cache_key = ("retrieval_prefetch_v1", query_base, use_semantic)
+
+    cached = cache_get("retrieval_prefetch", cache_key)
+    if cached is not None:
+        return cached
+
+    query_vectors = await _aembed_queries(_pool_queries(query_base)) if use_semantic else {}
+    pool = await sync_to_async(_collect_pool)(query_base, use_semantic, query_vectors)
+    cache_set("retrieval_prefetch", cache_key, pool, ttl_seconds=RETRIEVAL_CACHE_TTL)
+    return pool
+
+
+def _rerank_query(ctx: Dict[str, Any]) -> str:
+    # Tạo query từ profile để rerank
+    query_parts = [ctx["goal_style"] or ctx["goal_text"] or "workout"]
+    if ctx["base_muscles"]:
+        query_parts.extend(ctx["base_muscles"][:3])  # Thêm top 3 priority muscles
+    return " ".join([x for x in query_parts if x])
+
+
+def build_candidate_pack(
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    pool: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    pool: kết quả prefetch_candidate_pool (nếu có) — chỉ truy vấn các slice pool chưa đủ.
+    Pool khác query_base của pack (intent đã cho goal_style) thì bỏ qua, truy vấn như không prefetch.
+    """
+    ctx = _pack_context(profile)
+    pool = _usable_pool(ctx, pool)
+    cache_key = _candidates_cache_key(ctx, pool)
+
+    cached = cache_get("retrieval_candidates", cache_key)
+    if cached is not None:
+        return cached
+
+    # Semantic chỉ hữu ích khi Postgres + pgvector + có embedding
+    use_semantic = (connection.vendor == "postgresql")
+
+    query_vectors = _embed_queries(_pack_semantic_queries(ctx, pool)) if use_semantic else {}
+    candidates = _collect_candidates(ctx, use_semantic, query_vectors, pool)
 
     # Rerank candidates để cải thiện chất lượng
     if USE_RERANK and len(candidates) > 5:
         try:
-            # Tạo query từ profile để rerank
-            query_parts = [goal_style or goal_text or "workout"]
-            if base_muscles:
-                query_parts.extend(base_muscles[:3])  # Thêm top 3 priority muscles
-            rerank_query = " ".join([x for x in query_parts if x])
-
+            rerank_query = _rerank_query(ctx)
 
             rerank_service = get_rerank_service()
             candidates = rerank_service.rerank(
@@ -187,6 +406,51 @@ def build_candidate_pack(profile: Dict[str, Any], constraints: Dict[str, Any]) -
     return out
 
 
+async def abuild_candidate_pack(
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    pool: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Bản async của build_candidate_pack:
+      - embed các query semantic đồng thời (async provider, precomputed vectors ưu tiên), trừ slice đã có trong pool
+      - phần ORM chạy qua sync_to_async với vectors đã có
+      - rerank async
+    """
+    ctx = _pack_context(profile)
+    pool = _usable_pool(ctx, pool)
+    cache_key = _candidates_cache_key(ctx, pool)
+
+    cached = cache_get("retrieval_candidates", cache_key)
+    if cached is not None:
+        return cached
+
+    use_semantic = (connection.vendor == "postgresql")
+
+    query_vectors: Dict[str, List[float]] = {}
+    if use_semantic:
+        query_vectors = await _aembed_queries(_pack_semantic_queries(ctx, pool))
+
+    candidates = await sync_to_async(_collect_candidates)(ctx, use_semantic, query_vectors, pool)
+
+    if USE_RERANK and len(candidates) > 5:
+        try:
+            rerank_query = _rerank_query(ctx)
+            candidates = await get_rerank_service().arerank(
+                query=rerank_query,
+                candidates=candidates,
+                top_n=RERANK_TOP_N,
+            )
+            print(f"[RETRIEVAL] Rerank applied: query='{rerank_query}', top_n={RERANK_TOP_N}")
+        except Exception as e:
+            print(f"[RETRIEVAL] Rerank error: {e}, using original candidates")
+            candidates = sorted(candidates, key=lambda x: x.get("score", 0.0), reverse=True)
+
+    out = candidates[:DEFAULT_K]
+    cache_set("retrieval_candidates", cache_key, out, ttl_seconds=RETRIEVAL_CACHE_TTL)
+    return out
+
+
 def candidate_pack_to_documents(candidates: List[Dict[str, Any]]) -> List[Document]:
     """Convert candidate pack to LangChain Documents"""
     docs: List[Document] = []
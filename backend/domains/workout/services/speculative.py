@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+from backend.shared.llm import LLMClient
+from backend.domains.workout.services.evaluation import evaluate_plan
+from backend.domains.workout.services.planning import agenerate_plan_with_llm, generate_plan_with_llm
+
+# Sinh K plan song song (temperature khác nhau), evaluate từng plan ngay khi về, lấy plan đầu tiên
+# không có issue và bỏ phần còn lại. 1 = tắt (1 call như cũ); request override bằng speculative_k.
+PLAN_SPECULATIVE_K = int(os.getenv("PLAN_SPECULATIVE_K") or 1)
+# Cost cap: K của mọi request bị kẹp về tối đa giá trị này
+PLAN_SPECULATIVE_MAX_K = max(1, int(os.getenv("PLAN_SPECULATIVE_MAX_K") or 3))
+# Temperature cho phương án #2, #3...; phương án #1 giữ temperature mặc định (dùng chung cache với path thường)
+PLAN_SPECULATIVE_TEMPERATURES = [
+    float(x) for x in (os.getenv("PLAN_SPECULATIVE_TEMPERATURES") or "0.6,0.9,1.0").split(",") if x.strip()
+]
+
+
+@dataclass
+class SpeculativeResult:
+    plan: Dict[str, Any]
+    variant: int                                  # index phương án được chọn
+    issues: List[Dict[str, Any]] = field(default_factory=list)
+    k: int = 1                                    # số phương án đã chạy
+    finished: int = 0                             # số phương án đã về lúc chọn (phần còn lại bị huỷ)
+    failed: int = 0                               # số phương án lỗi (exception)
+
+
+def speculative_k(requested: Any = None) -> int:
+    """K cho 1 request: theo request (nếu có) hoặc PLAN_SPECULATIVE_K, kẹp trong 1..PLAN_SPECULATIVE_MAX_K."""
+    try:
+        k = int(requested) if requested is not None else PLAN_SPECULATIVE_K
+    except (TypeError, ValueError):
+        k = PLAN_SPECULATIVE_K
+    return max(1, min(k, PLAN_SPECULATIVE_MAX_K))
+
+
+def _variant_llm(llm: LLMClient, variant: int) -> LLMClient:
+    if variant == 0 or not PLAN_SPECULATIVE_TEMPERATURES:
+        return llm
+    temps = PLAN_SPECULATIVE_TEMPERATURES
+    return llm.with_temperature(temps[(variant - 1) % len(temps)])
+
+
+def _plan_issues(
+    plan: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+) -> List[Dict[str, Any]]:
+    if not isinstance(plan, dict) or plan.get("error_type"):
+        return [{"type": (plan or {}).get("error_type") or "invalid_plan"}]
+    return evaluate_plan(plan, candidates, profile, constraints).get("issues") or []
+
+
+class _Picker:
+    """Giữ phương án tốt nhất (ít issue nhất, về trước thắng khi hoà) trong lúc các kết quả về dần."""
+
+    def __init__(self, k: int, candidates: List[Dict[str, Any]], profile: Dict[str, Any], constraints: Dict[str, Any]):
+        self.k = k
+        self.candidates, self.profile, self.constraints = candidates, profile, constraints
+        self.best: Optional[SpeculativeResult] = None
+        self.finished = 0
+        self.errors: List[BaseException] = []
+
+    def add(self, variant: int, plan: Optional[Dict[str, Any]], error: Optional[BaseException]) -> bool:
+        """Ghi nhận 1 phương án; True nếu đã có plan không issue (dừng chờ phần còn lại)."""
+        self.finished += 1
+        if error is not None:
+            print(f"[SPECULATIVE] variant {variant} failed: {error}")
+            self.errors.append(error)
+            return False
+        issues = _plan_issues(plan, self.candidates, self.profile, self.constraints)
+        if self.best is None or len(issues) < len(self.best.issues):
+            self.best = SpeculativeResult(plan=plan, variant=variant, issues=issues, k=self.k)
+        return not issues
+
+    def result(self) -> SpeculativeResult:
+        if self.best is None:
+            raise self.errors[0]
+        self.best.finished = self.finished
+        self.best.failed = len(self.errors)
+        return self.best
+
+
+def generate_plan_speculative(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    k: int,
+    documents: Optional[List[Document]] = None,
+) -> SpeculativeResult:
+    """
+    Chạy K generate_plan_with_llm song song (thread pool, copy contextvars để llm_call_scope ghi đủ call),
+    evaluate_plan từng plan theo thứ tự về; plan đầu tiên 0 issue thắng. Không có plan nào sạch thì lấy
+    plan ít issue nhất (vòng sửa xử lý tiếp như bình thường). Mọi phương án lỗi → raise lỗi đầu tiên.
+    Call đang chạy không dừng được giữa chừng: kết quả của chúng bị bỏ, call chưa bắt đầu bị huỷ.
+    """
+    picker = _Picker(k, candidates, profile, constraints)
+    pool = ThreadPoolExecutor(max_workers=k)
+    try:
+        futures = {
+            pool.submit(
+                contextvars.copy_context().run,
+                generate_plan_with_llm,
+                _variant_llm(llm, v),
+                profile,
+                constraints,
+                candidates,
+                documents=documents,
+                variant=v,
+            ): v
+            for v in range(k)
+        }
+        for fut in as_completed(futures):
+            error = fut.exception()
+            if picker.add(futures[fut], None if error else fut.result(), error):
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return picker.result()
+
+
+async def agenerate_plan_speculative(
+    llm: LLMClient,
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    k: int,
+    documents: Optional[List[Document]] = None,
+) -> SpeculativeResult:
+    """Bản async của generate_plan_speculative: các task chưa xong bị cancel khi đã có plan sạch."""
+    picker = _Picker(k, candidates, profile, constraints)
+    tasks = {
+        asyncio.ensure_future(
+            agenerate_plan_with_llm(
+                _variant_llm(llm, v), profile, constraints, candidates, documents=documents, variant=v,
+            )
+        ): v
+        for v in range(k)
+    }
+    pending = set(tasks)
+    try:
+        done_clean = False
+        while pending and not done_clean:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                done_clean = picker.add(tasks[task], None if error else task.result(), error) or done_clean
+                if done_clean:
+                    break
+    finally:
+        for task in pending:
+            task.cancel()
+    return picker.result()
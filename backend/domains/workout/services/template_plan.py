@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from backend.domains.workout.schemas import WorkoutPlan
+from backend.domains.workout.services.intent_rules import SPLIT_NAMES, build_weekly_focus
+
+# Plan không cần LLM: lắp ngày trực tiếp từ candidate pack + weekly_focus_by_day.
+# llm = gọi LLM (mặc định) | template = luôn dùng template (request có thể override bằng plan_mode)
+PLAN_MODE = (os.getenv("PLAN_MODE") or "llm").lower()
+# Khi LLM lỗi (timeout, provider down, output hỏng): none = raise như cũ (mặc định) | template = degrade sang template
+PLAN_FALLBACK = (os.getenv("PLAN_FALLBACK") or "none").lower()
+
+# goal_style -> (sets, reps, rest_sec)
+_PRESCRIPTIONS: Dict[str, Tuple[int, str, int]] = {
+    "strength": (5, "3-5", 180),
+    "hypertrophy": (4, "8-12", 90),
+    "body_recomposition": (3, "8-12", 75),
+    "fat_loss": (3, "12-15", 45),
+    "endurance": (3, "15-20", 30),
+    "athletic_performance": (4, "4-6", 120),
+    "mobility_flexibility": (2, "30-45s", 30),
+    "posture_stability": (3, "10-12", 60),
+    "rehab_prevention": (2, "12-15", 60),
+}
+_DEFAULT_PRESCRIPTION = (3, "10-12", 60)
+
+
+def prescription_for(goal_style: Optional[str], experience: Optional[str] = None) -> Tuple[int, str, int]:
+    sets, reps, rest = _PRESCRIPTIONS.get((goal_style or "").lower(), _DEFAULT_PRESCRIPTION)
+    if (experience or "").lower() == "beginner":
+        sets = max(2, sets - 1)
+    return sets, reps, rest
+
+
+def _exercises_per_day(sets: int, rest_sec: int, session_minutes: int, constraints: Dict[str, Any]) -> int:
+    """Số bài vừa session_minutes (cùng công thức ước lượng với evaluation), kẹp trong min/max constraints."""
+    per_exercise = sets * (1.0 + rest_sec / 60.0)
+    fit = int(session_minutes // per_exercise) if per_exercise > 0 else 1
+    max_ex = int(constraints.get("max_exercises_per_day") or 6)
+    min_ex = int(constraints.get("min_exercises_per_day") or 1)
+    return max(1, min_ex, min(max_ex, fit))
+
+
+def muscle_index(candidates: List[Dict[str, Any]]) -> Tuple[Dict[str, List[int]], Dict[str, List[int]]]:
+    """(primary muscle -> ids, any muscle -> ids); giữ thứ tự candidate (đã rank theo retrieval/rerank)."""
+    primary: Dict[str, List[int]] = {}
+    any_muscle: Dict[str, List[int]] = {}
+    for c in candidates:
+        eid = c.get("id")
+        if eid is None:
+            continue
+        muscles = [str(m).strip().lower() for m in (c.get("muscle_groups") or [])]
+        if muscles:
+            primary.setdefault(muscles[0], []).append(int(eid))
+        for m in muscles:
+            any_muscle.setdefault(m, []).append(int(eid))
+    return primary, any_muscle
+
+
+def focus_by_day(profile: Dict[str, Any]) -> List[Tuple[str, List[str]]]:
+    training_days = [str(d) for d in (profile.get("training_days") or [])]
+    weekly = (profile.get("internal_goal") or {}).get("weekly_focus_by_day")
+    if not isinstance(weekly, list) or len(weekly) != len(training_days):
+        weekly = build_weekly_focus(training_days, [])
+
+    out: List[Tuple[str, List[str]]] = []
+    for item in weekly:
+        focus = sorted(item.get("focus") or [], key=lambda f: f.get("rank") or 99)
+        out.append((str(item.get("training_day")), [str(f.get("muscle")) for f in focus]))
+    return out
+
+
+def pick_day_exercises(
+    muscles: List[str],
+    n: int,
+    primary: Dict[str, List[int]],
+    any_muscle: Dict[str, List[int]],
+    all_ids: List[int],
+    used_week: Set[int],
+    picked: Optional[List[int]] = None,
+) -> List[int]:
+    """
+    Chia slot round-robin theo rank (rank 1 chọn trước), mỗi slot lấy candidate tốt nhất chưa dùng trong tuần:
+    primary muscle trước, rồi bài có muscle đó ở vị trí phụ. Thiếu thì lấp bằng candidate tốt nhất còn lại;
+    hết candidate chưa dùng mới cho lặp lại (không lặp trong cùng ngày).
+    picked: bài đã có sẵn trong ngày (bổ sung thêm cho đủ n).
+    """
+    picked = list(picked or [])
+
+    def _first(ids: List[int], allow_repeat: bool) -> Optional[int]:
+        for eid in ids:
+            if eid in picked or (not allow_repeat and eid in used_week):
+                continue
+            return eid
+        return None
+
+    for allow_repeat in (False, True):
+        stalled = False
+        while len(picked) < n and not stalled:
+            stalled = True
+            for m in muscles:
+                if len(picked) >= n:
+                    break
+                eid = _first(primary.get(m, []), allow_repeat)
+                if eid is None:
+                    eid = _first(any_muscle.get(m, []), allow_repeat)
+                if eid is not None:
+                    picked.append(eid)
+                    stalled = False
+
+        while len(picked) < n:
+            eid = _first(all_ids, allow_repeat)
+            if eid is None:
+                break
+            picked.append(eid)
+
+        if len(picked) >= n:
+            break
+    return picked
+
+
+def generate_template_plan(
+    profile: Dict[str, Any],
+    constraints: Dict[str, Any],
+    candidates: List[Dict[str, Any]],
+    on_day: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Sinh WorkoutPlan deterministic (không gọi LLM) từ candidate pack + weekly_focus_by_day.
+    Sets/reps/rest theo goal_style; số bài/ngày theo session_minutes và max_exercises_per_day.
+    """
+    if not candidates:
+        return {
+            "error_type": "template_plan_failed",
+            "message": "Không có candidate để lắp plan theo template.",
+            "errors": ["candidate pack rỗng"],
+        }
+
+    internal_goal = profile.get("internal_goal") or {}
+    sets, reps, rest = prescription_for(internal_goal.get("goal_style"), profile.get("experience"))
+    session_minutes = int(profile.get("session_minutes") or 60)
+    n = _exercises_per_day(sets, rest, session_minutes, constraints)
+
+    primary, any_muscle = muscle_index(candidates)
+    all_ids = [int(c["id"]) for c in candidates if c.get("id") is not None]
+    used_week: Set[int] = set()
+
+    days: List[Dict[str, Any]] = []
+    for i, (training_day, muscles) in enumerate(focus_by_day(profile)):
+        ids = pick_day_exercises(muscles, n, primary, any_muscle, all_ids, used_week)
+        used_week.update(ids)
+        day = {
+            "day": training_day,
+            "exercises": [
+                {"exercise_id": eid, "sets": sets, "reps": reps, "rest_sec": rest, "notes": ""}
+                for eid in ids
+            ],
+        }
+        days.append(day)
+        if on_day is not None:
+            on_day(i, day)
+
+    return assemble_plan(profile, days)
+
+
+def assemble_plan(profile: Dict[str, Any], days: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Ghép list DayPlan (dict) thành WorkoutPlan đã validate; goal/split/session lấy từ profile."""
+    internal_goal = profile.get("internal_goal") or {}
+    plan = {
+        "goal": str(profile.get("goal_text") or internal_goal.get("goal_style") or "general_fitness"),
+        "days_per_week": int(profile.get("days_per_week") or len(days)),
+        "session_minutes": int(profile.get("session_minutes") or 60),
+        "split": SPLIT_NAMES.get(len(days), "custom"),
+        "days": days,
+    }
+    return WorkoutPlan.model_validate(plan).model_dump(mode="json")
@@ -18,6 +18,11 @@ class WorkoutGraphState(BaseGraphState, total=False):
     documents: List[Document]
     final_plan: Optional[Dict[str, Any]]
     internal_goal: Optional[Dict[str, Any]] = None
+    plan_mode: str            # llm | template (chọn theo request hoặc env PLAN_MODE)
+    plan_source: str          # nguồn draft_plan hiện tại: llm | template
+    repaired: bool            # draft_plan hiện tại đã qua repair cục bộ (services/repair.py)
+    prefetch_pool: Optional[Dict[str, Any]]  # candidate pool lấy song song với intent (retrieval.prefetch_candidate_pool)
+    speculative_k: int        # số plan sinh song song ở lần sinh đầu (services/speculative.py), 1 = tắt
 
 @dataclass
 class WorkoutPlanResult(BaseResult):
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-from django.core.management.base import BaseCommand
+from dataclasses import replace
+
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.db.models import Q
 
-from backend.models import Exercise
-from backend.services.embedding_service import embed_document, DEFAULT_DIM, DEFAULT_EMBED_MODEL
+from backend.models import SHORT_EMBED_DIM, Exercise
+from backend.services.embedding_index import get_embedding_index
+from backend.services.embedding_service import embed_document, get_embedding_model_name
+from backend.services.vector_quantization import to_binary, to_halfvec, truncate_normalize
 
 
 def _build_embedding_text(ex: Exercise) -> str:
@@ -13,6 +18,12 @@ def _build_embedding_text(ex: Exercise) -> str:
     return " | ".join([p.strip() for p in parts if (p or "").strip()])
 
 
+def _set_compact(ex: Exercise, vec) -> None:
+    ex.embedding_half = to_halfvec(vec)
+    ex.embedding_bin = to_binary(vec)
+    ex.embedding_short = truncate_normalize(vec, SHORT_EMBED_DIM)
+
+
 class Command(BaseCommand):
     help = "Backfill embeddings for Exercise into Postgres (pgvector)."
 
@@ -20,45 +31,101 @@ class Command(BaseCommand):
         parser.add_argument("--limit", type=int, default=100000)
         parser.add_argument("--batch-size", type=int, default=32)
         parser.add_argument("--rebuild", action="store_true")  # overwrite existing embedding
-        parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+        # primary = embedding (+ compact copies), shadow = embedding_shadow (migrate model mới)
+        parser.add_argument("--index", type=str, default="primary")
+        parser.add_argument("--provider", type=str, default=None)  # override provider của index (openai | local)
+        # chỉ sinh embedding_half/embedding_bin/embedding_short từ embedding đã có (không gọi provider)
+        parser.add_argument("--quantize-only", action="store_true")
 
     def handle(self, *args, **opts):
         limit = int(opts["limit"])
         batch_size = max(1, int(opts["batch_size"]))
         rebuild = bool(opts["rebuild"])
-        dim = int(opts["dim"])
+
+        try:
+            index = get_embedding_index(opts["index"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if opts["provider"]:
+            provider = opts["provider"].lower()
+            index = replace(index, provider=provider, model=get_embedding_model_name(provider))
+
+        if opts["quantize_only"]:
+            self._quantize_existing(limit, batch_size)
+            return
 
         qs = Exercise.objects.all().order_by("id")
         if not rebuild:
-            qs = qs.filter(embedding__isnull=True)
+            # Thiếu vector hoặc vector của model khác -> cần (re)embed
+            qs = qs.filter(Q(**{f"{index.column}__isnull": True}) | ~Q(**{index.model_column: index.model_key}))
 
         total = min(limit, qs.count())
-        self.stdout.write(f"Target rows: {total} | batch_size={batch_size} | dim={dim}")
+        self.stdout.write(
+            f"Target rows: {total} | batch_size={batch_size} | index={index.name} "
+            f"| model={index.model_key} | provider={index.provider}"
+        )
 
         done = 0
+        last_id = 0
         while done < total:
-            batch = list(qs[done : done + batch_size])
+            # Phân trang theo id: rows đã update rời khỏi filter nên không dùng offset
+            batch = list(qs.filter(id__gt=last_id)[: min(batch_size, total - done)])
             if not batch:
                 break
 
             texts = []
             for ex in batch:
                 ex.embedding_text = _build_embedding_text(ex)
-                ex.embedding_model = f"{DEFAULT_EMBED_MODEL}@{dim}"
+                setattr(ex, index.model_column, index.model_key)
                 texts.append(ex.embedding_text)
 
-            vectors = embed_document(texts, output_dim=dim)
+            vectors = embed_document(texts, output_dim=index.dim, provider=index.provider, model=index.model)
+
+            fields = [index.column, index.model_column, "embedding_text"]
+            if index.compact:
+                fields += ["embedding_half", "embedding_bin", "embedding_short"]
 
             for ex, vec in zip(batch, vectors):
-                ex.embedding = vec
+                setattr(ex, index.column, vec)
+                if index.compact:
+                    _set_compact(ex, vec)
+
+            with transaction.atomic():
+                Exercise.objects.bulk_update(batch, fields, batch_size=batch_size)
+
+            last_id = batch[-1].id
+            done += len(batch)
+            self.stdout.write(f"Progress: {done}/{total}")
+
+        self.stdout.write("Done.")
+
+    def _quantize_existing(self, limit: int, batch_size: int) -> None:
+        qs = (
+            Exercise.objects.exclude(embedding__isnull=True)
+            .filter(Q(embedding_half__isnull=True) | Q(embedding_short__isnull=True))
+            .order_by("id")
+        )
+        total = min(limit, qs.count())
+        self.stdout.write(f"Quantize rows: {total} | batch_size={batch_size}")
+
+        done = 0
+        last_id = 0
+        while done < total:
+            batch = list(qs.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+
+            for ex in batch:
+                _set_compact(ex, list(ex.embedding))
 
             with transaction.atomic():
                 Exercise.objects.bulk_update(
                     batch,
-                    ["embedding", "embedding_text", "embedding_model"],
+                    ["embedding_half", "embedding_bin", "embedding_short"],
                     batch_size=batch_size,
                 )
 
+            last_id = batch[-1].id
             done += len(batch)
             self.stdout.write(f"Progress: {done}/{total}")
 
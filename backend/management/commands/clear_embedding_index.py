@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.models import Exercise
+from backend.services.embedding_index import get_active_embedding_index, get_embedding_index
+
+
+class Command(BaseCommand):
+    help = "Clear vectors of an inactive embedding index (after flipping EMBEDDING_ACTIVE_INDEX)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--index", type=str, required=True)  # primary | shadow
+        parser.add_argument("--force", action="store_true")  # cho phép clear cả index đang active
+
+    def handle(self, *args, **opts):
+        try:
+            index = get_embedding_index(opts["index"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        active = get_active_embedding_index()
+        if index.name == active.name and not opts["force"]:
+            raise CommandError(f"Index '{index.name}' đang active (EMBEDDING_ACTIVE_INDEX); flip reads trước.")
+
+        updates = {index.column: None, index.model_column: ""}
+        if index.compact:
+            updates.update({"embedding_half": None, "embedding_bin": None, "embedding_short": None})
+
+        n = Exercise.objects.exclude(**{f"{index.column}__isnull": True}).update(**updates)
+        self.stdout.write(f"Cleared {n} rows from index={index.name}. Chạy VACUUM để thu hồi dung lượng.")
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from backend.models import QueryEmbedding
+from backend.domains.workout.services.retrieval import iter_semantic_query_vocabulary
+from backend.services.embedding_index import get_embedding_index
+from backend.services.embedding_service import embed_texts
+from backend.services.query_vectors import load_query_vectors, query_model_key
+
+
+class Command(BaseCommand):
+    help = "Precompute query vectors for the goal_style × muscle semantic query vocabulary."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument("--rebuild", action="store_true")  # overwrite existing vectors
+        # vector query phải cùng model/dim với slot embedding sẽ phục vụ reads
+        parser.add_argument("--index", type=str, default="primary")
+
+    def handle(self, *args, **opts):
+        batch_size = max(1, int(opts["batch_size"]))
+        rebuild = bool(opts["rebuild"])
+        try:
+            index = get_embedding_index(opts["index"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        model_key = query_model_key(index.dim, index.provider, index.model)
+
+        vocab = list(dict.fromkeys(iter_semantic_query_vocabulary()))
+        if not rebuild:
+            existing = set(
+                QueryEmbedding.objects.filter(embedding_model=model_key).values_list("query_text", flat=True)
+            )
+            vocab = [q for q in vocab if q not in existing]
+
+        self.stdout.write(f"Target queries: {len(vocab)} | model={model_key} | batch_size={batch_size}")
+
+        for start in range(0, len(vocab), batch_size):
+            batch = vocab[start : start + batch_size]
+            vectors = embed_texts(
+                batch,
+                task_type="RETRIEVAL_QUERY",
+                model=index.model,
+                output_dim=index.dim,
+                provider=index.provider,
+            )
+
+            with transaction.atomic():
+                for text, vec in zip(batch, vectors):
+                    QueryEmbedding.objects.update_or_create(
+                        query_text=text,
+                        embedding_model=model_key,
+                        defaults={"embedding": vec},
+                    )
+
+            self.stdout.write(f"Progress: {min(start + batch_size, len(vocab))}/{len(vocab)}")
+
+        n = load_query_vectors(force=True)
+        self.stdout.write(f"Done. {n} vectors in table.")
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.9 on 2026-10-19 10:07
+
+import pgvector.django.bit
+import pgvector.django.halfvec
+import pgvector.django.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workout', '0005_nutritionatom'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='embedding_bin',
+            field=pgvector.django.bit.BitField(blank=True, length=1536, null=True),
+        ),
+        migrations.AddField(
+            model_name='exercise',
+            name='embedding_half',
+            field=pgvector.django.halfvec.HalfVectorField(blank=True, dimensions=1536, null=True),
+        ),
+        # Populate compact copies từ embedding hiện có trước khi build index
+        migrations.RunSQL(
+            sql=(
+                "UPDATE workout_exercise "
+                "SET embedding_half = embedding::halfvec(1536), "
+                "embedding_bin = binary_quantize(embedding)::bit(1536) "
+                "WHERE embedding IS NOT NULL"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_half'], m=16, name='wk_ex_emb_half_hnsw', opclasses=['halfvec_cosine_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_bin'], m=16, name='wk_ex_emb_bin_hnsw', opclasses=['bit_hamming_ops']),
+        ),
+    ]
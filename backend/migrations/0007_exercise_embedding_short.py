@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-19 10:07
+
+import pgvector.django.indexes
+import pgvector.django.vector
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workout', '0006_exercise_embedding_half_embedding_bin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='embedding_short',
+            field=pgvector.django.vector.VectorField(blank=True, dimensions=256, null=True),
+        ),
+        migrations.RunSQL(
+            sql=(
+                "UPDATE workout_exercise "
+                "SET embedding_short = l2_normalize(subvector(embedding, 1, 256))::vector(256) "
+                "WHERE embedding IS NOT NULL"
+            ),
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_short'], m=16, name='wk_ex_emb_short_hnsw', opclasses=['vector_cosine_ops']),
+        ),
+    ]
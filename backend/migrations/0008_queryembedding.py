@@ -0,0 +1,27 @@
+# Generated by Django 5.2.9 on 2026-10-19 10:08
+
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workout', '0007_exercise_embedding_short'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.CharField(max_length=255)),
+                ('embedding_model', models.CharField(max_length=64)),
+                ('embedding', pgvector.django.vector.VectorField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('query_text', 'embedding_model'), name='wk_query_emb_uniq')],
+            },
+        ),
+    ]
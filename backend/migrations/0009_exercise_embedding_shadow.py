@@ -0,0 +1,29 @@
+# Generated by Django 5.2.9 on 2026-10-19 10:09
+
+import pgvector.django.indexes
+import pgvector.django.vector
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workout', '0008_queryembedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='embedding_shadow',
+            field=pgvector.django.vector.VectorField(blank=True, dimensions=1536, null=True),
+        ),
+        migrations.AddField(
+            model_name='exercise',
+            name='embedding_shadow_model',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=pgvector.django.indexes.HnswIndex(ef_construction=64, fields=['embedding_shadow'], m=16, name='wk_ex_emb_shadow_hnsw', opclasses=['vector_cosine_ops']),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.db import models
-from pgvector.django import VectorField, HnswIndex
+from pgvector.django import BitField, HalfVectorField, HnswIndex, VectorField
+
+# Số chiều của cột vector (phải khớp migration). Đổi dim = đổi hằng số + makemigrations.
+PRIMARY_EMBED_DIM = 1536
+SHADOW_EMBED_DIM = 1536
+SHORT_EMBED_DIM = 256  # Matryoshka first-stage của slot primary (embedding_short)
 
 class Exercise(models.Model):
     title = models.CharField(max_length=255)
@@ -10,7 +15,7 @@ class Exercise(models.Model):
     image_file = models.CharField(max_length=512, blank=True, default="")
 
     # Embedding fields
-    embedding = VectorField(dimensions=1536, null=True, blank=True)
+    embedding = VectorField(dimensions=PRIMARY_EMBED_DIM, null=True, blank=True)
     embedding_text = models.TextField(blank=True, default="")
     embedding_model = models.CharField(
         max_length=64,
@@ -18,6 +23,16 @@ class Exercise(models.Model):
         default="text-embedding-3-small@1536",
     )
 
+    # Compact copies của embedding cho first-stage ANN (rescore lại bằng `embedding`)
+    embedding_half = HalfVectorField(dimensions=PRIMARY_EMBED_DIM, null=True, blank=True)
+    embedding_bin = BitField(length=PRIMARY_EMBED_DIM, null=True, blank=True)
+    # Matryoshka: SHORT_EMBED_DIM chiều đầu của embedding (đã normalize) cho first-stage ANN
+    embedding_short = VectorField(dimensions=SHORT_EMBED_DIM, null=True, blank=True)
+
+    # Shadow slot: backfill model mới song song, flip reads bằng EMBEDDING_ACTIVE_INDEX=shadow
+    embedding_shadow = VectorField(dimensions=SHADOW_EMBED_DIM, null=True, blank=True)
+    embedding_shadow_model = models.CharField(max_length=64, blank=True, default="")
+
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -29,12 +44,56 @@ class Exercise(models.Model):
                 m=16,
                 ef_construction=64,
                 opclasses=["vector_cosine_ops"],
-            )
+            ),
+            HnswIndex(
+                name="wk_ex_emb_half_hnsw",
+                fields=["embedding_half"],
+                m=16,
+                ef_construction=64,
+                opclasses=["halfvec_cosine_ops"],
+            ),
+            HnswIndex(
+                name="wk_ex_emb_bin_hnsw",
+                fields=["embedding_bin"],
+                m=16,
+                ef_construction=64,
+                opclasses=["bit_hamming_ops"],
+            ),
+            HnswIndex(
+                name="wk_ex_emb_short_hnsw",
+                fields=["embedding_short"],
+                m=16,
+                ef_construction=64,
+                opclasses=["vector_cosine_ops"],
+            ),
+            HnswIndex(
+                name="wk_ex_emb_shadow_hnsw",
+                fields=["embedding_shadow"],
+                m=16,
+                ef_construction=64,
+                opclasses=["vector_cosine_ops"],
+            ),
         ]
 
     def __str__(self) -> str:
         return self.title
 
+class QueryEmbedding(models.Model):
+    """Query vector precompute sẵn cho vocabulary cố định (goal_style × muscle)."""
+    query_text = models.CharField(max_length=255)
+    embedding_model = models.CharField(max_length=64)  # "<model>@<dim>", khớp Exercise.embedding_model
+    embedding = VectorField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["query_text", "embedding_model"], name="wk_query_emb_uniq"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.query_text} ({self.embedding_model})"
+
 class NutritionAtom(models.Model):
     class Category(models.TextChoices):
         PROTEIN_ANIMAL = "protein_animal", "Protein Animal"
@@ -96,6 +96,12 @@ class WorkoutPlanGenerateSerializer(serializers.Serializer):
     # để plan ổn định nếu bạn muốn
     seed = serializers.IntegerField(required=False)
 
+    # llm (mặc định theo env PLAN_MODE) | template: lắp plan deterministic không gọi LLM
+    plan_mode = serializers.ChoiceField(choices=["llm", "template"], required=False)
+
+    # số plan sinh song song, lấy plan đầu tiên không có issue (server kẹp theo PLAN_SPECULATIVE_MAX_K)
+    speculative_k = serializers.IntegerField(required=False, min_value=1)
+
     def validate(self, attrs):
         days_per_week = int(attrs.get("days_per_week") or 0)
 
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from backend.models import PRIMARY_EMBED_DIM, SHADOW_EMBED_DIM, SHORT_EMBED_DIM
+from backend.services.embedding_service import EMBEDDING_PROVIDER, get_embedding_model_name
+
+
+@dataclass(frozen=True)
+class EmbeddingIndexSpec:
+    """
+    Mô tả 1 "slot" embedding trên Exercise: cột vector + cột tag model + HNSW index riêng.
+    Hai slot (primary/shadow) cho phép backfill model mới song song rồi flip reads.
+    """
+    name: str
+    column: str
+    model_column: str
+    provider: str
+    model: str
+    dim: int
+    compact: bool = False  # có embedding_half/embedding_bin/embedding_short đi kèm
+
+    @property
+    def model_key(self) -> str:
+        return f"{self.model}@{self.dim}"
+
+
+def _slot_provider(slot: str) -> str:
+    return (os.getenv(f"EMBEDDING_{slot.upper()}_PROVIDER") or EMBEDDING_PROVIDER).lower()
+
+
+def _slot_model(slot: str, provider: str) -> str:
+    return os.getenv(f"EMBEDDING_{slot.upper()}_MODEL") or get_embedding_model_name(provider)
+
+
+def get_embedding_indexes() -> Dict[str, EmbeddingIndexSpec]:
+    primary_provider = _slot_provider("primary")
+    shadow_provider = _slot_provider("shadow")
+    return {
+        "primary": EmbeddingIndexSpec(
+            name="primary",
+            column="embedding",
+            model_column="embedding_model",
+            provider=primary_provider,
+            model=_slot_model("primary", primary_provider),
+            dim=PRIMARY_EMBED_DIM,
+            compact=True,
+        ),
+        "shadow": EmbeddingIndexSpec(
+            name="shadow",
+            column="embedding_shadow",
+            model_column="embedding_shadow_model",
+            provider=shadow_provider,
+            model=_slot_model("shadow", shadow_provider),
+            dim=SHADOW_EMBED_DIM,
+        ),
+    }
+
+
+def get_embedding_index(name: str) -> EmbeddingIndexSpec:
+    indexes = get_embedding_indexes()
+    key = (name or "").strip().lower()
+    if key not in indexes:
+        raise ValueError(f"Unknown embedding index={name}. Available: {sorted(indexes)}")
+    return indexes[key]
+
+
+def get_active_embedding_index(name: Optional[str] = None) -> EmbeddingIndexSpec:
+    """
+    Slot đang phục vụ reads. Flip bằng 1 setting duy nhất: EMBEDDING_ACTIVE_INDEX=primary|shadow.
+    """
+    return get_embedding_index(name or os.getenv("EMBEDDING_ACTIVE_INDEX") or "primary")
+
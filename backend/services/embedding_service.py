@@ -1,21 +1,79 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import os
 import random
 import re
+import threading
 import time
-from typing import List, Optional
+import weakref
+from functools import lru_cache, partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
-from openai import OpenAI
-from openai import OpenAIError
+import numpy as np
+
+from backend.shared.hedging import ahedged_call, hedged_call
 
 DEFAULT_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
 DEFAULT_DIM = int(os.getenv("OPENAI_EMBED_DIM", "1536"))
 
-_CLIENT: Optional[OpenAI] = None
+# Provider chọn qua env: "openai" (mặc định) hoặc "local" (hashing n-gram, không cần network)
+EMBEDDING_PROVIDER = (os.getenv("EMBEDDING_PROVIDER") or "openai").lower()
+LOCAL_EMBED_MODEL = "local-hash-ngram"
+
+
+
+class EmbedControl:
+    """
+    Tín hiệu giữa embed_texts/aembed_texts và provider cho 1 lần embed (bản gốc + bản hedge dùng chung):
+      - stop: đã có kết quả → bản còn chạy dừng trước attempt kế tiếp (đang sleep thì thoát ngay)
+      - rate_limited: provider đang chờ retry-after → không hedge (bản sao chỉ ăn thêm rate limit)
+    """
+
+    def __init__(self) -> None:
+        self.stop = threading.Event()
+        self.rate_limited = threading.Event()
+
+    def can_hedge(self) -> bool:
+        return not self.rate_limited.is_set()
+
+    def check(self) -> None:
+        if self.stop.is_set():
+            raise RuntimeError("hedged call already answered")
+
+    def sleep(self, seconds: float, rate_limited: bool = False) -> None:
+        if rate_limited:
+            self.rate_limited.set()
+        try:
+            self.stop.wait(seconds)
+        finally:
+            self.rate_limited.clear()
+
+    async def asleep(self, seconds: float, rate_limited: bool = False) -> None:
+        if rate_limited:
+            self.rate_limited.set()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.rate_limited.clear()
+
+
+# Signature chung cho mọi provider: (texts, model, output_dim, max_retries, control) -> vectors
+# control (EmbedControl | None): provider có retry/sleep phải check/sleep qua control để bản hedge thua dừng được
+EmbedFn = Callable[[List[str], str, int, int, Optional[EmbedControl]], List[List[float]]]
+AsyncEmbedFn = Callable[[List[str], str, int, int, Optional[EmbedControl]], Awaitable[List[List[float]]]]
 
+_PROVIDERS: Dict[str, EmbedFn] = {}
+_ASYNC_PROVIDERS: Dict[str, AsyncEmbedFn] = {}
+_PROVIDER_MODELS: Dict[str, str] = {}
 
-def get_client() -> OpenAI:
+_CLIENT = None
+# WSGI/runserver chạy mỗi request async trong 1 loop mới: client theo loop, loop bị thu hồi thì client đi theo
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+
+def get_client():
     global _CLIENT
     if _CLIENT is not None:
         return _CLIENT
@@ -24,10 +82,37 @@ def get_client() -> OpenAI:
     if not api_key:
         raise RuntimeError("Thiếu OPENAI_API_KEY trong environment variables.")
 
+    from openai import OpenAI
+
     _CLIENT = OpenAI(api_key=api_key)
     return _CLIENT
 
 
+def get_async_client():
+    """AsyncOpenAI của event loop đang chạy (connection pool gắn với loop tạo ra nó)."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is not None:
+        return client
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Thiếu OPENAI_API_KEY trong environment variables.")
+
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(api_key=api_key)
+    _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+async def aclose_async_client() -> None:
+    """Đóng AsyncOpenAI của event loop đang chạy (loop chỉ sống 1 request, vd view async dưới WSGI)."""
+    client = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
 def parse_retry_seconds(message: str) -> float:
     # Một số lỗi có thể chứa: "Please try again in 38.34s"
     m = re.search(r"(retry|try again) in\s+([0-9.]+)\s*s", message, re.IGNORECASE)
@@ -69,29 +154,66 @@ def _extract_retry_after_seconds(err: Exception) -> Optional[float]:
     return None
 
 
-def embed_texts(
-    texts: List[str],
-    task_type: str,  # giữ để tương thích; OpenAI embeddings không dùng
-    model: str = DEFAULT_EMBED_MODEL,
-    output_dim: int = DEFAULT_DIM,
-    title: Optional[str] = None,  # giữ để tương thích; OpenAI embeddings không dùng
-    max_retries: int = 10,
+# -----------------------------
+# Provider registry
+# -----------------------------
+def register_embedding_provider(
+    name: str,
+    fn: EmbedFn,
+    model: Optional[str] = None,
+    async_fn: Optional[AsyncEmbedFn] = None,
+) -> None:
+    """
+    Đăng ký provider embedding mới.
+    model: tên model mặc định của provider (ghi vào Exercise.embedding_model).
+    async_fn: bản async native (nếu không có, aembed_texts chạy fn trong thread).
+    """
+    key = (name or "").strip().lower()
+    _PROVIDERS[key] = fn
+    if model:
+        _PROVIDER_MODELS[key] = model
+    if async_fn is not None:
+        _ASYNC_PROVIDERS[key] = async_fn
+
+
+def get_embedding_provider(name: Optional[str] = None) -> EmbedFn:
+    key = (name or EMBEDDING_PROVIDER).strip().lower()
+    fn = _PROVIDERS.get(key)
+    if fn is None:
+        raise ValueError(f"Unsupported EMBEDDING_PROVIDER={key}. Available: {sorted(_PROVIDERS)}")
+    return fn
+
+
+def get_embedding_model_name(provider: Optional[str] = None) -> str:
+    """Tên model mặc định của provider đang dùng (vd text-embedding-3-small, local-hash-ngram)."""
+    key = (provider or EMBEDDING_PROVIDER).strip().lower()
+    return _PROVIDER_MODELS.get(key, DEFAULT_EMBED_MODEL)
+
+
+def _openai_kwargs(texts: List[str], model: str, output_dim: int) -> Dict[str, object]:
+    # OpenAI embeddings: input có thể là list[str]
+    # Với text-embedding-3-*, có thể truyền dimensions để giảm chiều nếu muốn.
+    kwargs: Dict[str, object] = {"model": model, "input": texts}
+    if output_dim and model.startswith("text-embedding-3"):
+        kwargs["dimensions"] = int(output_dim)
+    return kwargs
+
+
+def _openai_embed(
+    texts: List[str], model: str, output_dim: int, max_retries: int, control: Optional[EmbedControl] = None,
 ) -> List[List[float]]:
-    if not texts:
-        return []
+    from openai import OpenAIError
 
     client = get_client()
+    control = control or EmbedControl()
     last_err: Exception | None = None
 
     for attempt in range(max_retries):
+        control.check()
         try:
             # OpenAI embeddings: input có thể là list[str]
             # Với text-embedding-3-*, có thể truyền dimensions để giảm chiều nếu muốn.
-            kwargs = {"model": model, "input": texts}
-            if output_dim and model.startswith("text-embedding-3"):
-                kwargs["dimensions"] = int(output_dim)
-
-            res = client.embeddings.create(**kwargs)
+            res = client.embeddings.create(**_openai_kwargs(texts, model, output_dim))
 
             # res.data là list; mỗi item có .embedding
             return [list(item.embedding) for item in res.data]
@@ -103,32 +225,199 @@ def embed_texts(
                 wait_s = parse_retry_seconds(str(e))
 
             # thêm chút đệm để tránh “đụng” rate limit ngay khi retry
-            time.sleep(float(wait_s) + 1.0)
             last_err = e
+            control.sleep(float(wait_s) + 1.0, rate_limited=True)
 
         except Exception as e:
             last_err = e
             # backoff cho lỗi tạm thời khác
             sleep_s = min(16.0, (2 ** attempt) + random.random())
-            time.sleep(sleep_s)
+            control.sleep(sleep_s)
+
+    raise last_err if last_err else RuntimeError("Embedding failed without exception detail.")
+
+
+async def _openai_aembed(
+    texts: List[str], model: str, output_dim: int, max_retries: int, control: Optional[EmbedControl] = None,
+) -> List[List[float]]:
+    from openai import OpenAIError
+
+    client = get_async_client()
+    control = control or EmbedControl()
+    last_err: Exception | None = None
+
+    for attempt in range(max_retries):
+        try:
+            res = await client.embeddings.create(**_openai_kwargs(texts, model, output_dim))
+            return [list(item.embedding) for item in res.data]
+
+        except OpenAIError as e:
+            wait_s = _extract_retry_after_seconds(e)
+            if wait_s is None:
+                wait_s = parse_retry_seconds(str(e))
+            last_err = e
+            await control.asleep(float(wait_s) + 1.0, rate_limited=True)
+
+        except Exception as e:
+            last_err = e
+            await control.asleep(min(16.0, (2 ** attempt) + random.random()))
 
     raise last_err if last_err else RuntimeError("Embedding failed without exception detail.")
 
 
-def embed_document(texts: List[str], output_dim: int = DEFAULT_DIM) -> List[List[float]]:
+# -----------------------------
+# Local provider: hashing n-gram + random projection (deterministic, offline)
+# -----------------------------
+_LOCAL_NGRAM = 3
+
+
+def _local_features(text: str) -> Dict[str, float]:
+    """Word unigrams + char trigram (có biên từ) -> trọng số tần suất."""
+    feats: Dict[str, float] = {}
+    words = re.findall(r"\w+", (text or "").lower())
+    for w in words:
+        feats[f"w:{w}"] = feats.get(f"w:{w}", 0.0) + 1.0
+        padded = f"#{w}#"
+        for i in range(max(1, len(padded) - _LOCAL_NGRAM + 1)):
+            g = f"c:{padded[i:i + _LOCAL_NGRAM]}"
+            feats[g] = feats.get(g, 0.0) + 0.5
+    return feats
+
+
+# Mỗi entry là 1 vector dense float32 (1536-d ≈ 6KB) → 2048 entry ≈ 12MB/worker.
+# Feature ngoài cache sinh lại từ seed (vài chục µs), output không đổi nên vector đã lưu vẫn dùng được.
+_LOCAL_FEATURE_CACHE_SIZE = 2048
+
+
+@lru_cache(maxsize=_LOCAL_FEATURE_CACHE_SIZE)
+def _local_feature_vector(feature: str, dim: int) -> np.ndarray:
+    # Seed ổn định theo nội dung feature (không dùng hash() vì bị random hóa theo process)
+    seed = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(dim).astype(np.float32)
+
+
+def _local_embed(
+    texts: List[str], model: str, output_dim: int, max_retries: int, control: Optional[EmbedControl] = None,
+) -> List[List[float]]:
+    dim = int(output_dim or DEFAULT_DIM)
+    out: List[List[float]] = []
+    for t in texts:
+        vec = np.zeros(dim, dtype=np.float32)
+        for feat, w in _local_features(t).items():
+            vec += w * _local_feature_vector(feat, dim)
+        norm = float(np.linalg.norm(vec))
+        if norm > 0:
+            vec /= norm
+        out.append(vec.tolist())
+    return out
+
+
+register_embedding_provider("openai", _openai_embed, model=DEFAULT_EMBED_MODEL, async_fn=_openai_aembed)
+register_embedding_provider("local", _local_embed, model=LOCAL_EMBED_MODEL)
+
+
+def embed_texts(
+    texts: List[str],
+    task_type: str,  # giữ để tương thích; OpenAI embeddings không dùng
+    model: Optional[str] = None,
+    output_dim: int = DEFAULT_DIM,
+    title: Optional[str] = None,  # giữ để tương thích; OpenAI embeddings không dùng
+    max_retries: int = 10,
+    provider: Optional[str] = None,
+) -> List[List[float]]:
+    if not texts:
+        return []
+
+    # HEDGE_REQUESTS=on: 1 attempt kẹt quá p90 thì bắn bản sao cùng provider; đang chờ retry-after thì không,
+    # bản thua dừng trước attempt kế tiếp khi control.stop set
+    fn = get_embedding_provider(provider)
+    model_name = model or get_embedding_model_name(provider)
+    control = EmbedControl()
+    try:
+        return hedged_call(
+            f"embed:{(provider or EMBEDDING_PROVIDER).strip().lower()}",
+            lambda: fn(texts, model_name, int(output_dim), max_retries, control),
+            hedge_if=control.can_hedge,
+        )
+    finally:
+        control.stop.set()
+
+
+def embed_document(
+    texts: List[str],
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> List[List[float]]:
     return embed_texts(
         texts=texts,
         task_type="RETRIEVAL_DOCUMENT",
+        model=model,
         output_dim=output_dim,
         title="Exercise",
+        provider=provider,
     )
 
 
-def embed_query(text: str, output_dim: int = DEFAULT_DIM) -> List[float]:
+def embed_query(
+    text: str,
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> List[float]:
     vecs = embed_texts(
         texts=[text],
         task_type="RETRIEVAL_QUERY",
+        model=model,
         output_dim=output_dim,
         title=None,
+        provider=provider,
+    )
+    return vecs[0]
+
+
+async def aembed_texts(
+    texts: List[str],
+    task_type: str,
+    model: Optional[str] = None,
+    output_dim: int = DEFAULT_DIM,
+    max_retries: int = 10,
+    provider: Optional[str] = None,
+) -> List[List[float]]:
+    """Bản async của embed_texts (provider không có async native thì chạy trong thread)."""
+    if not texts:
+        return []
+
+    key = (provider or EMBEDDING_PROVIDER).strip().lower()
+    model_name = model or get_embedding_model_name(provider)
+    control = EmbedControl()
+    afn = _ASYNC_PROVIDERS.get(key)
+    if afn is None:
+        # Cancel task chỉ bỏ việc chờ, thread vẫn chạy: control.stop (set ở finally) mới dừng được nó
+        afn = partial(asyncio.to_thread, get_embedding_provider(provider))
+
+    try:
+        return await ahedged_call(
+            f"embed:{key}",
+            lambda: afn(texts, model_name, int(output_dim), max_retries, control),
+            hedge_if=control.can_hedge,
+        )
+    finally:
+        control.stop.set()
+
+
+async def aembed_query(
+    text: str,
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> List[float]:
+    vecs = await aembed_texts(
+        texts=[text],
+        task_type="RETRIEVAL_QUERY",
+        model=model,
+        output_dim=output_dim,
+        provider=provider,
     )
     return vecs[0]
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backend.services.embedding_service import (
+    DEFAULT_DIM,
+    aembed_query,
+    embed_query,
+    embed_texts,
+    get_embedding_model_name,
+)
+
+# Load lỗi (DB/bảng chưa sẵn sàng) -> thử lại sau N giây thay vì query DB mỗi request
+QUERY_VECTORS_RETRY_SECONDS = float(os.getenv("QUERY_VECTORS_RETRY_SECONDS") or 60)
+# Reload định kỳ để server nhận vector mới precompute mà không cần restart; 0 = tắt
+QUERY_VECTORS_RELOAD_SECONDS = float(os.getenv("QUERY_VECTORS_RELOAD_SECONDS") or 900)
+
+# (query_text, "<model>@<dim>") -> vector; None = chưa load
+_VECTORS: Optional[Dict[Tuple[str, str], List[float]]] = None
+_LOADED_AT = 0.0  # time.monotonic() lần load thành công gần nhất
+_RETRY_AT = 0.0  # trước mốc này không thử load lại (sau lỗi / đang có thread khác load)
+_LOCK = threading.Lock()
+
+
+def query_model_key(
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> str:
+    return f"{model or get_embedding_model_name(provider)}@{int(output_dim)}"
+
+
+def load_query_vectors(force: bool = False) -> int:
+    """Load toàn bộ bảng QueryEmbedding vào memory. Return số vector đã load."""
+    global _VECTORS, _LOADED_AT, _RETRY_AT
+    with _LOCK:
+        if _VECTORS is not None and not force:
+            return len(_VECTORS)
+
+        from backend.models import QueryEmbedding
+
+        vectors: Dict[Tuple[str, str], List[float]] = {}
+        for query_text, model_key, emb in QueryEmbedding.objects.values_list(
+            "query_text", "embedding_model", "embedding"
+        ):
+            vectors[(query_text, model_key)] = [float(x) for x in emb]
+
+        _VECTORS = vectors
+        _LOADED_AT = time.monotonic()
+        _RETRY_AT = 0.0
+        return len(vectors)
+
+
+def _needs_load() -> bool:
+    now = time.monotonic()
+    if now < _RETRY_AT:
+        return False
+    if _VECTORS is None:
+        return True
+    return QUERY_VECTORS_RELOAD_SECONDS > 0 and now - _LOADED_AT >= QUERY_VECTORS_RELOAD_SECONDS
+
+
+def _ensure_loaded() -> None:
+    """Load lần đầu / reload khi hết hạn. Lỗi -> giữ vector cũ (nếu có), thử lại sau QUERY_VECTORS_RETRY_SECONDS."""
+    global _RETRY_AT
+    with _LOCK:
+        if not _needs_load():
+            return
+        # Giữ chỗ: thread khác thấy _RETRY_AT trong tương lai sẽ không load trùng
+        _RETRY_AT = time.monotonic() + QUERY_VECTORS_RETRY_SECONDS
+    try:
+        load_query_vectors(force=True)
+    except Exception as e:
+        print(f"[QUERY_VECTORS] load failed, retry in {QUERY_VECTORS_RETRY_SECONDS:.0f}s: {e}")
+
+
+def preload_query_vectors() -> None:
+    """Gọi lúc start server (wsgi/asgi). Không block startup nếu DB/bảng chưa sẵn sàng."""
+    try:
+        n = load_query_vectors()
+        print(f"[QUERY_VECTORS] loaded {n} precomputed query vectors")
+    except Exception as e:
+        print(f"[QUERY_VECTORS] preload skipped: {e}")
+
+
+def get_precomputed_query_vector(text: str, model_key: str) -> Optional[List[float]]:
+    if _needs_load():
+        _ensure_loaded()
+    return (_VECTORS or {}).get((text, model_key))
+
+
+def embed_query_cached(
+    text: str,
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> List[float]:
+    """Ưu tiên vector precompute; chỉ embed online khi query ngoài vocabulary (vd goal_text tự do)."""
+    vec = get_precomputed_query_vector(text, query_model_key(output_dim, provider, model))
+    if vec is not None:
+        return vec
+    return embed_query(text, output_dim=output_dim, provider=provider, model=model)
+
+
+def embed_queries_cached(
+    texts: List[str],
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> Dict[str, List[float]]:
+    """Bản batch của embed_query_cached: query ngoài vocabulary embed chung 1 call. Return {text: vector}."""
+    model_key = query_model_key(output_dim, provider, model)
+    out: Dict[str, List[float]] = {}
+    missing: List[str] = []
+    for text in dict.fromkeys(texts):
+        vec = get_precomputed_query_vector(text, model_key)
+        if vec is not None:
+            out[text] = vec
+        else:
+            missing.append(text)
+    if missing:
+        vecs = embed_texts(missing, task_type="RETRIEVAL_QUERY", model=model, output_dim=output_dim, provider=provider)
+        out.update(zip(missing, vecs))
+    return out
+
+
+async def aembed_query_cached(
+    text: str,
+    output_dim: int = DEFAULT_DIM,
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+) -> List[float]:
+    """Bản async của embed_query_cached (load/reload bảng qua sync_to_async khi cần)."""
+    if _needs_load():
+        from asgiref.sync import sync_to_async
+
+        await sync_to_async(_ensure_loaded)()
+
+    vec = (_VECTORS or {}).get((text, query_model_key(output_dim, provider, model)))
+    if vec is not None:
+        return vec
+    return await aembed_query(text, output_dim=output_dim, provider=provider, model=model)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from typing import Any, Dict, List, Optional
 import os
 
@@ -61,6 +62,15 @@ class RerankService:
         else:
             raise ValueError(f"Unsupported RERANK_PROVIDER={self.provider}")
 
+    async def arerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        top_n: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Bản async của rerank: HTTP call chạy trong thread để không block event loop."""
+        return await asyncio.to_thread(self.rerank, query, candidates, top_n)
+
     def _cohere_rerank(
         self,
         query: str,
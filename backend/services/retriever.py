@@ -1,15 +1,24 @@
 from __future__ import annotations
 
+import os
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
 from django.db import connection
-from pgvector.django import CosineDistance
+from pgvector.django import CosineDistance, HalfVector, HammingDistance
 
-from backend.models import Exercise
-from backend.services.embedding_service import embed_query
+from backend.models import SHORT_EMBED_DIM, Exercise
+from backend.services.embedding_index import EmbeddingIndexSpec, get_active_embedding_index
+from backend.services.query_vectors import embed_query_cached
+from backend.services.vector_quantization import to_binary, to_halfvec, truncate_normalize
 
 DEFAULT_LIMIT = 20
 MAX_LIMIT = 100
 
+# First-stage ANN: "full" (embedding), "halfvec" (embedding_half), "binary" (embedding_bin)
+# hoặc "matryoshka" (embedding_short). Với các mode compact: lấy top limit*RESCORE_FACTOR
+# từ index compact rồi rescore bằng embedding full.
+EMBEDDING_FIRST_STAGE = (os.getenv("EMBEDDING_FIRST_STAGE") or "full").lower()
+EMBEDDING_RESCORE_FACTOR = max(1, int(os.getenv("EMBEDDING_RESCORE_FACTOR") or 4))
+
 
 def _clean_list(items: Iterable[str]) -> List[str]:
     out = []
@@ -27,12 +36,69 @@ def _clean_list(items: Iterable[str]) -> List[str]:
     return uniq
 
 
+def _semantic_search(
+    qs,
+    qvec: List[float],
+    limit: int,
+    index: EmbeddingIndexSpec,
+    first_stage: Optional[str] = None,
+) -> List[Exercise]:
+    """
+    ANN search theo cosine distance trên cột vector của index (slot) đang active.
+    Nếu first_stage là halfvec/binary/matryoshka (chỉ slot có cột compact):
+    shortlist trên index compact, rescore bằng vector full.
+    """
+    mode = (first_stage or EMBEDDING_FIRST_STAGE).lower()
+    if not index.compact:
+        mode = "full"
+
+    if mode == "matryoshka":
+        # Query vector short = truncate + normalize từ vector full (không gọi thêm API)
+        shortlist = (
+            qs.exclude(embedding_short__isnull=True)
+              .annotate(stage1=CosineDistance("embedding_short", truncate_normalize(qvec, SHORT_EMBED_DIM)))
+              .order_by("stage1")
+        )
+    elif mode == "halfvec":
+        shortlist = (
+            qs.exclude(embedding_half__isnull=True)
+              .annotate(stage1=CosineDistance("embedding_half", HalfVector(to_halfvec(qvec))))
+              .order_by("stage1")
+        )
+    elif mode == "binary":
+        shortlist = (
+            qs.exclude(embedding_bin__isnull=True)
+              .annotate(stage1=HammingDistance("embedding_bin", to_binary(qvec)))
+              .order_by("stage1")
+        )
+    else:
+        return list(
+            qs.annotate(distance=CosineDistance(index.column, qvec))
+              .order_by("distance")[:limit]
+        )
+
+    ids = list(shortlist.values_list("id", flat=True)[: limit * EMBEDDING_RESCORE_FACTOR])
+    if not ids:
+        return []
+
+    return list(
+        Exercise.objects.filter(id__in=ids)
+        .annotate(distance=CosineDistance(index.column, qvec))
+        .order_by("distance")[:limit]
+    )
+
+
 def retrieve_exercises(
     q: Optional[str] = None,
     muscles: Optional[Sequence[str]] = None,
     limit: Union[int, str] = DEFAULT_LIMIT,
     use_semantic: bool = True,
+    query_vector: Optional[List[float]] = None,
 ) -> List[Exercise]:
+    """
+    query_vector: vector của q đã embed sẵn (vd từ path async) -> bỏ qua embed trong hàm.
+    Phải cùng model/dim với embedding index đang active.
+    """
     q = (q or "").strip()
     muscles = _clean_list(muscles or [])
 
@@ -46,17 +112,17 @@ def retrieve_exercises(
 
     # Semantic path (Postgres + có embedding + có query)
     if use_semantic and q and connection.vendor == "postgresql":
-        qs2 = qs.exclude(embedding__isnull=True)
+        index = get_active_embedding_index()
+        qs2 = qs.exclude(**{f"{index.column}__isnull": True})
 
         if muscles:
             for m in muscles:
                 qs2 = qs2.filter(muscle_groups__contains=[m])
 
-        qvec = embed_query(q, output_dim=1536)
-        return list(
-            qs2.annotate(distance=CosineDistance("embedding", qvec))
-               .order_by("distance")[:limit_int]
-        )
+        qvec = query_vector
+        if qvec is None:
+            qvec = embed_query_cached(q, output_dim=index.dim, provider=index.provider, model=index.model)
+        return _semantic_search(qs2, qvec, limit_int, index)
 
     # Fallback path (logic hiện tại)
     if q:
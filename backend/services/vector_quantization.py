@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
+
+
+def to_halfvec(vec: Sequence[float]) -> List[float]:
+    """float32 -> float16 (làm tròn trước để giá trị ghi vào halfvec khớp với khi query)."""
+    return np.asarray(vec, dtype=np.float16).astype(np.float32).tolist()
+
+
+def to_binary(vec: Sequence[float]) -> str:
+    """Binary quantization giống pgvector binary_quantize(): bit=1 nếu giá trị > 0."""
+    arr = np.asarray(vec, dtype=np.float32)
+    return "".join("1" if x > 0 else "0" for x in arr)
+
+
+
+def truncate_normalize(vec: Sequence[float], dim: int) -> List[float]:
+    """
+    Matryoshka: cắt vector về `dim` chiều đầu rồi L2-normalize lại.
+    Với text-embedding-3-*, kết quả tương đương gọi API với dimensions=dim.
+    """
+    arr = np.asarray(vec, dtype=np.float32)[: int(dim)]
+    norm = float(np.linalg.norm(arr))
+    if norm > 0:
+        arr = arr / norm
+    return arr.tolist()
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+# Hedged request: call chưa về sau p90 latency gần đây → bắn thêm 1 bản sao (cùng target hoặc target
+# dự phòng), dùng kết quả về trước. on = bật | off = tắt (mặc định, mỗi call gọi 1 lần như cũ)
+HEDGE_REQUESTS = (os.getenv("HEDGE_REQUESTS") or "off").lower()
+# Quantile latency làm ngưỡng hedge, tính trên HEDGE_WINDOW call gần nhất của từng key (llm:<schema>, embed:<provider>)
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE") or 0.9)
+HEDGE_WINDOW = max(1, int(os.getenv("HEDGE_WINDOW") or 100))
+# Chưa đủ sample thì chưa hedge (quantile chưa tin được)
+HEDGE_MIN_SAMPLES = max(1, int(os.getenv("HEDGE_MIN_SAMPLES") or 20))
+# Ngưỡng tối thiểu: call vốn nhanh (local embedding, mock) không đáng bắn bản sao
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS") or 200)
+# Số bản sao tối đa cho 1 request pipeline (chặn chi phí tăng thêm khi provider chậm toàn cục)
+HEDGE_BUDGET = max(0, int(os.getenv("HEDGE_BUDGET") or 2))
+# Worker pool của path sync (call gốc + bản sao chạy trên thread). Pool đầy thì gọi thẳng trên thread hiện tại,
+# không xếp hàng sau call khác (call thua vẫn giữ worker tới khi attempt đang bay xong)
+HEDGE_MAX_WORKERS = max(2, int(os.getenv("HEDGE_MAX_WORKERS") or 32))
+
+T = TypeVar("T")
+
+
+class HedgeBudget:
+    """Số bản sao còn được bắn trong 1 request; dùng chung cho mọi thread/task của request (qua contextvars)."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(0, int(limit))
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> int:
+        return self.limit - self.used
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def refund(self) -> None:
+        """Trả lại 1 lượt đã take() nhưng không bắn được bản sao (pool đầy)."""
+        with self._lock:
+            self.used = max(0, self.used - 1)
+
+
+_BUDGET: contextvars.ContextVar[Optional[HedgeBudget]] = contextvars.ContextVar("hedge_budget", default=None)
+
+
+@contextmanager
+def hedge_budget(limit: Optional[int] = None) -> Iterator[HedgeBudget]:
+    """Mở budget hedge cho 1 request; ngoài block này (management command, script) không hedge."""
+    budget = HedgeBudget(HEDGE_BUDGET if limit is None else limit)
+    token = _BUDGET.set(budget)
+    try:
+        yield budget
+    finally:
+        _BUDGET.reset(token)
+
+
+def hedging_enabled() -> bool:
+    return HEDGE_REQUESTS == "on"
+
+
+# -----------------------------
+# Latency window + counters (process-local)
+# -----------------------------
+class _KeyStats:
+    def __init__(self) -> None:
+        self.samples: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.saturated = 0
+
+    def delay_ms(self) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))
+        return max(HEDGE_MIN_DELAY_MS, ordered[idx])
+
+
+_STATS: Dict[str, _KeyStats] = {}
+_LOCK = threading.Lock()
+
+
+def _stats(key: str) -> _KeyStats:
+    st = _STATS.get(key)
+    if st is None:
+        st = _STATS.setdefault(key, _KeyStats())
+    return st
+
+
+def _delay_ms(key: str) -> Optional[float]:
+    with _LOCK:
+        return _stats(key).delay_ms()
+
+
+def _observe(
+    key: str,
+    latency_ms: Optional[float],
+    hedged: bool = False,
+    hedge_won: bool = False,
+    denied: bool = False,
+    saturated: bool = False,
+) -> None:
+    """
+    Ghi 1 call. latency_ms là thời gian của call gốc; khi bản sao thắng thì call gốc chưa về nên
+    ghi thời gian đã chờ (cận dưới) để quantile không bị kéo xuống theo chính các lần hedge.
+    """
+    with _LOCK:
+        st = _stats(key)
+        st.calls += 1
+        st.hedged += int(hedged)
+        st.hedge_wins += int(hedge_won)
+        st.budget_denied += int(denied)
+        st.saturated += int(saturated)
+        if latency_ms is not None:
+            st.samples.append(latency_ms)
+
+
+def get_hedge_snapshot() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    with _LOCK:
+        for key, st in sorted(_STATS.items()):
+            out[key] = {
+                "samples": len(st.samples),
+                "delay_ms": st.delay_ms(),
+                "calls": st.calls,
+                "hedged": st.hedged,
+                "hedge_wins": st.hedge_wins,
+                "win_rate": st.hedge_wins / st.hedged if st.hedged else None,
+                "budget_denied": st.budget_denied,
+                "saturated": st.saturated,
+            }
+    return out
+
+
+# -----------------------------
+# Hedged call
+# -----------------------------
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+_IN_FLIGHT = 0  # số task đang chiếm worker của _EXECUTOR
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+    return _EXECUTOR
+
+
+def _submit(fn: Callable[[], T]) -> Optional[Future]:
+    """Chạy fn trên pool (trong bản copy contextvars); pool đã đủ HEDGE_MAX_WORKERS task → None."""
+    global _IN_FLIGHT
+    with _EXECUTOR_LOCK:
+        if _IN_FLIGHT >= HEDGE_MAX_WORKERS:
+            return None
+        _IN_FLIGHT += 1
+    fut = _executor().submit(contextvars.copy_context().run, fn)
+    fut.add_done_callback(_release)
+    return fut
+
+
+def _release(_: Future) -> None:
+    global _IN_FLIGHT
+    with _EXECUTOR_LOCK:
+        _IN_FLIGHT -= 1
+
+
+def _elapsed_ms(t0: float) -> float:
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def _hedge_plan(key: str) -> Optional[float]:
+    """Ngưỡng hedge (ms) cho call này; None → gọi thẳng (tắt, ngoài request, chưa đủ sample, hết budget)."""
+    if not hedging_enabled():
+        return None
+    budget = _BUDGET.get()
+    if budget is None or budget.remaining() <= 0:
+        return None
+    return _delay_ms(key)
+
+
+def _observe_direct(key: str, t0: float) -> None:
+    """Ghi call không qua hedge; quá ngưỡng mà budget request đã hết → tính budget_denied."""
+    if not hedging_enabled():
+        return
+    latency = _elapsed_ms(t0)
+    budget = _BUDGET.get()
+    delay_ms = _delay_ms(key)
+    denied = budget is not None and budget.remaining() <= 0 and delay_ms is not None and latency > delay_ms
+    _observe(key, latency, denied=denied)
+
+
+def _first_ok(futures: List[Future]) -> Optional[Future]:
+    """Future thành công về trước; lỗi thì chờ future còn lại. Tất cả lỗi → None."""
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                return fut
+    return None
+
+
+def hedged_call(
+    key: str,
+    fn: Callable[[], T],
+    hedge_fn: Optional[Callable[[], T]] = None,
+    hedge_if: Optional[Callable[[], bool]] = None,
+) -> T:
+    """
+    Gọi fn(); chưa về sau ngưỡng quantile của key thì bắn hedge_fn() (mặc định fn) song song
+    và trả kết quả thành công về trước. Cả hai lỗi → raise lỗi của call gốc.
+    Call thua không dừng được giữa chừng (sync): kết quả của nó bị bỏ, caller tự báo nó dừng
+    giữa các attempt (vd threading.Event). Pool đầy → không hedge.
+    hedge_if() == False lúc tới ngưỡng (vd call gốc đang chờ retry-after của provider) → không hedge.
+    Call lỗi vẫn được ghi vào stats.
+    """
+    delay_ms = _hedge_plan(key)
+    t0 = time.perf_counter()
+    primary = _submit(fn) if delay_ms is not None else None
+    if primary is None:
+        try:
+            return fn()
+        finally:
+            if delay_ms is None:
+                _observe_direct(key, t0)
+            else:
+                _observe(key, _elapsed_ms(t0), saturated=True)
+
+    done, _ = wait([primary], timeout=delay_ms / 1000.0)
+    if not done and hedge_if is not None and not hedge_if():
+        try:
+            return primary.result()
+        finally:
+            # Thời gian chờ retry-after không phải latency của provider: không đưa vào quantile
+            _observe(key, None)
+
+    budget = _BUDGET.get()
+    if done or budget is None or not budget.take():
+        try:
+            return primary.result()
+        finally:
+            _observe(key, _elapsed_ms(t0), denied=not done)
+
+    hedge = _submit(hedge_fn or fn)
+    if hedge is None:
+        budget.refund()
+        try:
+            return primary.result()
+        finally:
+            _observe(key, _elapsed_ms(t0), saturated=True)
+
+    print(f"[HEDGE] key={key} no response after {delay_ms:.0f}ms, hedging (budget {budget.used}/{budget.limit})")
+    winner = _first_ok([primary, hedge])
+    _observe(key, _elapsed_ms(t0), hedged=True, hedge_won=winner is hedge)
+    if winner is None:
+        return primary.result()
+    return winner.result()
+
+
+async def ahedged_call(
+    key: str,
+    afn: Callable[[], Awaitable[T]],
+    hedge_afn: Optional[Callable[[], Awaitable[T]]] = None,
+    hedge_if: Optional[Callable[[], bool]] = None,
+) -> T:
+    """Bản async của hedged_call: call thua bị cancel ngay khi đã có kết quả."""
+    delay_ms = _hedge_plan(key)
+    t0 = time.perf_counter()
+    if delay_ms is None:
+        try:
+            return await afn()
+        finally:
+            _observe_direct(key, t0)
+
+    primary = asyncio.ensure_future(afn())
+    done, _ = await asyncio.wait({primary}, timeout=delay_ms / 1000.0)
+    if not done and hedge_if is not None and not hedge_if():
+        try:
+            return await primary
+        finally:
+            _observe(key, None)
+
+    budget = _BUDGET.get()
+    if done or budget is None or not budget.take():
+        try:
+            return await primary
+        finally:
+            _observe(key, _elapsed_ms(t0), denied=not done)
+
+    print(f"[HEDGE] key={key} no response after {delay_ms:.0f}ms, hedging (budget {budget.used}/{budget.limit})")
+    hedge = asyncio.ensure_future((hedge_afn or afn)())
+    pending = {primary, hedge}
+    winner = None
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in done if t.exception() is None), None)
+    finally:
+        for task in pending:
+            task.cancel()
+    _observe(key, _elapsed_ms(t0), hedged=True, hedge_won=winner is hedge)
+    if winner is None:
+        return primary.result()
+    return winner.result()
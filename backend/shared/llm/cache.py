@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+# Cache response LLM dùng chung giữa các worker (khác simple_cache chỉ sống trong 1 process).
+# Backend chọn qua env: sqlite (mặc định, file local) | none; backend mạng đăng ký thêm qua registry.
+LLM_CACHE_BACKEND = (os.getenv("LLM_CACHE_BACKEND") or "sqlite").lower()
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or str(Path(__file__).resolve().parents[3] / "llm_cache.sqlite3")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL") or 7 * 24 * 3600)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES") or 20000)
+
+
+def llm_cache_key(provider: str, model: str, schema_name: str, prompt_hash: str) -> str:
+    return f"{provider}:{model}:{schema_name}:{prompt_hash}"
+
+
+class LLMResponseCache(abc.ABC):
+    """Interface tối thiểu cho backend cache (sqlite, redis, ...)."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl_seconds: int = LLM_CACHE_TTL) -> None:
+        ...
+
+
+class NullLLMCache(LLMResponseCache):
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def set(self, key: str, value: Any, ttl_seconds: int = LLM_CACHE_TTL) -> None:
+        return None
+
+
+class SQLiteLLMCache(LLMResponseCache):
+    """
+    File SQLite dùng chung cho mọi worker trên cùng máy (WAL cho phép đọc song song).
+    Value lưu dạng JSON nén zlib; số entry bị giới hạn, entry sắp hết hạn bị xóa trước.
+    """
+
+    _TRIM_EVERY = 100  # trim mỗi N lần set để không tốn 1 DELETE cho mọi call
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self._local = threading.local()
+        self._sets = 0
+        self._sets_lock = threading.Lock()
+        self._conn()  # tạo bảng ngay để lỗi path lộ ra sớm
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires_at)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        blob, expires_at = row
+        if expires_at < time.time():
+            return None
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def set(self, key: str, value: Any, ttl_seconds: int = LLM_CACHE_TTL) -> None:
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, time.time() + ttl_seconds, sqlite3.Binary(blob)),
+            )
+
+        with self._sets_lock:
+            self._sets += 1
+            due = self._sets % self._TRIM_EVERY == 1
+        if due:
+            self.trim()
+
+    def trim(self) -> None:
+        """Xóa entry hết hạn, sau đó cắt về max_entries (bỏ entry hết hạn sớm nhất)."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+# -----------------------------
+# Backend registry
+# -----------------------------
+_BACKENDS: Dict[str, Callable[[], LLMResponseCache]] = {
+    "sqlite": lambda: SQLiteLLMCache(),
+    "none": NullLLMCache,
+}
+
+_CACHE: Optional[LLMResponseCache] = None
+_LOCK = threading.Lock()
+
+
+def register_llm_cache_backend(name: str, factory: Callable[[], LLMResponseCache]) -> None:
+    """Đăng ký backend mới (vd redis dùng chung cả fleet) rồi chọn bằng LLM_CACHE_BACKEND."""
+    _BACKENDS[(name or "").strip().lower()] = factory
+
+
+def get_llm_cache() -> LLMResponseCache:
+    global _CACHE
+    if _CACHE is not None:
+        return _CACHE
+
+    with _LOCK:
+        if _CACHE is None:
+            factory = _BACKENDS.get(LLM_CACHE_BACKEND)
+            if factory is None:
+                print(f"[LLM_CACHE] unknown backend={LLM_CACHE_BACKEND}, cache disabled")
+                _CACHE = NullLLMCache()
+            else:
+                try:
+                    _CACHE = factory()
+                except Exception as e:
+                    # Không mở được file/DB: chạy tiếp không cache thay vì làm hỏng request
+                    print(f"[LLM_CACHE] init failed ({LLM_CACHE_BACKEND}): {e}")
+                    _CACHE = NullLLMCache()
+    return _CACHE
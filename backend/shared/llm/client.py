@@ -1,40 +1,55 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional, Type
+import asyncio
+import threading
+import time
+import weakref
+from dataclasses import replace
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
 
 from pydantic import BaseModel
 
+from backend.shared.hedging import ahedged_call, hedged_call
+from backend.shared.llm.cache import llm_cache_key
 from backend.shared.llm.config import LLMConfig
-from backend.domains.workout.schemas import WorkoutPlan
-
-
-def _log_prompt_stats(tag: str, prompt: str) -> None:
-    try:
-        prompt = prompt or ""
-        chars = len(prompt)
-        lines = prompt.count("\n") + 1
-        approx_tokens = chars // 4  # ước lượng thô
-        head = prompt[:300].replace("\n", "\\n")
-        print(f"[LLM][{tag}] prompt_chars={chars} prompt_lines={lines} approx_tokens~={approx_tokens}")
-        print(f"[LLM][{tag}] prompt_head={head}")
-    except Exception:
-        print(f"[LLM][{tag}] prompt log failed")
+from backend.shared.llm.metrics import LLMCallRecord, new_call_record, record_llm_call
+from backend.shared.llm.routing import current_task, get_llm_router
+from backend.shared.llm.salvage import salvage_structured
 
 
 class LLMClient:
     """
     Generic LLM client cho mọi domain.
     Hỗ trợ structured output theo schema Pydantic bất kỳ.
+
+    Chat model và structured-output runnable được build 1 lần rồi cache theo
+    (provider, model[, schema]); HTTP connection pool (keep-alive) dùng chung
+    nên các call lặp lại bỏ qua khởi tạo client, convert schema và TLS handshake.
+    Path async cache riêng theo event loop: AsyncClient gắn với loop tạo ra nó
+    (WSGI/runserver mỗi request 1 loop mới, loop cũ đã đóng thì không dùng lại được);
+    loop chỉ sống 1 request thì caller gọi aclose_loop_clients() trước khi loop kết thúc.
     """
 
     def __init__(self, cfg: Optional[LLMConfig] = None) -> None:
         self.cfg = cfg or LLMConfig.from_env()
+        self._lock = threading.Lock()
+        self._chat_models: Dict[Tuple[str, str], Any] = {}
+        self._structured: Dict[Tuple[str, str, Type[BaseModel]], Any] = {}
+        self._structured_stream: Dict[Tuple[str, str, Type[BaseModel]], Any] = {}
+        self._http_client: Any = None
+        self._loops: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._variants: Dict[float, "LLMClient"] = {}
 
     # -----------------------------
     # Backward-compatible entrypoint
     # -----------------------------
     def generate_plan_json(self, prompt: str, response_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         # response_schema giữ lại để tương thích chữ ký cũ, hiện không dùng
+        # Import trong hàm: shared/llm không phụ thuộc domain lúc import (tránh vòng import)
+        from backend.domains.workout.schemas import WorkoutPlan
+
         return self.generate_structured(prompt, WorkoutPlan)
 
     # -----------------------------
@@ -44,77 +59,449 @@ class LLMClient:
         """
         Generate structured JSON theo schema_model (Pydantic BaseModel).
         Return: dict (model_dump) để pipeline dùng thống nhất.
+
+        Có LLM_ROUTES: thử target của task theo thứ tự router (shared/llm/routing.py); lỗi thì failover
+        ngay sang target kế tiếp, chỉ backoff khi đã thử hết 1 vòng target.
+        HEDGE_REQUESTS=on: chưa về sau p90 latency của schema thì bắn bản sao (ưu tiên target dự phòng).
+        Mỗi bản có record riêng, chỉ ghi record của bản thắng; bản thua dừng trước attempt kế tiếp.
         """
-        if self.cfg.provider == "gemini":
-            return self._gemini_generate_structured(prompt, schema_model)
-        if self.cfg.provider == "openai":
-            return self._openai_generate_structured(prompt, schema_model)
-        raise ValueError(f"Unsupported LLM_PROVIDER={self.cfg.provider}")
+        task, prepared = self._prepare_targets(prompt, schema_model)
+        records: Dict[str, LLMCallRecord] = {}
+        stop = threading.Event()
+
+        def attempt(name: str, order: List[Tuple[str, str, Any]]) -> Tuple[Dict[str, Any], LLMCallRecord]:
+            record = records[name] = new_call_record(schema_model.__name__, order[0][0], order[0][1])
+            return self._invoke_targets(task, order, prompt, schema_model, record, stop), record
+
+        t0 = time.perf_counter()
+        record: Optional[LLMCallRecord] = None
+        try:
+            out, record = hedged_call(
+                f"llm:{schema_model.__name__}",
+                lambda: attempt("primary", prepared),
+                lambda: attempt("hedge", self._hedge_order(prepared)),
+            )
+            return out
+        except Exception as e:
+            record = records.get("primary") or new_call_record(schema_model.__name__, prepared[0][0], prepared[0][1])
+            record.ok, record.error = False, str(e)[:300]
+            raise
+        finally:
+            stop.set()
+            if record is not None:
+                record.latency_ms = (time.perf_counter() - t0) * 1000.0
+                record_llm_call(record)
+
+    async def agenerate_structured(self, prompt: str, schema_model: Type[BaseModel]) -> Dict[str, Any]:
+        """Bản async của generate_structured (runnable.ainvoke, không block event loop)."""
+        task, prepared = self._prepare_targets(prompt, schema_model, aio=True)
+        records: Dict[str, LLMCallRecord] = {}
+
+        async def attempt(name: str, order: List[Tuple[str, str, Any]]) -> Tuple[Dict[str, Any], LLMCallRecord]:
+            record = records[name] = new_call_record(schema_model.__name__, order[0][0], order[0][1])
+            return await self._ainvoke_targets(task, order, prompt, schema_model, record), record
+
+        t0 = time.perf_counter()
+        record: Optional[LLMCallRecord] = None
+        try:
+            out, record = await ahedged_call(
+                f"llm:{schema_model.__name__}",
+                lambda: attempt("primary", prepared),
+                lambda: attempt("hedge", self._hedge_order(prepared)),
+            )
+            return out
+        except Exception as e:
+            record = records.get("primary") or new_call_record(schema_model.__name__, prepared[0][0], prepared[0][1])
+            record.ok, record.error = False, str(e)[:300]
+            raise
+        finally:
+            if record is not None:
+                record.latency_ms = (time.perf_counter() - t0) * 1000.0
+                record_llm_call(record)
+
+    def _invoke_targets(
+        self,
+        task: str,
+        prepared: List[Tuple[str, str, Any]],
+        prompt: str,
+        schema_model: Type[BaseModel],
+        record: LLMCallRecord,
+        stop: Optional[threading.Event] = None,
+    ) -> Dict[str, Any]:
+        """
+        Vòng retry/failover qua các target (provider/model của target trả lời ghi vào record).
+        stop set (bản hedge kia đã thắng) → dừng trước attempt kế tiếp, không gọi/ghi router thêm.
+        """
+        attempts = self._attempts(len(prepared))
+        for attempt in range(attempts):
+            provider, model, structured = prepared[attempt % len(prepared)]
+            if attempt >= len(prepared):
+                delay = self._backoff(attempt - len(prepared))
+                if stop is not None:
+                    stop.wait(delay)
+                else:
+                    time.sleep(delay)
+            if stop is not None and stop.is_set():
+                raise RuntimeError("hedged call already answered")
+            record.provider, record.model = provider, model
+            a0 = time.perf_counter()
+            try:
+                out = self._unpack(provider, structured.invoke(prompt), schema_model, record)
+            except Exception:
+                self._route_record(task, provider, model, a0, ok=False)
+                if attempt >= attempts - 1:
+                    raise
+                record.retries += 1
+                continue
+            self._route_record(task, provider, model, a0, ok=True)
+            return out
+        raise RuntimeError("unreachable")
+
+    async def _ainvoke_targets(
+        self,
+        task: str,
+        prepared: List[Tuple[str, str, Any]],
+        prompt: str,
+        schema_model: Type[BaseModel],
+        record: LLMCallRecord,
+    ) -> Dict[str, Any]:
+        attempts = self._attempts(len(prepared))
+        for attempt in range(attempts):
+            provider, model, structured = prepared[attempt % len(prepared)]
+            record.provider, record.model = provider, model
+            if attempt >= len(prepared):
+                await asyncio.sleep(self._backoff(attempt - len(prepared)))
+            a0 = time.perf_counter()
+            try:
+                out = self._unpack(provider, await structured.ainvoke(prompt), schema_model, record)
+            except Exception:
+                self._route_record(task, provider, model, a0, ok=False)
+                if attempt >= attempts - 1:
+                    raise
+                record.retries += 1
+                continue
+            self._route_record(task, provider, model, a0, ok=True)
+            return out
+        raise RuntimeError("unreachable")
+
+    def stream_structured(self, prompt: str, schema_model: Type[BaseModel]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream structured output dạng partial dict (JSON đang sinh dở được parse dần).
+        Partial chưa validate theo schema_model; caller tự validate từng phần / bản cuối.
+        Failover sang target kế tiếp chỉ khi lỗi trước chunk đầu tiên (đã yield thì raise).
+        """
+        task = current_task()
+        targets = self._targets(task)
+        for provider, model in targets:
+            self._prepare_call(provider, model, prompt, schema_model)
+        # Stream không có usage_metadata ổn định -> chỉ ghi latency
+        record = new_call_record(schema_model.__name__, targets[0][0], targets[0][1])
+        t0 = time.perf_counter()
+        try:
+            for i, (provider, model) in enumerate(targets):
+                record.provider, record.model = provider, model
+                runnable = self._get_structured_stream(provider, model, schema_model)
+                a0 = time.perf_counter()
+                started = False
+                try:
+                    for chunk in runnable.stream(prompt):
+                        if hasattr(chunk, "model_dump"):
+                            started = True
+                            yield chunk.model_dump(mode="json")
+                        elif isinstance(chunk, dict):
+                            started = True
+                            yield chunk
+                except Exception:
+                    self._route_record(task, provider, model, a0, ok=False)
+                    if started or i >= len(targets) - 1:
+                        raise
+                    record.retries += 1
+                    continue
+                self._route_record(task, provider, model, a0, ok=True)
+                return
+        except Exception as e:
+            record.ok, record.error = False, str(e)[:300]
+            raise
+        finally:
+            record.latency_ms = (time.perf_counter() - t0) * 1000.0
+            record_llm_call(record)
+
+    def with_temperature(self, temperature: float) -> "LLMClient":
+        """Client cùng config nhưng khác temperature (cache theo giá trị, dùng cho sinh nhiều phương án)."""
+        if temperature == self.cfg.temperature:
+            return self
+        with self._lock:
+            client = self._variants.get(temperature)
+            if client is None:
+                client = LLMClient(replace(self.cfg, temperature=temperature))
+                self._variants[temperature] = client
+        return client
+
+    def response_cache_key(self, schema_model: Type[BaseModel], prompt_hash: str) -> str:
+        """Key cache response: (provider, model, schema, prompt hash); target đầu theo cấu hình route của task."""
+        try:
+            provider, model = self._route(current_task())[0]
+        except ValueError:
+            provider, model = self.cfg.provider, ""
+        return llm_cache_key(provider, model, schema_model.__name__, prompt_hash)
 
     # -----------------------------
-    # Providers
+    # Pooled clients / cached runnables
     # -----------------------------
-    def _gemini_generate_structured(self, prompt: str, schema_model: Type[BaseModel]) -> Dict[str, Any]:
-        if not self.cfg.gemini_api_key:
-            raise RuntimeError("Missing GEMINI_API_KEY (or GOOGLE_API_KEY)")
+    def _http_limits(self) -> Any:
+        import httpx
 
-        _log_prompt_stats("GEMINI_LANGCHAIN_INPUT", prompt)
+        return httpx.Limits(
+            max_connections=self.cfg.http_max_connections,
+            max_keepalive_connections=self.cfg.http_max_keepalive,
+        )
 
-        from langchain_google_genai import ChatGoogleGenerativeAI
+    def _get_http_client(self) -> Any:
+        """httpx.Client dùng chung (keep-alive pool) cho provider hỗ trợ inject http client."""
+        if self._http_client is None:
+            import httpx
 
-        llm = ChatGoogleGenerativeAI(
-            model=self.cfg.gemini_model,
-            temperature=self.cfg.temperature,
-            max_retries=self.cfg.max_retries,
-            google_api_key=self.cfg.gemini_api_key,
-        )
+            self._http_client = httpx.Client(limits=self._http_limits(), timeout=self.cfg.http_timeout)
+        return self._http_client
 
-        # Ưu tiên json_schema nếu version hỗ trợ để structured ổn định hơn
-        try:
-            structured = llm.with_structured_output(schema_model, method="json_schema")
-        except TypeError:
-            structured = llm.with_structured_output(schema_model)
+    def _loop_cache(self) -> Dict[str, Any]:
+        """Cache của event loop đang chạy (AsyncClient + chat model/runnable build với client đó)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            cache = self._loops.get(loop)
+            if cache is None:
+                cache = {"http": None, "chat_models": {}, "structured": {}}
+                self._loops[loop] = cache
+        return cache
 
-        result = structured.invoke(prompt)
+    def _get_http_async_client(self) -> Any:
+        """httpx.AsyncClient cho path async (ainvoke), 1 pool / event loop."""
+        cache = self._loop_cache()
+        if cache["http"] is None:
+            import httpx
 
-        # LangChain thường trả về Pydantic model
-        if hasattr(result, "model_dump"):
-            return result.model_dump()
-        # Fallback nếu trả dict
-        return dict(result)
+            with self._lock:
+                if cache["http"] is None:
+                    cache["http"] = httpx.AsyncClient(limits=self._http_limits(), timeout=self.cfg.http_timeout)
+        return cache["http"]
 
-    def _openai_generate_structured(self, prompt: str, schema_model: Type[BaseModel]) -> Dict[str, Any]:
-        if not self.cfg.openai_api_key:
-            raise RuntimeError("Missing OPENAI_API_KEY")
+    async def aclose_loop_clients(self) -> None:
+        """
+        Đóng AsyncClient của event loop đang chạy và bỏ cache của loop đó (kể cả các bản with_temperature).
+        Dưới WSGI mỗi request chạy view async trong 1 loop mới: gọi ở cuối request để pool không bị bỏ rơi.
+        Dưới ASGI loop sống suốt worker nên không cần gọi.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            cache = self._loops.pop(loop, None)
+            variants = list(self._variants.values())
+        if cache is not None and cache["http"] is not None:
+            await cache["http"].aclose()
+        for client in variants:
+            await client.aclose_loop_clients()
 
-        _log_prompt_stats("OPENAI_LANGCHAIN_INPUT", prompt)
+    def _build_chat_model(self, provider: str, model: str, http_async_client: Any = None) -> Any:
+        if provider == "mock":
+            from backend.shared.llm.mock import MockChatModel
 
-        from langchain_openai import ChatOpenAI
+            return MockChatModel()
 
-        # Tương thích nhiều version: api_key vs openai_api_key
-        try:
-            llm = ChatOpenAI(
-                model=self.cfg.openai_model,
-                api_key=self.cfg.openai_api_key,
-                temperature=self.cfg.temperature,
-                max_retries=self.cfg.max_retries,
-            )
-        except TypeError:
-            llm = ChatOpenAI(
-                model=self.cfg.openai_model,
-                openai_api_key=self.cfg.openai_api_key,
+        if provider == "gemini":
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            # Client google-genai bên trong instance giữ connection; cache instance là đủ reuse
+            return ChatGoogleGenerativeAI(
+                model=model,
                 temperature=self.cfg.temperature,
-                max_retries=self.cfg.max_retries,
+                max_retries=0,  # retry do LLMClient tự quản (đếm retries cho metrics)
+                google_api_key=self.cfg.gemini_api_key,
             )
 
-        # Một số version có thể hỗ trợ method, nhưng OpenAI thường ổn với mặc định
-        try:
-            structured = llm.with_structured_output(schema_model, method="json_schema")
-        except TypeError:
-            structured = llm.with_structured_output(schema_model)
+        if provider == "openai":
+            from langchain_openai import ChatOpenAI
+
+            # Tương thích nhiều version: api_key vs openai_api_key
+            try:
+                return ChatOpenAI(
+                    model=model,
+                    api_key=self.cfg.openai_api_key,
+                    temperature=self.cfg.temperature,
+                    max_retries=0,
+                    http_client=self._get_http_client(),
+                    http_async_client=http_async_client,
+                )
+            except TypeError:
+                return ChatOpenAI(
+                    model=model,
+                    openai_api_key=self.cfg.openai_api_key,
+                    temperature=self.cfg.temperature,
+                    max_retries=0,
+                    http_client=self._get_http_client(),
+                    http_async_client=http_async_client,
+                )
+
+        raise ValueError(f"Unsupported LLM_PROVIDER={provider}")
+
+    def _get_chat_model(self, provider: str, model: str, aio: bool = False) -> Any:
+        key = (provider, model)
+        models = self._loop_cache()["chat_models"] if aio else self._chat_models
+        llm = models.get(key)
+        if llm is not None:
+            return llm
+        http_async_client = self._get_http_async_client() if aio and provider == "openai" else None
+        with self._lock:
+            llm = models.get(key)
+            if llm is None:
+                llm = self._build_chat_model(provider, model, http_async_client=http_async_client)
+                models[key] = llm
+        return llm
+
+    def _get_structured(self, provider: str, model: str, schema_model: Type[BaseModel], aio: bool = False) -> Any:
+        key = (provider, model, schema_model)
+        cache = self._loop_cache()["structured"] if aio else self._structured
+        structured = cache.get(key)
+        if structured is not None:
+            return structured
+
+        llm = self._get_chat_model(provider, model, aio=aio)
+        with self._lock:
+            structured = cache.get(key)
+            if structured is None:
+                # Ưu tiên json_schema nếu version hỗ trợ để structured ổn định hơn.
+                # include_raw=True để lấy usage_metadata (token thật do provider báo)
+                try:
+                    structured = llm.with_structured_output(schema_model, method="json_schema", include_raw=True)
+                except TypeError:
+                    structured = llm.with_structured_output(schema_model, include_raw=True)
+                cache[key] = structured
+        return structured
+
+    def _get_structured_stream(self, provider: str, model: str, schema_model: Type[BaseModel]) -> Any:
+        """
+        Runnable cho streaming: truyền JSON schema (dict) thay vì class Pydantic
+        để parser trả partial dict theo từng chunk thay vì 1 object ở cuối.
+        """
+        key = (provider, model, schema_model)
+        runnable = self._structured_stream.get(key)
+        if runnable is not None:
+            return runnable
+
+        llm = self._get_chat_model(provider, model)
+        json_schema = schema_model.model_json_schema()
+        with self._lock:
+            runnable = self._structured_stream.get(key)
+            if runnable is None:
+                try:
+                    runnable = llm.with_structured_output(json_schema, method="json_schema")
+                except TypeError:
+                    runnable = llm.with_structured_output(json_schema)
+                self._structured_stream[key] = runnable
+        return runnable
+
+    # -----------------------------
+    # Providers
+    # -----------------------------
+    def _target(self) -> Tuple[str, str]:
+        return self.cfg.provider, self._default_model(self.cfg.provider)
 
-        result = structured.invoke(prompt)
+    def _default_model(self, provider: str) -> str:
+        if provider == "gemini":
+            return self.cfg.gemini_model
+        if provider == "openai":
+            return self.cfg.openai_model
+        if provider == "mock":
+            from backend.shared.llm.mock import MOCK_LLM_MODEL
 
+            return MOCK_LLM_MODEL
+        raise ValueError(f"Unsupported LLM_PROVIDER={provider}")
+
+    def _has_credentials(self, provider: str) -> bool:
+        if provider == "gemini":
+            return bool(self.cfg.gemini_api_key)
+        if provider == "openai":
+            return bool(self.cfg.openai_api_key)
+        return True
+
+    def _route(self, task: str) -> List[Tuple[str, str]]:
+        """Target cấu hình cho task (LLM_ROUTES, bỏ provider thiếu API key); không có route → target theo cfg."""
+        targets = [
+            (provider, model or self._default_model(provider))
+            for provider, model in get_llm_router().configured(task)
+            if self._has_credentials(provider)
+        ]
+        return targets or [self._target()]
+
+    def _targets(self, task: str) -> List[Tuple[str, str]]:
+        """Thứ tự thử cho call hiện tại: healthy + nhanh trước (router), target đang cooldown cuối."""
+        return get_llm_router().order(task, self._route(task))
+
+    def _prepare_targets(
+        self, prompt: str, schema_model: Type[BaseModel], aio: bool = False,
+    ) -> Tuple[str, List[Tuple[str, str, Any]]]:
+        task = current_task()
+        return task, [
+            (provider, model, self._prepare_call(provider, model, prompt, schema_model, aio=aio))
+            for provider, model in self._targets(task)
+        ]
+
+    @staticmethod
+    def _hedge_order(prepared: List[Tuple[str, str, Any]]) -> List[Tuple[str, str, Any]]:
+        # Bản sao hedge bắt đầu từ target dự phòng (nếu có) thay vì dồn thêm tải vào target đang chậm
+        return prepared[1:] + prepared[:1]
+
+    def _attempts(self, n_targets: int) -> int:
+        # Mỗi target được thử ít nhất 1 lần dù max_retries nhỏ hơn số target
+        return max(self.cfg.max_retries + 1, n_targets)
+
+    @staticmethod
+    def _route_record(task: str, provider: str, model: str, t0: float, ok: bool) -> None:
+        get_llm_router().record(task, (provider, model), (time.perf_counter() - t0) * 1000.0, ok)
+
+    def _prepare_call(
+        self, provider: str, model: str, prompt: str, schema_model: Type[BaseModel], aio: bool = False,
+    ) -> Any:
+        if provider == "gemini" and not self.cfg.gemini_api_key:
+            raise RuntimeError("Missing GEMINI_API_KEY (or GOOGLE_API_KEY)")
+        if provider == "openai" and not self.cfg.openai_api_key:
+            raise RuntimeError("Missing OPENAI_API_KEY")
+
+        return self._get_structured(provider, model, schema_model, aio=aio)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(8.0, 0.5 * (2 ** attempt))
+
+    def _unpack(
+        self, provider: str, result: Any, schema_model: Type[BaseModel], record: LLMCallRecord,
+    ) -> Dict[str, Any]:
+        """
+        Tách output include_raw: ghi token usage vào record. Parse lỗi → sửa output thô tại chỗ
+        (shared/llm/salvage.py); vẫn không hợp lệ mới raise (để retry).
+        """
+        if isinstance(result, dict) and "raw" in result and "parsed" in result:
+            usage = getattr(result.get("raw"), "usage_metadata", None) or {}
+            if usage:
+                # Cộng dồn qua các lần retry (mỗi attempt đều tốn token)
+                record.prompt_tokens = (record.prompt_tokens or 0) + int(usage.get("input_tokens") or 0)
+                record.completion_tokens = (record.completion_tokens or 0) + int(usage.get("output_tokens") or 0)
+                record.total_tokens = (record.total_tokens or 0) + int(usage.get("total_tokens") or 0)
+            if result.get("parsing_error") is not None or result.get("parsed") is None:
+                salvaged = salvage_structured(result.get("raw"), schema_model)
+                if salvaged is None:
+                    if result.get("parsing_error") is not None:
+                        raise result["parsing_error"]
+                    raise ValueError("LLM structured output is empty")
+                record.salvaged = True
+                print(f"[LLM_SALVAGE] schema={schema_model.__name__} provider={provider} repaired without retry")
+                return self._result_to_dict(provider, salvaged)
+            result = result.get("parsed")
+        return self._result_to_dict(provider, result)
+
+    @staticmethod
+    def _result_to_dict(provider: str, result: Any) -> Dict[str, Any]:
+        # LangChain thường trả về Pydantic model
         if hasattr(result, "model_dump"):
+            # mode="json": Enum -> value string (contract validate theo string)
             return result.model_dump(mode="json")
+        # Fallback nếu trả dict
         return dict(result)
@@ -14,17 +14,25 @@ class LLMConfig:
     gemini_model: str = "gemini-1.5-flash"
     temperature: float = 0.2
     max_retries: int = 2
+    # Connection pool dùng chung cho các chat client (keep-alive, tránh TLS handshake mỗi call).
+    # max_connections là trần số call LLM đồng thời / client (/ event loop ở path async); vượt thì chờ pool
+    http_max_connections: int = 200
+    http_max_keepalive: int = 50
+    http_timeout: float = 120.0
 
     @staticmethod
     def from_env() -> "LLMConfig":
         return LLMConfig(
-            provider=(os.getenv("LLM_PROVIDER") or "gemini").lower(),
+            provider=(os.getenv("LLM_PROVIDER") or "gemini").lower(),  # gemini | openai | mock
             openai_api_key=os.getenv("OPENAI_API_KEY"),
             openai_model=os.getenv("OPENAI_MODEL") or "gpt-4o-mini",
             gemini_api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"),
             gemini_model=os.getenv("GEMINI_MODEL") or "gemini-1.5-flash",
             temperature=float(os.getenv("LLM_TEMPERATURE") or 0.2),
             max_retries=int(os.getenv("LLM_MAX_RETRIES") or 2),
+            http_max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS") or 200),
+            http_max_keepalive=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE") or 50),
+            http_timeout=float(os.getenv("LLM_HTTP_TIMEOUT") or 120.0),
         )
 
 
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Bucket (upper bound) cho histogram; giá trị vượt bucket cuối rơi vào +Inf
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+TOKEN_BUCKETS: Tuple[float, ...] = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+@dataclass
+class LLMCallRecord:
+    """1 lần gọi LLM (hoặc 1 lần trúng cache) kèm tag node/iteration của pipeline."""
+    node: str
+    iteration: int
+    schema: str
+    provider: str = ""
+    model: str = ""
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    latency_ms: float = 0.0
+    retries: int = 0
+    cache_hit: bool = False
+    salvaged: bool = False          # output lỗi được sửa tại chỗ (không retry)
+    ok: bool = True
+    error: Optional[str] = None
+
+
+@dataclass
+class _Scope:
+    node: str
+    iteration: int
+    calls: List[LLMCallRecord] = field(default_factory=list)
+
+
+_SCOPE: contextvars.ContextVar[Optional[_Scope]] = contextvars.ContextVar("llm_call_scope", default=None)
+
+
+@contextmanager
+def llm_call_scope(node: str, iteration: int = 0) -> Iterator[List[LLMCallRecord]]:
+    """
+    Tag mọi call LLM bên trong block theo node/iteration.
+    Yield list record để node ghi vào audit sau khi block kết thúc.
+    """
+    scope = _Scope(node=node, iteration=int(iteration))
+    token = _SCOPE.set(scope)
+    try:
+        yield scope.calls
+    finally:
+        _SCOPE.reset(token)
+
+
+def current_llm_scope() -> Optional[Tuple[str, int]]:
+    """(node, iteration) của llm_call_scope đang mở, None nếu gọi ngoài pipeline."""
+    scope = _SCOPE.get()
+    return (scope.node, scope.iteration) if scope is not None else None
+
+
+# -----------------------------
+# Histogram (process-local)
+# -----------------------------
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Ước lượng quantile = upper bound của bucket chứa quantile đó."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 2),
+            "buckets": dict(zip(labels, self.counts)),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+_HISTOGRAMS: Dict[Tuple[str, str], Histogram] = {}
+_COUNTERS: Dict[Tuple[str, str], int] = {}
+_LOCK = threading.Lock()
+
+
+def _observe(metric: str, node: str, value: Optional[float], buckets: Tuple[float, ...]) -> None:
+    if value is None:
+        return
+    key = (metric, node)
+    h = _HISTOGRAMS.get(key)
+    if h is None:
+        h = _HISTOGRAMS.setdefault(key, Histogram(buckets))
+    h.observe(float(value))
+
+
+def _incr(metric: str, node: str, n: int = 1) -> None:
+    _COUNTERS[(metric, node)] = _COUNTERS.get((metric, node), 0) + n
+
+
+def record_llm_call(record: LLMCallRecord) -> None:
+    with _LOCK:
+        _incr("calls", record.node)
+        if record.cache_hit:
+            _incr("cache_hits", record.node)
+        else:
+            _observe("latency_ms", record.node, record.latency_ms, LATENCY_BUCKETS_MS)
+            _observe("prompt_tokens", record.node, record.prompt_tokens, TOKEN_BUCKETS)
+            _observe("completion_tokens", record.node, record.completion_tokens, TOKEN_BUCKETS)
+        if record.retries:
+            _incr("retries", record.node, record.retries)
+        if record.salvaged:
+            _incr("salvaged", record.node)
+        if not record.ok:
+            _incr("errors", record.node)
+
+    scope = _SCOPE.get()
+    if scope is not None:
+        scope.calls.append(record)
+
+    print(
+        f"[LLM] node={record.node} iter={record.iteration} schema={record.schema} "
+        f"model={record.model or '-'} cache_hit={record.cache_hit} "
+        f"tokens={record.prompt_tokens}/{record.completion_tokens} "
+        f"latency_ms={record.latency_ms:.0f} retries={record.retries} ok={record.ok}"
+    )
+
+
+def new_call_record(schema: str, provider: str = "", model: str = "", cache_hit: bool = False) -> LLMCallRecord:
+    """Tạo record với node/iteration lấy từ scope hiện tại ("-" nếu gọi ngoài pipeline)."""
+    scope = _SCOPE.get()
+    return LLMCallRecord(
+        node=scope.node if scope else "-",
+        iteration=scope.iteration if scope else 0,
+        schema=schema,
+        provider=provider,
+        model=model,
+        cache_hit=cache_hit,
+    )
+
+
+def get_llm_metrics_snapshot() -> Dict[str, Any]:
+    with _LOCK:
+        out: Dict[str, Any] = {"histograms": {}, "counters": {}}
+        for (metric, node), h in sorted(_HISTOGRAMS.items()):
+            out["histograms"].setdefault(metric, {})[node] = h.snapshot()
+        for (metric, node), n in sorted(_COUNTERS.items()):
+            out["counters"].setdefault(metric, {})[node] = n
+        return out
+
+
+# -----------------------------
+# Audit helpers
+# -----------------------------
+def llm_calls_payload(calls: List[LLMCallRecord]) -> List[Dict[str, Any]]:
+    return [asdict(c) for c in calls]
+
+
+def summarize_llm_calls(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Gộp các audit event "llm_calls" của 1 request: tổng token/latency theo node."""
+    by_node: Dict[str, Dict[str, Any]] = {}
+    for ev in events or []:
+        if ev.get("name") != "llm_calls":
+            continue
+        for c in (ev.get("payload") or {}).get("calls") or []:
+            s = by_node.setdefault(c.get("node") or "-", {
+                "calls": 0,
+                "cache_hits": 0,
+                "errors": 0,
+                "retries": 0,
+                "salvaged": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "latency_ms": 0.0,
+            })
+            s["calls"] += 1
+            s["cache_hits"] += int(bool(c.get("cache_hit")))
+            s["errors"] += int(not c.get("ok", True))
+            s["retries"] += int(c.get("retries") or 0)
+            s["salvaged"] += int(bool(c.get("salvaged")))
+            s["prompt_tokens"] += int(c.get("prompt_tokens") or 0)
+            s["completion_tokens"] += int(c.get("completion_tokens") or 0)
+            s["latency_ms"] += float(c.get("latency_ms") or 0.0)
+
+    keys = ("calls", "cache_hits", "errors", "retries", "salvaged", "prompt_tokens", "completion_tokens", "latency_ms")
+    total = {k: sum(s[k] for s in by_node.values()) for k in keys}
+    return {"by_node": by_node, "total": total}
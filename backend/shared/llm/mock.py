@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type
+
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel
+
+# LLM_PROVIDER=mock: sinh output đúng schema, deterministic theo prompt, không cần network.
+# Dùng cho CI / load test / profile pipeline end-to-end trên 1 máy.
+MOCK_LLM_MODEL = "mock-v1"
+# Phân phối latency giả lập: const:<ms> | uniform:<min_ms>:<max_ms> | lognormal:<median_ms>:<sigma>
+MOCK_LLM_LATENCY = os.getenv("MOCK_LLM_LATENCY") or "const:0"
+MOCK_LLM_ERROR_RATE = float(os.getenv("MOCK_LLM_ERROR_RATE") or 0.0)
+# Tỉ lệ output sai format (chữ giải thích sau JSON) → parsing_error như provider thật
+MOCK_LLM_MALFORMED_RATE = float(os.getenv("MOCK_LLM_MALFORMED_RATE") or 0.0)
+
+# Generator theo tên schema: (prompt, rng) -> dict đúng schema. Domain tự đăng ký generator của mình.
+MockGenerator = Callable[[str, random.Random], Dict[str, Any]]
+_GENERATORS: Dict[str, MockGenerator] = {}
+
+_LATENCY_RNG = random.Random()
+
+
+def register_mock_generator(schema_name: str, fn: MockGenerator) -> None:
+    _GENERATORS[schema_name] = fn
+
+
+def prompt_rng(prompt: str) -> random.Random:
+    """RNG seed theo hash prompt: cùng prompt -> cùng output."""
+    seed = int.from_bytes(hashlib.sha256((prompt or "").encode("utf-8")).digest()[:8], "little")
+    return random.Random(seed)
+
+
+def sample_latency_ms(spec: str = MOCK_LLM_LATENCY) -> float:
+    kind, _, rest = (spec or "const:0").partition(":")
+    args = [float(x) for x in rest.split(":") if x]
+    kind = kind.strip().lower()
+    if kind == "uniform" and len(args) >= 2:
+        return _LATENCY_RNG.uniform(args[0], args[1])
+    if kind == "lognormal" and args:
+        sigma = args[1] if len(args) > 1 else 0.5
+        return args[0] * _LATENCY_RNG.lognormvariate(0.0, sigma)
+    return args[0] if args else 0.0
+
+
+def _maybe_fail() -> None:
+    if MOCK_LLM_ERROR_RATE > 0 and _LATENCY_RNG.random() < MOCK_LLM_ERROR_RATE:
+        raise RuntimeError("mock LLM injected error")
+
+
+# -----------------------------
+# Fallback: sinh giá trị từ JSON schema (cho schema chưa có generator riêng)
+# -----------------------------
+def _from_json_schema(node: Dict[str, Any], defs: Dict[str, Any], rng: random.Random) -> Any:
+    if "$ref" in node:
+        return _from_json_schema(defs[node["$ref"].split("/")[-1]], defs, rng)
+    if "enum" in node:
+        return rng.choice(node["enum"])
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in node:
+            options = [o for o in node[key] if o.get("type") != "null"] or node[key]
+            return _from_json_schema(options[0], defs, rng)
+
+    t = node.get("type")
+    if t == "object":
+        return {k: _from_json_schema(v, defs, rng) for k, v in (node.get("properties") or {}).items()}
+    if t == "array":
+        n = max(int(node.get("minItems", 1)), 1)
+        return [_from_json_schema(node.get("items") or {}, defs, rng) for _ in range(n)]
+    if t == "integer":
+        return int(node.get("minimum", node.get("exclusiveMinimum", 0)))
+    if t == "number":
+        return float(node.get("minimum", 0.0))
+    if t == "boolean":
+        return False
+    return "mock"
+
+
+def generate_mock_output(prompt: str, schema_name: str, json_schema: Dict[str, Any]) -> Dict[str, Any]:
+    rng = prompt_rng(prompt)
+    fn = _GENERATORS.get(schema_name)
+    if fn is not None:
+        return fn(prompt, rng)
+    return _from_json_schema(json_schema, json_schema.get("$defs") or {}, rng)
+
+
+# -----------------------------
+# Chat model giả lập (chỉ phần with_structured_output mà LLMClient dùng)
+# -----------------------------
+class MockStructuredRunnable:
+    def __init__(self, schema: Any, include_raw: bool) -> None:
+        if isinstance(schema, dict):
+            self.schema_model: Optional[Type[BaseModel]] = None
+            self.json_schema = schema
+            self.schema_name = str(schema.get("title") or "")
+        else:
+            self.schema_model = schema
+            self.json_schema = schema.model_json_schema()
+            self.schema_name = schema.__name__
+        self.include_raw = include_raw
+
+    def _output(self, prompt: str) -> Any:
+        _maybe_fail()
+        data = generate_mock_output(prompt, self.schema_name, self.json_schema)
+        parsed: Any = self.schema_model.model_validate(data) if self.schema_model is not None else data
+        if not self.include_raw:
+            return parsed
+
+        content = json.dumps(data, ensure_ascii=False)
+        error: Optional[Exception] = None
+        if MOCK_LLM_MALFORMED_RATE > 0 and _LATENCY_RNG.random() < MOCK_LLM_MALFORMED_RATE:
+            content += "\nHy vọng kết quả trên phù hợp với bạn!"
+            parsed = None
+            try:
+                json.loads(content)
+            except ValueError as e:
+                error = e
+
+        n_in = len(prompt or "") // 4
+        n_out = len(content) // 4
+        raw = AIMessage(
+            content=content,
+            usage_metadata={"input_tokens": n_in, "output_tokens": n_out, "total_tokens": n_in + n_out},
+        )
+        return {"raw": raw, "parsed": parsed, "parsing_error": error}
+
+    def invoke(self, prompt: str, *args: Any, **kwargs: Any) -> Any:
+        time.sleep(sample_latency_ms() / 1000.0)
+        return self._output(prompt)
+
+    async def ainvoke(self, prompt: str, *args: Any, **kwargs: Any) -> Any:
+        await asyncio.sleep(sample_latency_ms() / 1000.0)
+        return self._output(prompt)
+
+    def stream(self, prompt: str, *args: Any, **kwargs: Any) -> Iterator[Any]:
+        """Yield partial dict theo từng phần tử của field list đầu tiên (vd days), latency chia đều."""
+        total_s = sample_latency_ms() / 1000.0
+        _maybe_fail()
+        data = generate_mock_output(prompt, self.schema_name, self.json_schema)
+        list_key = next((k for k, v in data.items() if isinstance(v, list)), None)
+        items: List[Any] = (data.get(list_key) or []) if list_key else []
+        steps = max(len(items), 1)
+        for i in range(1, len(items) + 1):
+            time.sleep(total_s / steps)
+            yield {**data, list_key: items[:i]}
+        if not items:
+            time.sleep(total_s)
+            yield data
+
+
+class MockChatModel:
+    def with_structured_output(self, schema: Any, method: Optional[str] = None, include_raw: bool = False, **kwargs: Any):
+        return MockStructuredRunnable(schema, include_raw=include_raw)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from backend.shared.llm.metrics import current_llm_scope
+
+# Route theo task, mỗi task 1 list target provider:model theo thứ tự ưu tiên, ví dụ:
+#   intent=gemini:gemini-1.5-flash,openai:gpt-4o-mini;plan=openai:gpt-4o,gemini:gemini-1.5-pro
+# Model bỏ trống → model mặc định của provider trong LLMConfig. Task "default" dùng cho task không khai báo.
+# Rỗng → 1 target theo LLM_PROVIDER như cũ.
+LLM_ROUTES = os.getenv("LLM_ROUTES") or ""
+# Số call gần nhất/target để tính latency (median) và error rate
+LLM_ROUTE_WINDOW = max(1, int(os.getenv("LLM_ROUTE_WINDOW") or 50))
+# Circuit breaker: lỗi liên tiếp (hoặc error rate của window) vượt ngưỡng → bỏ target trong cooldown
+LLM_ROUTE_FAILURE_THRESHOLD = max(1, int(os.getenv("LLM_ROUTE_FAILURE_THRESHOLD") or 3))
+LLM_ROUTE_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTE_MAX_ERROR_RATE") or 0.5)
+LLM_ROUTE_COOLDOWN_S = float(os.getenv("LLM_ROUTE_COOLDOWN_S") or 30)
+_MIN_SAMPLES_FOR_ERROR_RATE = 4
+
+Target = Tuple[str, str]  # (provider, model)
+
+
+def parse_routes(spec: str) -> Dict[str, List[Target]]:
+    routes: Dict[str, List[Target]] = {}
+    for part in (spec or "").split(";"):
+        task, _, targets = part.partition("=")
+        task = task.strip().lower()
+        out: List[Target] = []
+        for item in targets.split(","):
+            provider, _, model = item.strip().partition(":")
+            if provider.strip():
+                out.append((provider.strip().lower(), model.strip()))
+        if task and out:
+            routes[task] = out
+    return routes
+
+
+def current_task() -> str:
+    """Task của call hiện tại theo llm_call_scope: intent | plan | repair (plan ở vòng sửa) | default."""
+    scope = current_llm_scope()
+    if scope is None:
+        return "default"
+    node, iteration = scope
+    if node == "plan" and iteration > 0:
+        return "repair"
+    return node
+
+
+class _TargetStats:
+    def __init__(self) -> None:
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=LLM_ROUTE_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record(self, latency_ms: float, ok: bool, now: float) -> None:
+        self.samples.append((latency_ms, ok))
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        rate = self.error_rate()
+        if self.consecutive_failures >= LLM_ROUTE_FAILURE_THRESHOLD or (
+            rate is not None and len(self.samples) >= _MIN_SAMPLES_FOR_ERROR_RATE and rate > LLM_ROUTE_MAX_ERROR_RATE
+        ):
+            self.open_until = now + LLM_ROUTE_COOLDOWN_S
+
+    def error_rate(self) -> Optional[float]:
+        if not self.samples:
+            return None
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency_ms(self) -> Optional[float]:
+        ok = [ms for ms, good in self.samples if good]
+        return statistics.median(ok) if ok else None
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.open_until
+
+
+class LLMRouter:
+    """
+    Chọn thứ tự target cho mỗi call theo task:
+      - target healthy trước, xếp theo median latency của window; target chưa có sample nào
+        giữ thứ tự cấu hình và được thử trước (lấy số liệu), target chỉ có lỗi xếp sau
+      - target đang cooldown (circuit open) xếp cuối, chỉ dùng khi mọi target khác đều lỗi
+    Stats theo (task, provider, model) vì latency intent và plan khác nhau nhiều.
+    """
+
+    def __init__(self, routes: Dict[str, List[Target]]) -> None:
+        self.routes = routes
+        self._stats: Dict[Tuple[str, str, str], _TargetStats] = {}
+        self._lock = threading.Lock()
+
+    def configured(self, task: str) -> List[Target]:
+        return list(self.routes.get(task) or self.routes.get("default") or [])
+
+    def order(self, task: str, targets: List[Target]) -> List[Target]:
+        now = time.monotonic()
+        healthy: List[Tuple[Tuple[int, float], Target]] = []
+        cooling: List[Tuple[float, Target]] = []
+        with self._lock:
+            for i, target in enumerate(targets):
+                st = self._stats.get((task, *target))
+                if st is not None and not st.healthy(now):
+                    cooling.append((st.open_until, target))
+                    continue
+                if st is not None and st.open_until:
+                    # hết cooldown (half-open): xoá window để target được thử lại trước; lỗi tiếp → open lại ngay
+                    st.samples.clear()
+                    st.open_until = 0.0
+                if st is None or not st.samples:
+                    key = (0, float(i))         # chưa có số liệu: thử trước
+                elif st.latency_ms() is not None:
+                    key = (1, st.latency_ms())
+                else:
+                    key = (2, float(i))         # toàn lỗi nhưng chưa tới ngưỡng circuit
+                healthy.append((key, target))
+        healthy.sort(key=lambda x: x[0])
+        cooling.sort(key=lambda x: x[0])
+        return [t for _, t in healthy] + [t for _, t in cooling]
+
+    def record(self, task: str, target: Target, latency_ms: float, ok: bool) -> None:
+        with self._lock:
+            st = self._stats.get((task, *target))
+            if st is None:
+                st = self._stats.setdefault((task, *target), _TargetStats())
+            st.record(latency_ms, ok, time.monotonic())
+        if not ok and not st.healthy(time.monotonic()):
+            print(f"[LLM_ROUTE] task={task} target={target[0]}:{target[1]} open for {LLM_ROUTE_COOLDOWN_S:.0f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        out: Dict[str, Any] = {}
+        with self._lock:
+            for (task, provider, model), st in sorted(self._stats.items()):
+                out.setdefault(task, {})[f"{provider}:{model}"] = {
+                    "samples": len(st.samples),
+                    "latency_p50_ms": st.latency_ms(),
+                    "error_rate": st.error_rate(),
+                    "consecutive_failures": st.consecutive_failures,
+                    "healthy": st.healthy(now),
+                }
+        return out
+
+
+_ROUTER: Optional[LLMRouter] = None
+_ROUTER_LOCK = threading.Lock()
+
+
+def get_llm_router() -> LLMRouter:
+    """Router dùng chung trong process (stats chung cho mọi LLMClient, kể cả client variant temperature)."""
+    global _ROUTER
+    if _ROUTER is None:
+        with _ROUTER_LOCK:
+            if _ROUTER is None:
+                _ROUTER = LLMRouter(parse_routes(LLM_ROUTES))
+    return _ROUTER
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import types
+import typing
+from enum import Enum
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+# Output structured không parse/validate được: thử sửa trong process trước khi retry (tốn thêm 1 round trip)
+# local = bật (mặc định) | off = parse lỗi là retry như cũ
+LLM_SALVAGE = (os.getenv("LLM_SALVAGE") or "local").lower()
+
+# Enum -> {alias (lowercase): value}; domain tự đăng ký alias của mình (vd workout: glutes -> hips)
+_ENUM_ALIASES: Dict[Type[Enum], Dict[str, str]] = {}
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_SEPARATOR_RE = re.compile(r"[\s\-]+")
+
+
+def register_enum_aliases(enum_cls: Type[Enum], aliases: Dict[str, str]) -> None:
+    _ENUM_ALIASES.setdefault(enum_cls, {}).update({k.strip().lower(): v for k, v in aliases.items()})
+
+
+def raw_output(raw: Any) -> Any:
+    """Nội dung thô của message provider trả về: args của tool call (dict) hoặc text content."""
+    tool_calls = getattr(raw, "tool_calls", None) or []
+    if tool_calls:
+        return tool_calls[0].get("args")
+    content = getattr(raw, "content", raw)
+    if isinstance(content, list):
+        # Một số provider trả content dạng list part
+        content = "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return content
+
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """JSON object đầu tiên trong text: bỏ code fence, chữ giải thích trước/sau JSON."""
+    if not isinstance(text, str):
+        return None
+    fenced = _FENCE_RE.search(text)
+    decoder = json.JSONDecoder()
+    for chunk in ([fenced.group(1)] if fenced else []) + [text]:
+        start = chunk.find("{")
+        while start != -1:
+            try:
+                obj, _ = decoder.raw_decode(chunk, start)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
+                return obj
+            start = chunk.find("{", start + 1)
+    return None
+
+
+def _fold_enum(value: str, enum_cls: Type[Enum]) -> str:
+    key = _SEPARATOR_RE.sub("_", value.strip().lower())
+    key = _ENUM_ALIASES.get(enum_cls, {}).get(key, key)
+    for member in enum_cls:
+        if str(member.value).lower() == key:
+            return member.value
+    return value
+
+
+def _coerce(value: Any, annotation: Any) -> Any:
+    """Đi theo annotation của schema: bỏ field lạ, fold enum (hoa/thường, alias), giữ nguyên phần còn lại."""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union or origin is types.UnionType:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        return _coerce(value, args[0]) if len(args) == 1 else value
+    if origin in (list, tuple, set) and isinstance(value, list):
+        args = typing.get_args(annotation)
+        return [_coerce(v, args[0]) for v in value] if args else value
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel) and isinstance(value, dict):
+        return {
+            name: _coerce(value[name], field.annotation)
+            for name, field in annotation.model_fields.items()
+            if name in value
+        }
+    if isinstance(annotation, type) and issubclass(annotation, Enum) and isinstance(value, str):
+        return _fold_enum(value, annotation)
+    return value
+
+
+def salvage_structured(raw: Any, schema_model: Type[BaseModel]) -> Optional[BaseModel]:
+    """
+    Sửa output lỗi nhẹ (chữ thừa quanh JSON, enum sai hoa/thường, alias, field lạ) rồi validate lại.
+    Return instance schema_model, hoặc None nếu vẫn không hợp lệ (caller retry như cũ).
+    """
+    if LLM_SALVAGE != "local":
+        return None
+    data = raw_output(raw)
+    if isinstance(data, str):
+        data = extract_json(data)
+    if not isinstance(data, dict):
+        return None
+    try:
+        return schema_model.model_validate(_coerce(data, schema_model))
+    except ValidationError:
+        return None
@@ -1,3 +1,1090 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from pydantic import ValidationError
+
+from django.test import SimpleTestCase
+
+from backend.domains.workout.contract import validate_intent_internal_goal
+from backend.domains.workout.schemas import CompactDayPlan, CompactWorkoutPlan, IntentInternalGoal, WorkoutPlan
+from backend.domains.workout.services.evaluation import evaluate_plan
+from backend.domains.workout.services.formatting import expand_compact_plan
+from backend.domains.workout.services.intent_rules import check_split_constraints, match_intent_rules
+from backend.domains.workout.services.planning import (
+    INTENT_STATIC_PREFIX,
+    PLAN_STATIC_PREFIX,
+    _build_intent_prompt,
+    _build_prompt,
+    split_candidates_by_day,
+)
+from backend.domains.workout.services import planning, retrieval
+from backend.domains.workout.services.repair import repair_plan
+from backend.domains.workout.services import speculative
+from backend.domains.workout.services import intent_cache
+from backend.models import QueryEmbedding
+from backend.services import embedding_service, query_vectors, retriever, vector_quantization
+from backend.shared import hedging
+from backend.shared.llm import LLMClient, LLMConfig, metrics, mock as mock_llm
+from backend.shared.llm.cache import NullLLMCache, SQLiteLLMCache
+from backend.shared.llm.metrics import llm_call_scope
+from backend.shared.llm.salvage import salvage_structured
+from backend.shared.llm.routing import LLMRouter, parse_routes
+from backend.domains.workout.services.template_plan import generate_template_plan
+from backend.domains.workout import nodes
+from backend.domains.workout.graph import stream_workout_planning_pipeline
+from backend import views
+
+
+def _shared_prefix_len(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+class EmbeddingProviderTests(SimpleTestCase):
+    """Registry embedding provider + provider local (offline, deterministic)."""
+
+    def test_local_embed_is_deterministic_unit_norm_and_honours_dim(self):
+        texts = ["bench press ngực", "squat chân"]
+        a = embedding_service._local_embed(texts, embedding_service.LOCAL_EMBED_MODEL, 64, 1)
+        b = embedding_service._local_embed(texts, embedding_service.LOCAL_EMBED_MODEL, 64, 1)
+
+        self.assertEqual(a, b)
+        self.assertEqual([len(v) for v in a], [64, 64])
+        for v in a:
+            self.assertAlmostEqual(float(np.linalg.norm(v)), 1.0, places=5)
+        self.assertNotEqual(a[0], a[1])
+
+    def test_unknown_provider_is_rejected(self):
+        with self.assertRaises(ValueError):
+            embedding_service.get_embedding_provider("no-such-provider")
+
+    def test_model_name_is_per_provider(self):
+        self.assertEqual(embedding_service.get_embedding_model_name("local"), embedding_service.LOCAL_EMBED_MODEL)
+        self.assertEqual(embedding_service.get_embedding_model_name("openai"), embedding_service.DEFAULT_EMBED_MODEL)
+        self.assertIs(embedding_service.get_embedding_provider(" LOCAL "), embedding_service._local_embed)
+
+
+def _mocked_semantic_search(first_stage, qvec=(0.6, -0.8)):
+    """Chạy _semantic_search trên queryset mock: shortlist trả id [3, 1, 2], rescore trả 2 bài."""
+    index = mock.Mock(compact=True, column="embedding")
+    qs = mock.MagicMock()
+    qs.exclude.return_value.annotate.return_value.order_by.return_value.values_list.return_value = [3, 1, 2]
+    with mock.patch.object(retriever, "Exercise") as exercise:
+        rescored = exercise.objects.filter.return_value.annotate.return_value.order_by.return_value
+        rescored.__getitem__.return_value = ["ex-1", "ex-3"]
+        out = retriever._semantic_search(qs, list(qvec), 2, index, first_stage=first_stage)
+    return out, qs, exercise
+
+
+class VectorQuantizationTests(SimpleTestCase):
+    """halfvec/binary first-stage: lượng tử hóa khớp pgvector, rescore bằng cột full."""
+
+    def test_binary_is_sign_bit_string(self):
+        self.assertEqual(vector_quantization.to_binary([0.5, -0.1, 0.0, 2.0, -3.0]), "10010")
+
+    def test_halfvec_rounds_to_float16(self):
+        vec = [0.1, -1.0 / 3.0, 65504.0]
+        half = vector_quantization.to_halfvec(vec)
+
+        self.assertEqual(half, np.asarray(vec, dtype=np.float16).astype(np.float32).tolist())
+        self.assertEqual(half[2], 65504.0)
+        self.assertNotEqual(half[0], np.float32(0.1))
+
+    def test_rescore_orders_by_full_precision_column(self):
+        for first_stage, column in (("halfvec", "embedding_half"), ("binary", "embedding_bin")):
+            with self.subTest(first_stage=first_stage):
+                out, qs, exercise = _mocked_semantic_search(first_stage)
+
+                qs.exclude.assert_called_once_with(**{f"{column}__isnull": True})
+                stage1 = qs.exclude.return_value.annotate.call_args.kwargs["stage1"]
+                self.assertEqual(stage1.source_expressions[0].name, column)
+
+                exercise.objects.filter.assert_called_once_with(id__in=[3, 1, 2])
+                filtered = exercise.objects.filter.return_value
+                distance = filtered.annotate.call_args.kwargs["distance"]
+                self.assertEqual(distance.source_expressions[0].name, "embedding")
+                filtered.annotate.return_value.order_by.assert_called_once_with("distance")
+                self.assertEqual(out, ["ex-1", "ex-3"])
+
+
+class MatryoshkaTests(SimpleTestCase):
+    """Matryoshka first-stage: truncate + renormalize vector full, shortlist trên embedding_short."""
+
+    def test_truncate_normalize_length_and_norm(self):
+        vec = [3.0, 4.0, 12.0, -5.0]
+        short = vector_quantization.truncate_normalize(vec, 2)
+
+        self.assertEqual(len(short), 2)
+        self.assertAlmostEqual(float(np.linalg.norm(short)), 1.0, places=6)
+        np.testing.assert_allclose(short, [0.6, 0.8], rtol=1e-6)
+        self.assertEqual(vector_quantization.truncate_normalize([0.0, 0.0, 1.0], 2), [0.0, 0.0])
+
+    def test_matryoshka_shortlists_on_short_column(self):
+        qvec = list(np.linspace(-1.0, 1.0, retriever.SHORT_EMBED_DIM * 2))
+        out, qs, exercise = _mocked_semantic_search("matryoshka", qvec)
+
+        qs.exclude.assert_called_once_with(embedding_short__isnull=True)
+        stage1 = qs.exclude.return_value.annotate.call_args.kwargs["stage1"]
+        self.assertEqual(stage1.source_expressions[0].name, "embedding_short")
+        short = json.loads(stage1.source_expressions[1].value)
+        self.assertEqual(len(short), retriever.SHORT_EMBED_DIM)
+        np.testing.assert_allclose(short, vector_quantization.truncate_normalize(qvec, retriever.SHORT_EMBED_DIM), rtol=1e-5)
+        distance = exercise.objects.filter.return_value.annotate.call_args.kwargs["distance"]
+        self.assertEqual(distance.source_expressions[0].name, "embedding")
+
+    def test_non_compact_index_ignores_first_stage(self):
+        index = mock.Mock(compact=False, column="embedding_shadow")
+        qs = mock.MagicMock()
+        with mock.patch.object(retriever, "Exercise") as exercise:
+            retriever._semantic_search(qs, [0.6, -0.8], 2, index, first_stage="matryoshka")
+
+        qs.exclude.assert_not_called()
+        exercise.objects.filter.assert_not_called()
+        self.assertEqual(qs.annotate.call_args.kwargs["distance"].source_expressions[0].name, "embedding_shadow")
+
+
+class PrecomputedQueryVectorTests(SimpleTestCase):
+    """Bảng QueryEmbedding in-memory: load lỗi thì thử lại sau retry-after, reload định kỳ."""
+
+    def setUp(self):
+        for name, value in (("_VECTORS", None), ("_LOADED_AT", 0.0), ("_RETRY_AT", 0.0)):
+            patcher = mock.patch.object(query_vectors, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.now = 1000.0
+        patcher = mock.patch.object(query_vectors.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_load_retries_after_delay(self):
+        with mock.patch.object(QueryEmbedding, "objects") as objects:
+            objects.values_list.side_effect = RuntimeError("no table")
+            self.assertIsNone(query_vectors.get_precomputed_query_vector("squat", "m@2"))
+            self.assertIsNone(query_vectors.get_precomputed_query_vector("squat", "m@2"))
+            self.assertEqual(objects.values_list.call_count, 1)
+
+            self.now += query_vectors.QUERY_VECTORS_RETRY_SECONDS
+            objects.values_list.side_effect = None
+            objects.values_list.return_value = [("squat", "m@2", [0.6, 0.8])]
+            self.assertEqual(query_vectors.get_precomputed_query_vector("squat", "m@2"), [0.6, 0.8])
+            self.assertEqual(objects.values_list.call_count, 2)
+
+    def test_periodic_reload_picks_up_new_vectors(self):
+        with mock.patch.object(QueryEmbedding, "objects") as objects, \
+                mock.patch.object(query_vectors, "QUERY_VECTORS_RELOAD_SECONDS", 60.0):
+            objects.values_list.return_value = []
+            self.assertIsNone(query_vectors.get_precomputed_query_vector("squat", "m@2"))
+
+            objects.values_list.return_value = [("squat", "m@2", [1.0, 0.0])]
+            self.now += 30
+            self.assertIsNone(query_vectors.get_precomputed_query_vector("squat", "m@2"))
+            self.now += 30
+            self.assertEqual(query_vectors.get_precomputed_query_vector("squat", "m@2"), [1.0, 0.0])
+
+            # Reload lỗi -> giữ vector cũ
+            objects.values_list.side_effect = RuntimeError("db down")
+            self.now += 60
+            self.assertEqual(query_vectors.get_precomputed_query_vector("squat", "m@2"), [1.0, 0.0])
+
+
+class PromptPrefixTests(SimpleTestCase):
+    """Prompt phải bắt đầu bằng static prefix giống hệt nhau để provider cache được prefix."""
+
+    profile_a = {
+        "goal_text": "tăng cơ ngực",
+        "days_per_week": 3,
+        "session_minutes": 45,
+        "experience": "beginner",
+        "training_days": ["mon", "wed", "fri"],
+    }
+    profile_b = {
+        "goal_text": "giảm mỡ bụng",
+        "days_per_week": 5,
+        "session_minutes": 90,
+        "experience": "advanced",
+        "weight_kg": None,
+    }
+
+    def test_intent_prompts_share_static_prefix(self):
+        a = _build_intent_prompt(self.profile_a)
+        b = _build_intent_prompt(self.profile_b)
+
+        self.assertTrue(a.startswith(INTENT_STATIC_PREFIX))
+        self.assertEqual(_shared_prefix_len(a, b), len(INTENT_STATIC_PREFIX) + len("days_per_week: "))
+
+    def test_plan_prompts_share_static_prefix(self):
+        candidates = [
+            {"id": i, "title": f"Exercise {i}", "muscle_groups": ["chest", "triceps"]}
+            for i in range(1, 31)
+        ]
+        a = _build_prompt(self.profile_a, {"max_exercises_per_day": 6}, candidates)
+        b = _build_prompt(self.profile_b, {"max_exercises_per_day": 4}, candidates[::-1])
+
+        self.assertTrue(a.startswith(PLAN_STATIC_PREFIX))
+        self.assertTrue(b.startswith(PLAN_STATIC_PREFIX))
+        self.assertGreaterEqual(_shared_prefix_len(a, b), len(PLAN_STATIC_PREFIX))
+
+
+class LLMResponseCacheTests(SimpleTestCase):
+    """L2 cache (SQLite) dùng chung giữa worker: TTL, giới hạn số entry, không lưu output lỗi."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = SQLiteLLMCache(path=os.path.join(tmp.name, "llm_cache.sqlite3"), max_entries=3)
+
+    def test_expired_entry_is_a_miss(self):
+        self.cache.set("fresh", {"v": 1}, ttl_seconds=60)
+        self.cache.set("stale", {"v": 2}, ttl_seconds=-1)
+
+        self.assertEqual(self.cache.get("fresh"), {"v": 1})
+        self.assertIsNone(self.cache.get("stale"))
+
+    def test_trim_keeps_max_entries_latest_expiring(self):
+        for i in range(5):
+            self.cache.set(f"k{i}", i, ttl_seconds=60 + i)
+        self.cache.trim()
+
+        self.assertEqual([self.cache.get(f"k{i}") for i in range(5)], [None, None, 2, 3, 4])
+
+    def test_store_llm_output_skips_error_outputs_in_l2(self):
+        with mock.patch.object(planning, "get_llm_cache", return_value=self.cache):
+            planning._store_llm_output("test_l2", "ok-key", {"goal": "fat_loss"}, 60)
+            planning._store_llm_output("test_l2", "err-key", {"error_type": "intent_generation_failed"}, 60)
+
+        self.assertEqual(self.cache.get("ok-key"), {"goal": "fat_loss"})
+        self.assertIsNone(self.cache.get("err-key"))
+
+
+class CompactPlanTests(SimpleTestCase):
+    """Plan dạng compact (PLAN_OUTPUT_FORMAT=compact) phải expand ra đúng WorkoutPlan."""
+
+    profile = {"goal_text": "tăng cơ ngực", "days_per_week": 2, "session_minutes": 60}
+
+    def test_compact_round_trips_to_workout_plan(self):
+        compact = CompactWorkoutPlan.model_validate({
+            "split": "upper_lower",
+            "days": [
+                {"day": "mon", "ex": ["12|4|8-10|90|nặng dần", "7|3|12|60"]},
+                {"day": "thu", "ex": ["3|3|10|75"]},
+            ],
+        }).model_dump(mode="json")
+
+        plan = expand_compact_plan(compact, self.profile)
+
+        self.assertEqual(plan["goal"], "tăng cơ ngực")
+        self.assertEqual((plan["days_per_week"], plan["session_minutes"], plan["split"]), (2, 60, "upper_lower"))
+        self.assertEqual(plan["days"][0]["exercises"][0], {
+            "exercise_id": 12, "sets": 4, "reps": "8-10", "rest_sec": 90, "notes": "nặng dần",
+        })
+        self.assertEqual(plan["days"][0]["exercises"][1]["notes"], "")
+        self.assertEqual([d["day"] for d in plan["days"]], ["mon", "thu"])
+        self.assertEqual(plan["days"][1]["exercises"][0]["exercise_id"], 3)
+
+    def test_malformed_rows_fail_validation(self):
+        for row in ("abc|3|10|60", "12|3|10"):
+            with self.subTest(row=row), self.assertRaises(ValidationError):
+                CompactDayPlan.model_validate({"day": "mon", "ex": [row]})
+
+
+class MockProviderTests(SimpleTestCase):
+    """LLM_PROVIDER=mock: cùng prompt thật → cùng output, hợp lệ theo schema, chỉ dùng id có trong prompt."""
+
+    profile = PromptPrefixTests.profile_a
+
+    def _generate(self, prompt, schema_model):
+        outs = [
+            mock_llm.generate_mock_output(prompt, schema_model.__name__, schema_model.model_json_schema())
+            for _ in range(2)
+        ]
+        self.assertEqual(outs[0], outs[1])
+        return schema_model.model_validate(outs[0]).model_dump(mode="json")
+
+    def test_intent_is_deterministic_and_valid(self):
+        out = self._generate(_build_intent_prompt(self.profile), IntentInternalGoal)
+
+        self.assertEqual(out["training_days"], self.profile["training_days"])
+        self.assertEqual(validate_intent_internal_goal(out, days_per_week=3), [])
+
+    def test_plan_uses_only_prompt_candidates(self):
+        candidates = [
+            {"id": 100 + i, "title": f"Exercise {i}", "muscle_groups": ["chest", "triceps"]}
+            for i in range(40)
+        ]
+        prompt = _build_prompt(self.profile, {"max_exercises_per_day": 6}, candidates)
+        in_prompt = {c["id"] for c in candidates if f"\n{c['id']}|" in prompt}
+
+        out = self._generate(prompt, WorkoutPlan)
+
+        used = {ex["exercise_id"] for day in out["days"] for ex in day["exercises"]}
+        self.assertTrue(used)
+        self.assertLessEqual(used, in_prompt)
+        self.assertEqual([d["day"] for d in out["days"]], self.profile["training_days"])
+
+
+class PlanStreamTests(SimpleTestCase):
+    """SSE pipeline (LLM_PROVIDER=mock): node → day (từng ngày khi LLM sinh xong) → result, đúng framing SSE."""
+
+    raw_input = {
+        "goal_text": "tập toàn thân đều các nhóm cơ",
+        "days_per_week": 3,
+        "session_minutes": 45,
+        "experience": "beginner",
+        "training_days": ["mon", "wed", "fri"],
+    }
+
+    def setUp(self):
+        muscles = TemplatePlanTests.muscles
+        candidates = [
+            {"id": i, "title": f"Exercise {i}", "muscle_groups": [muscles[i % 10]], "score": 1.0} for i in range(1, 41)
+        ]
+        for patcher in (
+            mock.patch.object(nodes, "_LLM", LLMClient(LLMConfig(provider="mock"))),
+            mock.patch.object(nodes, "_should_prefetch", return_value=False),
+            mock.patch.object(nodes, "build_candidate_pack", return_value=candidates),
+            mock.patch.object(planning, "get_llm_cache", return_value=NullLLMCache()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stream_yields_nodes_days_then_result(self):
+        events = list(stream_workout_planning_pipeline(self.raw_input))
+        order = [ev["node"] if ev["type"] == "node" else ev["type"] for ev in events]
+
+        # prefetch/intent cùng superstep nên thứ tự giữa 2 node không cố định
+        self.assertEqual(order[:2], ["profile", "constraints"])
+        self.assertEqual(sorted(order[2:4]), ["intent", "prefetch"])
+        self.assertEqual(order[4:], ["retrieval", "day", "day", "day", "plan", "evaluate", "enrich", "result"])
+        self.assertEqual(events[0]["event"]["name"], "profile_done")
+
+        days = [ev for ev in events if ev["type"] == "day"]
+        final_plan = events[-1]["result"].final_plan
+        self.assertEqual([ev["index"] for ev in days], [0, 1, 2])
+        self.assertEqual([ev["day"] for ev in days], final_plan["days"])
+
+    def test_view_frames_events_as_sse(self):
+        from rest_framework.test import APIRequestFactory
+
+        request = APIRequestFactory().post("/plan/generate-agent/stream/", self.raw_input, format="json")
+        response = views.WorkoutPlanGenerateAgentStreamView.as_view()(request)
+        body = b"".join(response.streaming_content).decode("utf-8")
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(body.endswith("\n\n"))
+        frames = [frame.split("\n") for frame in body[:-2].split("\n\n")]
+        self.assertTrue(all(len(f) == 2 and f[0].startswith("event: ") and f[1].startswith("data: ") for f in frames))
+
+        names = [f[0][len("event: "):] for f in frames]
+        payloads = [json.loads(f[1][len("data: "):]) for f in frames]
+        self.assertEqual(names.count("day"), 3)
+        self.assertEqual(names[-1], "result")
+        self.assertNotIn("error", names)
+        self.assertEqual(set(payloads[-1]), {"request_id", "plan", "warnings", "issues", "audit"})
+        self.assertEqual(payloads[0]["node"], "profile")
+
+
+class IntentRulesTests(SimpleTestCase):
+    """Fast path intent phải cho output hợp lệ với mọi days_per_week, và nhường LLM khi không chắc."""
+
+    def _profile(self, goal_text, days):
+        days_of_week = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+        return {
+            "goal_text": goal_text,
+            "days_per_week": days,
+            "session_minutes": 60,
+            "experience": "beginner",
+            "training_days": days_of_week[:days],
+        }
+
+    def test_common_goals_pass_hard_constraints(self):
+        for goal_text, goal_style in (("giảm mỡ bụng", "fat_loss"), ("build muscle", "hypertrophy"), ("tang co nguc", "hypertrophy")):
+            for days in range(1, 8):
+                result = match_intent_rules(self._profile(goal_text, days))
+                self.assertTrue(result.accepted, (goal_text, days, result.reason))
+                goal = result.internal_goal
+                self.assertEqual(goal["goal_style"], goal_style)
+                self.assertEqual(validate_intent_internal_goal(goal, days_per_week=days), [])
+                self.assertEqual(check_split_constraints(goal["weekly_focus_by_day"], days, "beginner"), [])
+
+    def test_muscles_match_accented_words_only(self):
+        # Bỏ dấu thì "mong muốn" -> mông, "vài" -> vai: nhóm cơ phải so theo token có dấu
+        goal = match_intent_rules(self._profile("mong muốn giảm mỡ bụng", 3)).internal_goal
+        self.assertEqual(goal["priority_muscles"], ["core"])
+
+        result = match_intent_rules(self._profile("tập vài buổi để giảm mỡ", 3))
+        self.assertTrue(result.accepted, result.reason)
+        self.assertNotIn("shoulders", result.internal_goal["priority_muscles"])
+
+        # Input không dấu vẫn khớp theo dạng bỏ dấu
+        self.assertEqual(match_intent_rules(self._profile("tang co mong", 3)).internal_goal["priority_muscles"], ["hips"])
+        self.assertEqual(match_intent_rules(self._profile("mong muon giam mo bung", 3)).internal_goal["priority_muscles"], ["core"])
+
+    def test_falls_back_to_llm_when_unsure(self):
+        for goal_text in ("muốn có body đẹp như idol", "giảm mỡ nhưng đau gối", ""):
+            self.assertFalse(match_intent_rules(self._profile(goal_text, 3)).accepted, goal_text)
+
+
+class TemplatePlanTests(SimpleTestCase):
+    muscles = ["chest", "back", "quadriceps", "shoulders", "triceps", "biceps", "hamstrings", "hips", "calves", "core"]
+
+    def test_template_plan_passes_evaluation_without_weekly_repeats(self):
+        candidates = [
+            {"id": i, "title": f"Exercise {i}", "muscle_groups": [self.muscles[i % 10], self.muscles[(i * 3) % 10]]}
+            for i in range(1, 41)
+        ]
+        profile = {
+            "goal_text": "giảm mỡ bụng",
+            "days_per_week": 3,
+            "session_minutes": 45,
+            "experience": "beginner",
+            "training_days": ["mon", "wed", "fri"],
+        }
+        profile["internal_goal"] = match_intent_rules(profile).internal_goal
+        constraints = {"max_exercises_per_day": 6}
+
+        plan = generate_template_plan(profile, constraints, candidates)
+
+        self.assertEqual([d["day"] for d in plan["days"]], ["mon", "wed", "fri"])
+        ids = [ex["exercise_id"] for d in plan["days"] for ex in d["exercises"]]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(evaluate_plan(plan, candidates, profile, constraints)["issues"], [])
+
+
+class PlanRepairTests(SimpleTestCase):
+    def test_repair_fixes_mechanical_issues_without_llm(self):
+        muscles = TemplatePlanTests.muscles
+        candidates = [
+            {"id": i, "title": f"Exercise {i}", "muscle_groups": [muscles[i % 10]]}
+            for i in range(1, 41)
+        ]
+        profile = {"goal_text": "tăng cơ", "days_per_week": 2, "session_minutes": 60, "training_days": ["mon", "thu"]}
+        constraints = {"max_exercises_per_day": 4, "min_exercises_per_day": 3}
+
+        def ex(eid):
+            return {"exercise_id": eid, "sets": 3, "reps": "8-12", "rest_sec": 60, "notes": ""}
+
+        draft = {
+            "goal": "tăng cơ",
+            "days_per_week": 2,
+            "session_minutes": 60,
+            "split": "upper/lower",
+            "days": [
+                {"day": "mon", "exercises": [ex(1), ex(999), ex(2), ex(3), ex(4), ex(5)]},
+                {"day": "thu", "exercises": [ex(7)]},
+            ],
+        }
+        self.assertNotEqual(evaluate_plan(draft, candidates, profile, constraints)["issues"], [])
+
+        repaired, actions = repair_plan(draft, candidates, profile, constraints)
+
+        self.assertTrue(actions)
+        self.assertEqual(evaluate_plan(repaired, candidates, profile, constraints)["issues"], [])
+
+    def test_week_repeats_count_each_day_once(self):
+        candidates = [{"id": i, "title": f"Exercise {i}", "muscle_groups": ["chest"]} for i in range(1, 11)]
+        profile = {"goal_text": "tăng cơ", "days_per_week": 2, "session_minutes": 60, "training_days": ["mon", "thu"]}
+        constraints = {"max_repeat_same_exercise_per_week": 1}
+        ex = {"exercise_id": 1, "sets": 3, "reps": "8-12", "rest_sec": 60, "notes": ""}
+        draft = {
+            "goal": "tăng cơ",
+            "days_per_week": 2,
+            "session_minutes": 60,
+            "split": "full body",
+            "days": [{"day": "mon", "exercises": [ex, ex]}, {"day": "thu", "exercises": [ex]}],
+        }
+        self.assertEqual(evaluate_plan(draft, candidates, profile, constraints)["issues"], [])
+
+        repaired, actions = repair_plan(draft, candidates, profile, constraints)
+
+        self.assertEqual(actions, [])
+        self.assertEqual(repaired["days"][1]["exercises"][0]["exercise_id"], 1)
+
+
+class PerDayPlanTests(SimpleTestCase):
+    def test_day_candidate_subsets_are_disjoint(self):
+        muscles = TemplatePlanTests.muscles
+        candidates = [{"id": i, "muscle_groups": [muscles[i % 10]]} for i in range(1, 41)]
+        focus = [["chest", "triceps"], ["back", "biceps"], ["quadriceps", "hips"], ["chest", "shoulders"]]
+
+        subsets = split_candidates_by_day(candidates, focus, min_size=4)
+
+        ids = [c["id"] for subset in subsets for c in subset]
+        self.assertEqual(sorted(ids), list(range(1, 41)))
+        chest_days = [i for i, subset in enumerate(subsets) for c in subset if c["muscle_groups"] == ["chest"]]
+        self.assertEqual(sorted(set(chest_days)), [0, 3])
+
+    def test_evaluation_flags_weekly_repeats(self):
+        candidates = [{"id": i, "title": f"Exercise {i}", "muscle_groups": ["chest"]} for i in range(1, 11)]
+        profile = {"days_per_week": 3, "session_minutes": 60, "training_days": ["mon", "wed", "fri"]}
+        constraints = {"max_repeat_same_exercise_per_week": 1}
+
+        def day(label, ids):
+            return {"day": label, "exercises": [
+                {"exercise_id": eid, "sets": 3, "reps": "8-12", "rest_sec": 60, "notes": ""} for eid in ids
+            ]}
+
+        plan = {"days": [day("mon", [1, 2]), day("wed", [1, 3]), day("fri", [1, 4])]}
+
+        issues = evaluate_plan(plan, candidates, profile, constraints)["issues"]
+
+        self.assertEqual([(i["type"], i["day"]) for i in issues], [("exercise_repeated", "fri")])
+
+
+class DayScopedRegenTests(SimpleTestCase):
+    """Issue gắn với 1 ngày → chỉ sinh lại ngày đó, các ngày khác giữ nguyên từng byte."""
+
+    profile = {
+        "goal_text": "tăng cơ", "days_per_week": 3, "session_minutes": 60,
+        "experience": "beginner", "training_days": ["mon", "wed", "fri"],
+    }
+
+    def _plan(self):
+        def day(label, ids):
+            return {"day": label, "exercises": [
+                {"exercise_id": eid, "sets": 3, "reps": "8-12", "rest_sec": 60, "notes": "giữ nguyên"} for eid in ids
+            ]}
+
+        return {
+            "goal": "tăng cơ", "days_per_week": 3, "session_minutes": 60, "split": "push/pull/legs",
+            "days": [day("mon", [1, 2]), day("wed", [1, 3]), day("fri", [4, 5])],
+        }
+
+    def test_issue_day_indexes(self):
+        plan = self._plan()
+        with mock.patch.object(planning, "PLAN_REGEN_SCOPE", "day"):
+            self.assertEqual(planning.issue_day_indexes([{"type": "exercise_repeated", "day": "WED"}], plan), [1])
+            self.assertIsNone(planning.issue_day_indexes([{"type": "too_long", "day": None}], plan))
+            self.assertIsNone(planning.issue_day_indexes([{"type": "x", "day": "wed"}, {"type": "y"}], plan))
+
+    def test_regenerate_keeps_untouched_days_identical(self):
+        muscles = TemplatePlanTests.muscles
+        candidates = [
+            {"id": i, "title": f"Exercise {i}", "muscle_groups": [muscles[i % 10]]} for i in range(1, 41)
+        ]
+        plan = self._plan()
+        issues = [{"type": "exercise_repeated", "day": "wed", "detail": "exercise_id=1"}]
+
+        with mock.patch.object(planning, "get_llm_cache", return_value=NullLLMCache()), llm_call_scope("plan", 0):
+            out = planning.regenerate_days_with_llm(
+                LLMClient(LLMConfig(provider="mock")), self.profile, {"max_exercises_per_day": 4},
+                candidates, plan, issues, [1],
+            )
+
+        for i in (0, 2):
+            self.assertEqual(json.dumps(out["days"][i]), json.dumps(plan["days"][i]))
+        self.assertEqual(out["days"][1]["day"], "wed")
+        self.assertNotEqual(out["days"][1], plan["days"][1])
+
+
+class SpeculativePlanTests(SimpleTestCase):
+    def test_first_clean_plan_wins_and_k_is_capped(self):
+        delays = {0: 0.3, 1: 0.05, 2: 0.1}
+
+        def fake_generate(llm, profile, constraints, candidates, documents=None, variant=0):
+            time.sleep(delays[variant])
+            return {"variant": variant}
+
+        def fake_issues(plan, candidates, profile, constraints):
+            return [] if plan["variant"] == 2 else [{"type": "too_few_exercises"}]
+
+        with mock.patch.object(speculative, "generate_plan_with_llm", fake_generate), \
+                mock.patch.object(speculative, "_plan_issues", fake_issues), \
+                mock.patch.object(speculative, "PLAN_SPECULATIVE_MAX_K", 3):
+            k = speculative.speculative_k(10)
+            result = speculative.generate_plan_speculative(mock.Mock(), {}, {}, [], k=k)
+
+        self.assertEqual(k, 3)
+        self.assertEqual(result.variant, 2)
+        self.assertEqual(result.finished, 2)
+
+
+class RetrievalPrefetchTests(SimpleTestCase):
+    def test_pack_is_cut_from_pool_and_only_missing_slices_are_fetched(self):
+        fetched = []
+
+        def fake_retrieve(q=None, muscles=None, limit=20, use_semantic=True, query_vector=None):
+            m = (muscles or ["all"])[0]
+            fetched.append(m)
+            return [
+                mock.Mock(id=f"{m}-{i}", title=m, muscle_groups=[m], image_url="", image_file="", distance=None)
+                for i in range(limit)
+            ]
+
+        with mock.patch.object(retrieval, "retrieve_exercises", fake_retrieve):
+            pool = retrieval._collect_pool("tăng cơ", use_semantic=False)
+            fetched.clear()
+
+            two = retrieval._pack_context({"goal_text": "tăng cơ", "internal_goal": {"priority_muscles": ["chest", "back"]}})
+            candidates = retrieval._collect_candidates(two, use_semantic=False, pool=pool)
+            self.assertEqual(fetched, [])
+            self.assertEqual(len(candidates), 2 * two["per_muscle"])
+
+            one = retrieval._pack_context({"goal_text": "tăng cơ", "internal_goal": {"priority_muscles": ["core"]}})
+            retrieval._collect_candidates(one, use_semantic=False, pool=pool)
+            self.assertEqual(fetched, ["core"])
+
+    def test_pool_is_ignored_when_pack_queries_by_goal_style(self):
+        queries = []
+
+        def fake_retrieve(q=None, muscles=None, limit=20, use_semantic=True, query_vector=None):
+            queries.append(q)
+            return []
+
+        pool = {"query_base": "tăng cơ", "limit": 20, "slices": {"chest": [], "back": []}, "global": []}
+        profile = {"goal_text": "tăng cơ", "internal_goal": {"goal_style": "hypertrophy", "priority_muscles": ["chest", "back"]}}
+        ctx = retrieval._pack_context(profile)
+        same = retrieval._pack_context({"goal_text": "tăng cơ", "internal_goal": {"priority_muscles": ["chest", "back"]}})
+
+        self.assertIsNone(retrieval._usable_pool(ctx, pool))
+        self.assertIs(retrieval._usable_pool(same, pool), pool)
+        self.assertEqual(retrieval._pack_semantic_queries(ctx, retrieval._usable_pool(ctx, pool))[0], "hypertrophy exercise for chest")
+        self.assertNotEqual(retrieval._candidates_cache_key(same, pool), retrieval._candidates_cache_key(same, None))
+        with mock.patch.object(retrieval, "retrieve_exercises", fake_retrieve):
+            retrieval._collect_candidates(ctx, use_semantic=True, pool=pool)
+        self.assertIn("hypertrophy exercise for chest", queries)
+        self.assertIn("hypertrophy workout exercise", queries)
+
+    def test_sync_prefetch_embeds_pool_queries_in_one_batch(self):
+        seen_vectors = []
+
+        def fake_retrieve(q=None, muscles=None, limit=20, use_semantic=True, query_vector=None):
+            seen_vectors.append(query_vector)
+            return []
+
+        def fake_embed(texts, **kwargs):
+            return {t: [0.1, 0.2] for t in texts}
+
+        index = mock.Mock(dim=2, provider="local", model="local-hash-ngram")
+        with mock.patch.object(retrieval, "retrieve_exercises", fake_retrieve), \
+                mock.patch.object(retrieval, "embed_queries_cached", side_effect=fake_embed) as embed, \
+                mock.patch.object(retrieval, "get_active_embedding_index", return_value=index), \
+                mock.patch.object(retrieval, "connection", mock.Mock(vendor="postgresql")):
+            retrieval.prefetch_candidate_pool({"goal_text": "prefetch batch embed test"})
+
+        embed.assert_called_once()
+        self.assertEqual(len(embed.call_args.args[0]), len(retrieval._pool_queries("prefetch batch embed test")))
+        semantic_calls = [v for v in seen_vectors if v is not None]
+        self.assertEqual(len(semantic_calls), len(retrieval._pool_queries("x")))
+
+    def test_no_prefetch_when_intent_is_cached(self):
+        cache = intent_cache.SemanticIntentCache(threshold=0.9, max_entries=8, ttl_seconds=60)
+        profile = {
+            "goal_text": "muốn có body đẹp như idol", "days_per_week": 3,
+            "training_days": ["mon", "wed", "fri"], "experience": "beginner",
+        }
+        goal = {"goal_style": "hypertrophy", "priority_muscles": ["chest"]}
+
+        similar = {**profile, "goal_text": "muốn có body đẹp giống idol"}
+
+        with mock.patch.object(nodes, "RETRIEVAL_PREFETCH", "on"), \
+                mock.patch.object(planning, "get_semantic_intent_cache", return_value=cache), \
+                mock.patch.object(planning, "get_llm_cache", return_value=NullLLMCache()), \
+                mock.patch.object(intent_cache, "_embed_goal", return_value=np.array([1.0, 0.0])) as embed:
+            self.assertTrue(nodes._should_prefetch({"profile": profile}))
+            cache.put(profile, goal).result()
+            self.assertFalse(nodes._should_prefetch({"profile": profile}))
+            # Gate chỉ tra exact: text gần giống vẫn prefetch, không embed thêm (chỉ 1 lần embed nền của put)
+            self.assertTrue(nodes._should_prefetch({"profile": similar}))
+            self.assertEqual(embed.call_count, 1)
+
+
+class LLMClientReuseTests(SimpleTestCase):
+    """Chat model và structured runnable build 1 lần rồi dùng lại cho các call sau."""
+
+    def _patched(self):
+        build = mock.patch.object(
+            LLMClient, "_build_chat_model", autospec=True, side_effect=LLMClient._build_chat_model,
+        )
+        structured = mock.patch.object(
+            mock_llm.MockChatModel, "with_structured_output", autospec=True,
+            side_effect=mock_llm.MockChatModel.with_structured_output,
+        )
+        return build, structured
+
+    def test_sync_calls_build_chat_model_and_runnable_once(self):
+        llm = LLMClient(LLMConfig(provider="mock"))
+        prompt = _build_intent_prompt(PromptPrefixTests.profile_a)
+        build, structured = self._patched()
+        with build as build_mock, structured as structured_mock:
+            first = llm.generate_structured(prompt, IntentInternalGoal)
+            second = llm.generate_structured(prompt, IntentInternalGoal)
+
+        self.assertEqual(first, second)
+        self.assertEqual(build_mock.call_count, 1)
+        self.assertEqual(structured_mock.call_count, 1)
+
+    def test_async_calls_reuse_per_loop_runnable(self):
+        llm = LLMClient(LLMConfig(provider="mock"))
+        prompt = _build_intent_prompt(PromptPrefixTests.profile_a)
+
+        async def _twice():
+            return [await llm.agenerate_structured(prompt, IntentInternalGoal) for _ in range(2)]
+
+        build, structured = self._patched()
+        with build as build_mock, structured as structured_mock:
+            outs = asyncio.run(_twice())
+
+        self.assertEqual(outs[0], outs[1])
+        self.assertEqual(build_mock.call_count, 1)
+        self.assertEqual(structured_mock.call_count, 1)
+
+
+class AsyncClientPerLoopTests(SimpleTestCase):
+    def test_async_http_client_is_cached_per_event_loop(self):
+        llm = LLMClient(LLMConfig(provider="mock"))
+
+        async def _pair():
+            return llm._get_http_async_client(), llm._get_http_async_client()
+
+        a1, a2 = asyncio.run(_pair())
+        b1, _ = asyncio.run(_pair())
+        self.assertIs(a1, a2)
+        self.assertIsNot(a1, b1)
+
+    def test_aclose_loop_clients_closes_pools_of_current_loop(self):
+        llm = LLMClient(LLMConfig(provider="mock"))
+        variant = llm.with_temperature(0.9)
+
+        async def _request():
+            clients = (llm._get_http_async_client(), variant._get_http_async_client())
+            with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+                embed_client = embedding_service.get_async_client()
+            await llm.aclose_loop_clients()
+            await embedding_service.aclose_async_client()
+            loop = asyncio.get_running_loop()
+            return clients, embed_client, loop in llm._loops, loop in embedding_service._ASYNC_CLIENTS
+
+        (http, variant_http), embed_client, llm_cached, embed_cached = asyncio.run(_request())
+        self.assertTrue(http.is_closed)
+        self.assertTrue(variant_http.is_closed)
+        self.assertTrue(embed_client.is_closed())
+        self.assertFalse(llm_cached)
+        self.assertFalse(embed_cached)
+
+
+class LLMMetricsTests(SimpleTestCase):
+    """Record call LLM theo llm_call_scope, tổng hợp audit theo node và histogram process-local."""
+
+    def test_scope_tags_records_and_resets(self):
+        self.assertIsNone(metrics.current_llm_scope())
+        with llm_call_scope("intent") as outer:
+            with llm_call_scope("plan", iteration=2) as inner:
+                self.assertEqual(metrics.current_llm_scope(), ("plan", 2))
+                metrics.record_llm_call(metrics.new_call_record("WorkoutPlan", "mock", "m"))
+            self.assertEqual(metrics.current_llm_scope(), ("intent", 0))
+            metrics.record_llm_call(metrics.new_call_record("IntentInternalGoal", cache_hit=True))
+        self.assertIsNone(metrics.current_llm_scope())
+
+        self.assertEqual([(c.node, c.iteration, c.schema) for c in inner], [("plan", 2, "WorkoutPlan")])
+        self.assertEqual([(c.node, c.cache_hit) for c in outer], [("intent", True)])
+        self.assertEqual(metrics.new_call_record("X").node, "-")
+
+    def test_summarize_counts_cache_hits_retries_and_errors(self):
+        def rec(node, **kw):
+            return metrics.LLMCallRecord(node=node, iteration=0, schema="S", **kw)
+
+        events = [
+            {"name": "llm_calls", "payload": {"calls": metrics.llm_calls_payload([
+                rec("intent", cache_hit=True),
+                rec("plan", prompt_tokens=100, completion_tokens=40, latency_ms=250.0, retries=2),
+            ])}},
+            {"name": "plan_done", "payload": {"calls": metrics.llm_calls_payload([rec("plan")])}},
+            {"name": "llm_calls", "payload": {"calls": metrics.llm_calls_payload([
+                rec("plan", ok=False, error="boom", retries=1, latency_ms=50.0, salvaged=True),
+            ])}},
+        ]
+
+        summary = metrics.summarize_llm_calls(events)
+
+        self.assertEqual(summary["by_node"]["intent"]["calls"], 1)
+        self.assertEqual(summary["by_node"]["intent"]["cache_hits"], 1)
+        plan = summary["by_node"]["plan"]
+        self.assertEqual(
+            (plan["calls"], plan["cache_hits"], plan["retries"], plan["errors"], plan["salvaged"]), (2, 0, 3, 1, 1),
+        )
+        self.assertEqual((plan["prompt_tokens"], plan["completion_tokens"], plan["latency_ms"]), (100, 40, 300.0))
+        self.assertEqual((summary["total"]["calls"], summary["total"]["cache_hits"]), (3, 1))
+
+    def test_histogram_snapshot_buckets_and_quantiles(self):
+        h = metrics.Histogram((100, 500, 1000))
+        for v in (50, 100, 300, 700, 5000):
+            h.observe(v)
+
+        snap = h.snapshot()
+
+        self.assertEqual(snap["buckets"], {"100": 2, "500": 1, "1000": 1, "+Inf": 1})
+        self.assertEqual((snap["count"], snap["sum"]), (5, 6150.0))
+        self.assertEqual((snap["p50"], snap["p95"]), (500, float("inf")))
+        self.assertIsNone(metrics.Histogram((1,)).quantile(0.5))
+
+    def test_cache_hits_skip_latency_histogram(self):
+        node = "test_metrics_node"
+        record = metrics.LLMCallRecord(node=node, iteration=0, schema="S", latency_ms=120.0, retries=1)
+        metrics.record_llm_call(record)
+        metrics.record_llm_call(metrics.LLMCallRecord(node=node, iteration=0, schema="S", cache_hit=True))
+
+        snap = metrics.get_llm_metrics_snapshot()
+
+        self.assertEqual(snap["counters"]["calls"][node], 2)
+        self.assertEqual(snap["counters"]["cache_hits"][node], 1)
+        self.assertEqual(snap["counters"]["retries"][node], 1)
+        self.assertEqual(snap["histograms"]["latency_ms"][node]["count"], 1)
+
+
+class LLMRoutingTests(SimpleTestCase):
+    def test_routes_prefer_fast_healthy_targets_and_fail_over(self):
+        routes = parse_routes("intent=mock:small;plan=gemini:pro,openai:gpt-4o")
+        self.assertEqual(routes["plan"], [("gemini", "pro"), ("openai", "gpt-4o")])
+
+        router = LLMRouter(routes)
+        targets = router.configured("plan")
+        router.record("plan", ("gemini", "pro"), 900.0, True)
+        router.record("plan", ("openai", "gpt-4o"), 300.0, True)
+        self.assertEqual(router.order("plan", targets)[0], ("openai", "gpt-4o"))
+
+        for _ in range(3):
+            router.record("plan", ("openai", "gpt-4o"), 50.0, False)
+        self.assertEqual(router.order("plan", targets), [("gemini", "pro"), ("openai", "gpt-4o")])
+        self.assertFalse(router.snapshot()["plan"]["openai:gpt-4o"]["healthy"])
+
+
+class HedgingTests(SimpleTestCase):
+    def _seed(self, key, latency_ms):
+        for _ in range(hedging.HEDGE_MIN_SAMPLES):
+            hedging._observe(key, latency_ms)
+
+    def test_slow_call_is_hedged_within_budget(self):
+        def slow():
+            time.sleep(0.5)
+            return "primary"
+
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "_STATS", {}):
+            self._seed("test:slow", 20.0)
+            with hedging.hedge_budget(1) as budget:
+                self.assertEqual(hedging.hedged_call("test:slow", slow, lambda: "hedge"), "hedge")
+                # Hết budget: call chậm chờ call gốc, không bắn thêm
+                self.assertEqual(hedging.hedged_call("test:slow", slow, lambda: "hedge"), "primary")
+            self.assertEqual(budget.used, 1)
+            # Ngoài request: không hedge
+            self.assertEqual(hedging.hedged_call("test:slow", slow, lambda: "hedge"), "primary")
+
+            stats = hedging.get_hedge_snapshot()["test:slow"]
+            self.assertEqual((stats["hedged"], stats["hedge_wins"], stats["budget_denied"]), (1, 1, 1))
+            self.assertEqual(stats["win_rate"], 1.0)
+
+    def test_async_hedge_cancels_loser(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(0.5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "primary"
+
+        async def fast():
+            return "hedge"
+
+        async def run():
+            with hedging.hedge_budget(1):
+                return await hedging.ahedged_call("test:aslow", slow, fast)
+
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "_STATS", {}):
+            self._seed("test:aslow", 20.0)
+            self.assertEqual(asyncio.run(run()), "hedge")
+        self.assertEqual(cancelled, [True])
+
+    def test_saturated_pool_calls_directly(self):
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "HEDGE_MAX_WORKERS", 0), \
+                mock.patch.object(hedging, "_STATS", {}):
+            self._seed("test:full", 20.0)
+            with hedging.hedge_budget(1) as budget:
+                self.assertEqual(hedging.hedged_call("test:full", lambda: "primary", lambda: "hedge"), "primary")
+            self.assertEqual(budget.used, 0)
+            self.assertEqual(hedging.get_hedge_snapshot()["test:full"]["saturated"], 1)
+
+    def test_llm_hedge_records_winner_only_and_stops_loser(self):
+        invoked = []
+        routed = []
+
+        class Target:
+            def __init__(self, name, delay, ok):
+                self.name, self.delay, self.ok = name, delay, ok
+
+            def invoke(self, prompt):
+                invoked.append(self.name)
+                time.sleep(self.delay)
+                if not self.ok:
+                    raise RuntimeError(f"{self.name} failed")
+                return {"winner": self.name}
+
+        llm = LLMClient(LLMConfig(provider="mock", max_retries=3))
+        prepared = [("mock", "slow", Target("slow", 0.3, False)), ("mock", "fast", Target("fast", 0.0, True))]
+        key = f"llm:{IntentInternalGoal.__name__}"
+
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "_STATS", {}), \
+                mock.patch.object(llm, "_prepare_targets", return_value=("plan", prepared)), \
+                mock.patch.object(LLMClient, "_route_record", staticmethod(lambda t, p, m, a0, ok: routed.append((m, ok)))):
+            self._seed(key, 20.0)
+            with hedging.hedge_budget(1), llm_call_scope("plan") as calls:
+                out = llm.generate_structured("prompt", IntentInternalGoal)
+            time.sleep(0.5)  # call gốc chạy nốt attempt đang bay rồi phải dừng
+
+        self.assertEqual(out, {"winner": "fast"})
+        self.assertEqual([(c.model, c.ok, c.retries) for c in calls], [("fast", True, 0)])
+        self.assertEqual(sorted(invoked), ["fast", "slow"])
+        self.assertEqual(sorted(routed), [("fast", True), ("slow", False)])
+
+    def test_failed_calls_are_recorded(self):
+        def boom():
+            raise RuntimeError("down")
+
+        async def aboom():
+            raise RuntimeError("down")
+
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "_STATS", {}):
+            with self.assertRaises(RuntimeError):
+                hedging.hedged_call("test:fail", boom)  # chưa đủ sample → gọi thẳng
+            self._seed("test:fail", 20.0)
+            with hedging.hedge_budget(1), self.assertRaises(RuntimeError):
+                hedging.hedged_call("test:fail", boom)
+            with self.assertRaises(RuntimeError):
+                asyncio.run(hedging.ahedged_call("test:fail", aboom))
+
+            self.assertEqual(hedging.get_hedge_snapshot()["test:fail"]["calls"], hedging.HEDGE_MIN_SAMPLES + 3)
+
+    def test_embed_is_not_hedged_while_waiting_retry_after(self):
+        calls = []
+
+        def provider(texts, model, output_dim, max_retries, control=None):
+            calls.append(len(calls))
+            if len(calls) == 1:
+                control.sleep(0.2, rate_limited=True)
+            return [[1.0]]
+
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "_STATS", {}), \
+                mock.patch.dict(embedding_service._PROVIDERS, {"test-hedge": provider}):
+            self._seed("embed:test-hedge", 20.0)
+            with hedging.hedge_budget(1) as budget:
+                out = embedding_service.embed_texts(["x"], "RETRIEVAL_QUERY", output_dim=1, provider="test-hedge")
+
+        self.assertEqual(out, [[1.0]])
+        self.assertEqual(calls, [0])
+        self.assertEqual(budget.used, 0)
+
+    def test_embed_hedge_loser_stops_before_next_attempt(self):
+        created = []
+
+        def create(**kwargs):
+            created.append(kwargs["input"])
+            if len(created) == 1:
+                time.sleep(0.2)
+                raise RuntimeError("slow attempt failed")  # không có stop: backoff >= 1s rồi gọi lại
+            return mock.Mock(data=[mock.Mock(embedding=[0.5])])
+
+        client = mock.Mock()
+        client.embeddings.create.side_effect = create
+        with mock.patch.object(hedging, "HEDGE_REQUESTS", "on"), \
+                mock.patch.object(hedging, "HEDGE_MIN_DELAY_MS", 10), \
+                mock.patch.object(hedging, "_STATS", {}), \
+                mock.patch.object(embedding_service, "get_client", return_value=client):
+            self._seed("embed:openai", 20.0)
+            with hedging.hedge_budget(1):
+                out = embedding_service.embed_texts(["x"], "RETRIEVAL_QUERY", output_dim=1, provider="openai")
+            time.sleep(0.4)
+
+        self.assertEqual(out, [[0.5]])
+        self.assertEqual(len(created), 2)
+        self.assertEqual(hedging._IN_FLIGHT, 0)  # bản gốc đã thoát khỏi backoff, trả worker
+
+
+class LLMSalvageTests(SimpleTestCase):
+    def test_salvages_common_output_mistakes(self):
+        raw = """Đây là kết quả:
+```json
+{"goal_style": "Hypertrophy", "priority_muscles": ["Glutes", "chest"], "confidence": 0.9,
+ "training_days": ["Mon"],
+ "weekly_focus_by_day": [{"training_day": "mon", "focus": [{"muscle": "glutes", "rank": 1, "why": "x"}]}]}
+```
+Chúc bạn tập tốt!"""
+        goal = salvage_structured(raw, IntentInternalGoal)
+        self.assertIsNotNone(goal)
+        self.assertEqual(goal.goal_style.value, "hypertrophy")
+        self.assertEqual([m.value for m in goal.priority_muscles], ["hips", "chest"])
+        self.assertEqual(goal.weekly_focus_by_day[0].focus[0].muscle, "hips")
+        self.assertIsNone(salvage_structured("không có JSON", IntentInternalGoal))
+
+    def test_malformed_output_does_not_cost_a_retry(self):
+        llm = LLMClient(LLMConfig(provider="mock"))
+        prompt = "Input profile:\n{\"goal_text\": \"tăng cơ\", \"days_per_week\": 3}\ndays_per_week: 3"
+        with mock.patch.object(mock_llm, "MOCK_LLM_MALFORMED_RATE", 1.0), llm_call_scope("intent") as calls:
+            out = llm.generate_structured(prompt, IntentInternalGoal)
+        self.assertEqual(out["goal_style"], "hypertrophy")
+        self.assertEqual((calls[0].retries, calls[0].salvaged), (0, True))
+
+
+class SemanticIntentCacheTests(SimpleTestCase):
+    def test_paraphrased_goal_reuses_intent_for_same_structure(self):
+        vectors = {
+            "giảm mỡ bụng": [1.0, 0.0, 0.0],
+            "đốt mỡ vùng bụng": [0.96, 0.28, 0.0],
+            "tăng cơ ngực": [0.0, 0.0, 1.0],
+        }
+        embedded = []
+
+        def fake_embed(text):
+            embedded.append(text)
+            vec = np.asarray(vectors[text], dtype=np.float32)
+            return vec / np.linalg.norm(vec)
+
+        base = {"days_per_week": 3, "training_days": ["mon", "wed", "fri"], "experience": "beginner"}
+        goal = {"goal_style": "fat_loss", "priority_muscles": ["core"], "training_days": ["mon", "wed", "fri"]}
+        cache = intent_cache.SemanticIntentCache(threshold=0.92, max_entries=2, ttl_seconds=60)
+        with mock.patch.object(intent_cache, "_embed_goal", fake_embed):
+            pending = cache.put({**base, "goal_text": "Muốn giảm mỡ bụng!", "user_id": 1, "weight": 80}, goal)
+
+            # Trùng sau normalize: hit ngay, không cần embedding (embedding của entry chạy nền)
+            pending.result()
+            embedded.clear()
+            hit, sim = cache.get({**base, "goal_text": "giảm mỡ bụng", "user_id": 2, "weight": 60})
+            self.assertEqual((hit["goal_style"], sim, embedded), ("fat_loss", 1.0, []))
+
+            self.assertEqual(cache.get({**base, "goal_text": "đốt mỡ vùng bụng"})[0], goal)
+            self.assertIsNone(cache.get({**base, "goal_text": "tăng cơ ngực"}))
+            self.assertIsNone(cache.get({**base, "goal_text": "giảm mỡ bụng", "days_per_week": 4}))
+            self.assertIsNone(cache.get({**base, "goal_text": "giảm mỡ bụng nhưng đau lưng"}))
+
+            # LRU giới hạn số entry
+            cache.put({**base, "goal_text": "tăng cơ ngực"}, {**goal, "goal_style": "hypertrophy"})
+            cache.put({**base, "goal_text": "đốt mỡ vùng bụng", "experience": "advanced"}, goal).result()
+            self.assertEqual(len(cache._entries), 2)
+
+    def test_different_muscles_never_share_intent(self):
+        # Embedding thô coi 2 câu gần như trùng nhau; tập nhóm cơ trong struct key vẫn tách chúng
+        def fake_embed(text):
+            return np.asarray([1.0, 0.0], dtype=np.float32)
+
+        base = {"days_per_week": 3, "training_days": ["mon", "wed", "fri"], "experience": "beginner"}
+        cache = intent_cache.SemanticIntentCache(threshold=0.9, max_entries=8, ttl_seconds=60)
+        with mock.patch.object(intent_cache, "_embed_goal", fake_embed):
+            cache.put({**base, "goal_text": "tăng cơ ngực"}, {"goal_style": "hypertrophy", "priority_muscles": ["chest"]}).result()
+
+            self.assertIsNone(cache.get({**base, "goal_text": "tăng cơ lưng"}))
+            self.assertEqual(cache.get({**base, "goal_text": "muốn tăng cơ ngực to"})[0]["priority_muscles"], ["chest"])
@@ -1,9 +1,27 @@
 from django.urls import path
-from .views import ExerciseListView, ExerciseSearchView, WorkoutPlanGenerateAgentView
+from .views import (
+    ExerciseListView,
+    ExerciseSearchView,
+    LLMMetricsView,
+    WorkoutPlanGenerateAgentAsyncView,
+    WorkoutPlanGenerateAgentStreamView,
+    WorkoutPlanGenerateAgentView,
+)
 
 urlpatterns = [
     path("exercises/", ExerciseListView.as_view(), name="exercise-list"),
     path("exercises/search/", ExerciseSearchView.as_view(), name="exercise-search"),
     path("plan/generate-agent/", WorkoutPlanGenerateAgentView.as_view(), name="workout-plan-generate-agent"),
+    path(
+        "plan/generate-agent/async/",
+        WorkoutPlanGenerateAgentAsyncView.as_view(),
+        name="workout-plan-generate-agent-async",
+    ),
+    path(
+        "plan/generate-agent/stream/",
+        WorkoutPlanGenerateAgentStreamView.as_view(),
+        name="workout-plan-generate-agent-stream",
+    ),
+    path("llm/metrics/", LLMMetricsView.as_view(), name="llm-metrics"),
 
 ]
@@ -1,4 +1,15 @@
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -9,7 +20,14 @@ from .serializers import ExerciseSerializer
 from .services.retriever import retrieve_exercises
 
 from backend.serializers_plan import WorkoutPlanGenerateSerializer
-from backend.domains.workout import run_workout_planning_pipeline
+from backend.domains.workout import (
+    arun_workout_planning_pipeline,
+    run_workout_planning_pipeline,
+    stream_workout_planning_pipeline,
+)
+from backend.shared.hedging import get_hedge_snapshot
+from backend.shared.llm.metrics import get_llm_metrics_snapshot
+from backend.shared.llm.routing import get_llm_router
 
 
 class ExerciseListView(generics.ListAPIView):
@@ -66,3 +84,115 @@ class WorkoutPlanGenerateAgentView(APIView):
             "issues": result.issues,
             "audit": result.audit,
         }, status=status.HTTP_200_OK)
+
+
+class LLMMetricsView(APIView):
+    """
+    Histogram latency/token + counter (calls, cache_hits, retries, errors) theo node, trong process hiện tại;
+    routes: latency/error rate/health theo task + target của LLM_ROUTES;
+    hedging: ngưỡng p90, số bản sao đã bắn và tỉ lệ bản sao thắng theo key (llm:<schema>, embed:<provider>).
+    Chỉ staff xem được (lộ tên model/provider và lưu lượng).
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            **get_llm_metrics_snapshot(),
+            "routes": get_llm_router().snapshot(),
+            "hedging": get_hedge_snapshot(),
+        })
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, cls=DjangoJSONEncoder)}\n\n"
+
+
+class WorkoutPlanGenerateAgentStreamView(APIView):
+    """
+    Server-Sent Events cho pipeline:
+      event: node   -> mỗi node của graph chạy xong (kèm audit event)
+      event: day    -> từng DayPlan (đã enrich) ngay khi LLM sinh xong ngày đó
+      event: result -> payload giống WorkoutPlanGenerateAgentView
+      event: error  -> pipeline lỗi giữa chừng
+    """
+
+    def post(self, request):
+        ser = WorkoutPlanGenerateSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+
+        raw_input = dict(ser.validated_data)
+
+        user = getattr(request, "user", None)
+        if user is not None and getattr(user, "is_authenticated", False):
+            raw_input["user_id"] = getattr(user, "id", None)
+
+        def events():
+            try:
+                for ev in stream_workout_planning_pipeline(raw_input):
+                    if ev.get("type") == "result":
+                        result = ev["result"]
+                        yield _sse("result", {
+                            "request_id": result.request_id,
+                            "plan": result.final_plan,
+                            "warnings": result.warnings,
+                            "issues": result.issues,
+                            "audit": result.audit,
+                        })
+                    else:
+                        yield _sse(ev.get("type") or "message", ev)
+            except Exception as e:
+                print(f"[STREAM] pipeline error: {e}")
+                yield _sse("error", {"detail": str(e)})
+
+        response = StreamingHttpResponse(events(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # tắt buffering của nginx
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class WorkoutPlanGenerateAgentAsyncView(View):
+    """
+    Bản async của WorkoutPlanGenerateAgentView (chạy dưới ASGI).
+    DRF APIView chưa hỗ trợ async handler nên dùng Django View thuần,
+    vẫn validate bằng WorkoutPlanGenerateSerializer. Response giữ nguyên format.
+    CSRF giống APIView: anonymous không cần token, user đăng nhập bằng session thì bắt buộc
+    (csrf_exempt chỉ để tắt middleware, check lại bằng SessionAuthentication.enforce_csrf).
+    """
+
+    async def post(self, request):
+        user = await request.auser()
+        authenticated = user is not None and getattr(user, "is_authenticated", False)
+        if authenticated:
+            try:
+                SessionAuthentication().enforce_csrf(request)
+            except PermissionDenied as e:
+                return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"detail": "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST)
+
+        ser = WorkoutPlanGenerateSerializer(data=data)
+        if not ser.is_valid():
+            return JsonResponse(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        raw_input = dict(ser.validated_data)
+
+        if authenticated:
+            raw_input["user_id"] = getattr(user, "id", None)
+
+        # Dưới WSGI event loop chỉ sống trong request này -> đóng AsyncClient của loop trước khi trả response
+        result = await arun_workout_planning_pipeline(
+            raw_input, close_loop_clients=not isinstance(request, ASGIRequest),
+        )
+
+        return JsonResponse({
+            "request_id": result.request_id,
+            "plan": result.final_plan,
+            "warnings": result.warnings,
+            "issues": result.issues,
+            "audit": result.audit,
+        }, status=status.HTTP_200_OK)
@@ -14,3 +14,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# plan/generate-agent/async/ chỉ thực sự non-blocking khi chạy qua ASGI server (uvicorn/daphne);
+# dưới WSGI, Django sẽ chạy view async trong event loop riêng mỗi request (view tự đóng AsyncClient
+# của loop đó sau mỗi request, xem arun_workout_planning_pipeline(close_loop_clients=...)).
+
+# Load query vectors precompute (goal_style × muscle) vào memory ngay khi start worker
+from backend.services.query_vectors import preload_query_vectors  # noqa: E402
+
+preload_query_vectors()
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Load query vectors precompute (goal_style × muscle) vào memory ngay khi start worker
+from backend.services.query_vectors import preload_query_vectors  # noqa: E402
+
+preload_query_vectors()